@@ -17,33 +17,43 @@ import micasense.imageutils as imageutils
 
 DEBUG = True
 
-def getAlignment(imageToGetAlignmentRoot, panelRoot):
+def getAlignment(captureFiles, panelRoot, samples=5, candidates=50):
+    '''align the flight from the most textured of a sample of its captures; captureFiles is a
+       {(folder, capture number): {band number: path}} dictionary of the flight captures'''
     import micasense.capture as capture
     # Alignment
-    imageNames = glob.glob(imageToGetAlignmentRoot)
     panelNames = glob.glob(panelRoot)
 
     panelCap = capture.Capture.from_filelist(panelNames) 
-    imgCap = capture.Capture.from_filelist(imageNames)
     panel_reflectance_by_band = [0.67, 0.69, 0.68, 0.61, 0.67] #RedEdge band_index order
     panel_irradiance = panelCap.panel_irradiance(panel_reflectance_by_band)
     # capture.plot_undistorted_reflectance(panel_irradiance)
-    imgCap.compute_reflectance(panel_irradiance)
+
+    # only read the metadata of the captures scored for texture, with one exiftool process
+    keys = list(captureFiles.keys())
+    keys = [keys[int(i)] for i in np.unique(np.linspace(0, len(keys) - 1, min(candidates, len(keys))).round())]
+    flightSet = imageset.ImageSet([capture.Capture.from_band_files(captureFiles[key]) for key in keys], sort=False)
+    flightSet.load_metadata()
+    # panel and takeoff captures are close to the ground, where the band parallax is large
+    flightCaptures = flightSet.partition()['flight']
 
     ## Increase max_iterations to 1000+ for better results, but much longer runtimes, but start with 100 for speed
-    warp_matrices, alignment_pairs = imageutils.align_capture(imgCap, ref_index=3)#, max_iterations=10)
+    warp_matrices, alignment = imageutils.align_flight(flightCaptures, samples=samples, candidates=candidates, ref_index=3)#, max_iterations=10)
+    for cap, score in zip(alignment['captures'], alignment['scores']):
+        print("aligned " + cap.images[0].path + " texture score %.4f" % score)
+    print("warp residuals (px):\n", alignment['residuals'])
+    alignment_pairs = alignment['alignment_pairs'][0]
     
     return warp_matrices, alignment_pairs, panel_irradiance
 
-def main(imagePath, warp_matrices, alignment_pairs, panel_irradiance):
+def main(imagePath, captureFiles, warp_matrices, alignment_pairs, panel_irradiance):
+    '''captureFiles is a {capture number: {band number: path}} dictionary of the captures in imagePath'''
     import micasense.capture as capture
     
-    for i in range(0,201):
-            imageRoot = "IMG_%04i" % i
+    for number, band_paths in captureFiles.items():
+            imageRoot = "IMG_%04i" % number
             outputRoot = imagePath.replace('Imagery\\','').replace('\\','_') + imageRoot
-            imageSet = os.path.join(imagePath,imageRoot+'_*.tif')re
-            imageNames = glob.glob(imageSet)
-            if not len(imageNames): continue #skip
+            imageNames = [band_paths[band] for band in sorted(band_paths)]
         # try:
             imgCap = capture.Capture.from_filelist(imageNames)
             imgCap.compute_reflectance(panel_irradiance)
@@ -90,17 +100,21 @@ def main(imagePath, warp_matrices, alignment_pairs, panel_irradiance):
 
             outRaster = None
             im_aligned = None
-            print ("processed " + imageSet)
+            print ("processed " + os.path.join(imagePath,imageRoot))
         # except Exception as err:
-            # print("Could not process: " + imageSet)
+            # print("Could not process: " + os.path.join(imagePath,imageRoot))
             # print(err)
 
 if __name__ == '__main__':
     multiprocessing.set_start_method('spawn') 
-    warp_matrices, alignment_pairs, panel_irradiance = getAlignment(r'.\Imagery\0001SET\000\IMG_0042_*.tif', r'.\Imagery\0001SET\000\IMG_0000_*.tif')
-    for set in range(100):
-        for sub in range(100):
-            for typ in ['SET', 'DUP']:
-                imageryPath = 'Imagery\\%04i%s\\%03i' % (set, typ, sub)
-                if os.path.exists(imageryPath):
-                    main(os.path.join('.','Imagery','0001SET','000'), warp_matrices, alignment_pairs, panel_irradiance)
+    captureFiles = imageset.find_capture_files('Imagery')
+    for folder, number in imageset.incomplete_captures(captureFiles):
+        print("skipping incomplete capture " + os.path.join('Imagery', folder, "IMG_%04i" % number))
+        del captureFiles[(folder, number)]
+    warp_matrices, alignment_pairs, panel_irradiance = getAlignment(captureFiles, r'.\Imagery\0001SET\000\IMG_0000_*.tif')
+    folders = {}
+    for (folder, number), band_paths in captureFiles.items():
+        folders.setdefault(folder, {})[number] = band_paths
+    for folder in folders:
+        main(os.path.join('Imagery', folder), folders[folder], warp_matrices, alignment_pairs, panel_irradiance)
+
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Benchmark harness and synthetic captures
+
+    Run with: python -m pytest benchmarks [--save-baselines] [--regression-tolerance 0.25]
+    Each benchmark records the median time of a few rounds and the Python heap peak
+    (traced by tracemalloc, so without OpenCV's allocations) of one more round, and
+    fails if either regresses past the baseline
+
+Copyright 2019 MicaSense, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in the
+Software without restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import json
+import os
+import platform
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+import pytest
+
+import micasense.capture as capture
+import micasense.synthetic as synthetic
+
+BASELINES_PATH = os.path.join(os.path.dirname(__file__), 'baselines.json')
+RESULTS = {}
+
+def pytest_addoption(parser):
+    group = parser.getgroup('micasense benchmarks')
+    group.addoption('--save-baselines', action='store_true', default=False,
+                    help='store the benchmark results as the new baselines')
+    group.addoption('--baselines', default=BASELINES_PATH,
+                    help='path of the baselines json file')
+    group.addoption('--regression-tolerance', type=float, default=0.25,
+                    help='allowed fractional slowdown or memory growth over the baselines')
+    group.addoption('--benchmark-results', default=None,
+                    help='write the benchmark results to this json file')
+
+def _load_baselines(config):
+    path = config.getoption('baselines')
+    if config.getoption('save_baselines') or not os.path.isfile(path):
+        return {}
+    with open(path) as baselines_file:
+        return json.load(baselines_file).get('benchmarks', {})
+
+@pytest.fixture(scope='session')
+def baselines(request):
+    return _load_baselines(request.config)
+
+@pytest.fixture()
+def measure(request, baselines):
+    ''' Time func over a few rounds, calling setup (untimed) before each, then measure
+        the Python heap peak of one more round. NumPy arrays are traced, but memory
+        allocated inside OpenCV is not '''
+    tolerance = request.config.getoption('regression_tolerance')
+
+    def run(func, setup=None, rounds=3):
+        times = []
+        for _ in range(rounds):
+            if setup is not None:
+                setup()
+            start = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - start)
+        if setup is not None:
+            setup()
+        tracemalloc.start()
+        try:
+            func()
+            _, heap_peak_bytes = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        result = {'median_s': float(np.median(times)),
+                  'min_s': float(np.min(times)),
+                  'rounds': rounds,
+                  'python_heap_peak_bytes': int(heap_peak_bytes)}
+        RESULTS[request.node.name] = result
+
+        baseline = baselines.get(request.node.name)
+        if baseline is not None:
+            assert result['median_s'] <= baseline['median_s'] * (1 + tolerance), \
+                "{:.4f}s is slower than the {:.4f}s baseline".format(result['median_s'], baseline['median_s'])
+            if 'python_heap_peak_bytes' in baseline:
+                assert result['python_heap_peak_bytes'] <= baseline['python_heap_peak_bytes'] * (1 + tolerance), \
+                    "{} Python heap peak bytes is more than the {} baseline".format(
+                        result['python_heap_peak_bytes'], baseline['python_heap_peak_bytes'])
+        return result
+    return run
+
+def pytest_terminal_summary(terminalreporter):
+    if not RESULTS:
+        return
+    terminalreporter.write_sep('-', 'benchmarks (median time, Python heap peak)')
+    width = max(len(name) for name in RESULTS)
+    for name in sorted(RESULTS):
+        result = RESULTS[name]
+        terminalreporter.write_line('{}  {:10.4f} s  {:10.1f} MB'.format(
+            name.ljust(width), result['median_s'], result['python_heap_peak_bytes'] / 2.0**20))
+
+def pytest_sessionfinish(session):
+    if not RESULTS:
+        return
+    report = {'machine': {'platform': platform.platform(),
+                          'processor': platform.processor(),
+                          'python': platform.python_version(),
+                          'numpy': np.__version__,
+                          'opencv': cv2.__version__},
+              'benchmarks': RESULTS}
+    paths = []
+    if session.config.getoption('save_baselines'):
+        paths.append(session.config.getoption('baselines'))
+    if session.config.getoption('benchmark_results') is not None:
+        paths.append(session.config.getoption('benchmark_results'))
+    for path in paths:
+        with open(path, 'w') as results_file:
+            json.dump(report, results_file, indent=2, sort_keys=True)
+
+# Synthetic captures are full-size frames from micasense.synthetic, with the rig offsets
+# between bands, so alignment has texture to match
+@pytest.fixture(scope='session')
+def ground_texture():
+    return synthetic.ground_texture()
+
+@pytest.fixture(params=sorted(synthetic.CAMERAS))
+def synthetic_capture(request, tmpdir, ground_texture):
+    return capture.Capture(synthetic.write_capture(str(tmpdir), request.param, texture=ground_texture))
+
+@pytest.fixture(params=sorted(synthetic.CAMERAS))
+def panel_capture(request, tmpdir, ground_texture):
+    entry = synthetic.flight_plan(2, panel_captures=1)[0]
+    return capture.Capture(synthetic.write_capture(str(tmpdir), request.param, entry=entry,
+                                                   texture=ground_texture))
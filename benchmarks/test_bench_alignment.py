@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Benchmarks of band alignment
+
+Copyright 2019 MicaSense, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in the
+Software without restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import cv2
+import pytest
+
+import micasense.imageutils as imageutils
+
+@pytest.mark.parametrize('texture_coverage', [None, 0.5])
+def test_align_capture(synthetic_capture, measure, texture_coverage):
+    synthetic_capture.images[0].radiance()
+    measure(lambda: imageutils.align_capture(synthetic_capture,
+                                             ref_index=1,
+                                             max_iterations=50,
+                                             epsilon_threshold=1e-6,
+                                             multithreaded=False,
+                                             pyramid_levels=2,
+                                             texture_coverage=texture_coverage),
+            rounds=1)
+
+def test_find_crop_bounds(synthetic_capture, measure):
+    warp_matrices = synthetic_capture.get_warp_matrices()
+    measure(lambda: imageutils.find_crop_bounds(synthetic_capture, warp_matrices))
+
+def test_aligned_capture(synthetic_capture, measure):
+    warp_matrices = synthetic_capture.get_warp_matrices()
+    cropped_dimensions, _ = imageutils.find_crop_bounds(synthetic_capture, warp_matrices)
+    synthetic_capture.compute_undistorted_radiance()
+    measure(lambda: imageutils.aligned_capture(synthetic_capture,
+                                               warp_matrices,
+                                               cv2.MOTION_HOMOGRAPHY,
+                                               cropped_dimensions,
+                                               None,
+                                               img_type='radiance'))
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Benchmarks of capture exports and image set loading
+
+Copyright 2019 MicaSense, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in the
+Software without restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import os
+import shutil
+import pytest
+
+import micasense.imageset as imageset
+import micasense.synthetic as synthetic
+
+def test_save_capture_as_stack(synthetic_capture, measure, tmpdir):
+    pytest.importorskip('osgeo.gdal')
+    synthetic_capture.create_aligned_capture(img_type='radiance')
+    measure(lambda: synthetic_capture.save_capture_as_stack(str(tmpdir.join('stack.tif'))))
+
+@pytest.fixture()
+def flight_dir(tmpdir, ground_texture):
+    ''' A directory of 50 RedEdge captures and its image set index '''
+    directory = tmpdir.mkdir('0000SET')
+    images = []
+    for capture_index, entry in enumerate(synthetic.flight_plan(50, panel_captures=0)):
+        images.extend(synthetic.write_capture(str(directory), 'rededge', capture_index, entry,
+                                              texture=ground_texture))
+    index = str(tmpdir.join('index.npz'))
+    imageset.write_index(index, images, imageset.scan_directory(str(directory)))
+    return str(directory), index
+
+def test_imageset_from_directory_index(flight_dir, measure):
+    directory, index = flight_dir
+    measure(lambda: imageset.ImageSet.from_directory(directory, index=index))
+
+def test_imageset_from_directory(flight_dir, measure):
+    if shutil.which('exiftool') is None and os.environ.get('exiftoolpath') is None:
+        pytest.skip('exiftool is not installed')
+    directory, _ = flight_dir
+    measure(lambda: imageset.ImageSet.from_directory(directory), rounds=1)
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Benchmarks of Image radiometry and undistortion
+
+Copyright 2019 MicaSense, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in the
+Software without restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import pytest
+
+import micasense.image as image
+import micasense.synthetic as synthetic
+
+def test_radiance(synthetic_capture, measure):
+    img = synthetic_capture.images[0]
+    img.raw()
+    measure(lambda: img.radiance(force_recompute=True))
+
+def test_vignette(synthetic_capture, measure):
+    img = synthetic_capture.images[0]
+    img.raw()
+    measure(img.vignette)
+
+def test_undistorted(synthetic_capture, measure):
+    img = synthetic_capture.images[0]
+    radiance = img.radiance()
+    measure(lambda: img.undistorted(radiance), setup=img.clear_image_data)
+
+def test_compute_into(synthetic_capture, measure):
+    img = synthetic_capture.images[0]
+    img.raw()
+    measure(lambda: img.compute_into(kind='reflectance', irradiance=1.0))
+
+@pytest.mark.parametrize('keep_exif', [True, False])
+def test_load_metadata(synthetic_capture, measure, keep_exif):
+    # the metadata as exiftool reports it, without running exiftool
+    exif = dict((img.path, synthetic.exiftool_metadata(img.calibration, img.record))
+                for img in synthetic_capture.images)
+    class ExifTool(object):
+        def get_metadata(self, path):
+            return dict(exif[path])
+    paths = [img.path for img in synthetic_capture.images] * 20
+    # the peak includes the images held at the end, so it compares the memory kept per image
+    measure(lambda: [image.Image(path, exiftool_obj=ExifTool(), keep_exif=keep_exif) for path in paths])
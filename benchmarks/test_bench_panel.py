@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Benchmarks of panel detection
+
+Copyright 2019 MicaSense, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in the
+Software without restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import micasense.panel as panel
+
+def test_panel_radiance(panel_capture, measure):
+    img = panel_capture.images[0]
+
+    def detect():
+        pnl = panel.Panel(img)
+        assert pnl.panel_detected()
+        pnl.radiance()
+    measure(detect, setup=img.clear_image_data)
+
+def test_capture_panel_irradiance(panel_capture, measure):
+    def detect():
+        panel_capture.panels = None
+        panel_capture.panel_irradiance()
+    measure(detect, setup=panel_capture.clear_image_data, rounds=1)
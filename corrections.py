@@ -7,6 +7,7 @@ import imageio
 import micasense
 import micasense.capture as capture
 import micasense.image as image
+import micasense.imageset as imageset
 import micasense.metadata as metadata
 import micasense.utils as msutils
 import micasense.panel as panel
@@ -22,44 +23,27 @@ def log(message):
     with open(__file__ + ".log", 'a') as logfil:
         logfil.write("%s: %s\n" % (datetime.datetime.now(), message))
     
-def sortImageryByAlt(path, cutoffElev):
-    '''sort imagery into lists of panel images or flight images'''
+def sortImageryByAlt(path, cutoffElev=None):
+    '''sort imagery into lists of panel images or flight images. cutoffElev is the altitude
+       (m MSL) separating them, by default estimated from the capture altitudes'''
     data = {}
-    count = 0
-    for i in range(100):
-        for typ in ['SET', 'DUP']:
-            iset = '%04i%s' % (i, typ)
-            if os.path.exists(os.path.join(path, iset)):
-                for j in range(100):
-                    sub = '%03i' % j
-                    if os.path.exists(os.path.join(path, iset, sub)):
-                        images = []
-                        panels = []
-                        for img in range(2001):
-                            fname = 'IMG_%04i_*.tif' % (img)
-                            found = True
-                            for band in range(1,6):
-                                imageryPath = os.path.join(path, iset, sub, fname.replace("*",str(band)))
-                                if os.path.exists(imageryPath):
-                                    count +=1
-                                else:
-                                    found = False
-                            print (count, imageryPath, "complete:", found)
-                            if found:
-                                meta = metadata.Metadata(imageryPath, exiftoolPath=os.environ['exiftoolpath'])
-                                if meta.position()[2] > cutoffElev:
-                                    images.append(fname)
-                                else:
-                                    panels.append(fname)
-                        for k in [images, panels]:
-                            if k:
-                                if iset not in data: data[iset] = {}
-                                if sub not in data[iset]: data[iset][sub] = {}
-                        if images:
-                            data[iset][sub]['images'] = images
-                        if panels:
-                            data[iset][sub]['panels'] = panels
-                            
+    captureFiles = imageset.find_capture_files(path)
+    incomplete = imageset.incomplete_captures(captureFiles)
+    captures = {}
+    for key, bands in captureFiles.items():
+        if key in incomplete:
+            log("missing bands %s of %s" % (incomplete[key], os.path.join(path, key[0], 'IMG_%04i_*.tif' % key[1])))
+        else:
+            captures[key] = capture.Capture.from_band_files(bands)
+    imgset = imageset.ImageSet(list(captures.values()), sort=False)
+    imgset.load_metadata()
+    parts = imgset.partition(cutoff_altitude=cutoffElev)
+    log("ground altitude %.1f m, cutoff altitude %.1f m" % (parts['ground_altitude'], parts['cutoff_altitude']))
+    flight = set(id(cap) for cap in parts['flight'])
+    for (folder, number), cap in captures.items():
+        iset, sub = os.path.split(folder)
+        kind = 'images' if id(cap) in flight else 'panels'
+        data.setdefault(iset, {}).setdefault(sub, {}).setdefault(kind, []).append('IMG_%04i_*.tif' % (number))
     return data
 
 def printExif(filename, items=None):
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+MicaSense Batched Radiometry
+
+    Radiance of many images of the same band in one vectorized call, over
+    (images, rows, cols) blocks, for flight-wide processing
+
+Copyright 2019 MicaSense, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in the
+Software without restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import numpy as np
+
+import micasense.image as image
+import micasense.instrumentation as instrumentation
+
+def group_by_calibration(images):
+    ''' Group images by their band calibration, which is shared by all images of a camera band.
+        Returns a list of image lists, in order of first appearance '''
+    groups = {}
+    for img in images:
+        groups.setdefault(id(img.calibration), []).append(img)
+    return list(groups.values())
+
+def load_raw_block(images, out=None):
+    ''' Read the raw images of a group into a (images, rows, cols) uint16 block '''
+    width, height = images[0].calibration.image_size
+    if out is None:
+        out = np.empty((len(images), height, width), dtype=np.uint16)
+    for i, img in enumerate(images):
+        out[i] = img.raw()
+    return out
+
+def radiance_block(images, raw=None):
+    '''
+    The float32 (images, rows, cols) radiance of images sharing one band calibration, as
+    computed by Image.radiance. The black level, row gradient, exposure and gain of each image
+    are applied by broadcasting over the block, and the vignette map is shared by all images
+    '''
+    calibration = images[0].calibration
+    if any(img.calibration is not calibration for img in images):
+        raise ValueError("Images in a radiance block must share a band calibration")
+    if raw is None:
+        raw = load_raw_block(images)
+    radiance = np.empty(raw.shape, dtype=np.float32)
+    if calibration.band_name == 'LWIR':
+        # convert to C from centi-K
+        np.subtract(raw, np.float32(273.15*100.0), out=radiance)
+        radiance *= np.float32(0.01)
+        return radiance
+
+    a1, a2, a3 = calibration.radiometric_cal[0], calibration.radiometric_cal[1], calibration.radiometric_cal[2]
+    black_level = np.array([img.black_level for img in images], dtype=np.float32)[:, np.newaxis, np.newaxis]
+    exposure_time = np.array([img.exposure_time for img in images], dtype=float)[:, np.newaxis, np.newaxis]
+    gain = np.array([img.gain for img in images], dtype=float)[:, np.newaxis, np.newaxis]
+    y = np.arange(raw.shape[1], dtype=float)[np.newaxis, :, np.newaxis]
+    # the row gradient, calibration, exposure and gain only depend on the image and the row
+    row_scale = a1 / (float(2**calibration.bits_per_pixel) * gain * exposure_time * (1.0 + a2 * y / exposure_time - a3 * y))
+
+    np.subtract(raw, black_level, out=radiance)
+    radiance *= image.band_vignette(calibration)
+    radiance *= row_scale.astype(np.float32)
+    np.maximum(radiance, 0, out=radiance)
+    return radiance
+
+def iter_radiance_batches(images, batch_size=None):
+    ''' Yield (images, radiance block) pairs for the images grouped by band calibration, with
+        at most batch_size images per block to bound memory use '''
+    for group in group_by_calibration(images):
+        size = len(group) if batch_size is None else batch_size
+        for start in range(0, len(group), size):
+            batch = group[start:start + size]
+            with instrumentation.stage('radiance_batch', batch[0].capture_id) as record:
+                radiance = radiance_block(batch)
+                if record is not None:
+                    record['bytes'] = radiance.nbytes
+            yield batch, radiance
+
+def radiance_batch(images, batch_size=None):
+    ''' The radiance of many images, as a list of (images, float32 (images, rows, cols) radiance)
+        pairs with one pair per band calibration, or per batch_size images of a band '''
+    return list(iter_radiance_batches(images, batch_size))
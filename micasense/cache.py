@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+MicaSense Image Cache
+
+    A memory budget with least-recently-used eviction for the images
+    (raw, radiance, reflectance, ...) cached by Image objects
+
+Copyright 2019 MicaSense, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in the
+Software without restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+from collections import OrderedDict
+import threading
+import weakref
+
+class ImageCache(object):
+    """
+    Tracks the arrays cached by Image objects and evicts the least recently used ones when
+    their total size is over budget_bytes. Evicting calls owner.release_cached(slot), which
+    drops the owner's reference to the array. With no budget nothing is evicted, but the
+    size and counters are still tracked.
+    """
+    def __init__(self, budget_bytes=None):
+        self.budget_bytes = budget_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.__entries = OrderedDict() # (id(owner), slot) -> (weakref to owner, nbytes)
+        self.__slots = {} # id(owner) -> set of the owner's slots in __entries
+        self.__collected = [] # keys of owners garbage collected since the last update
+        self.__lock = threading.Lock()
+
+    def set_budget(self, budget_bytes):
+        ''' Set the budget in bytes, or None for no limit, evicting arrays to fit it '''
+        with self.__lock:
+            self.budget_bytes = budget_bytes
+            victims = self.__over_budget()
+        self.__release(victims)
+
+    def store(self, owner, slot, array, nbytes=None):
+        ''' Record a newly computed (missed) array, evicting others if over budget. nbytes
+            overrides the size of the array, e.g. to include other arrays it keeps alive '''
+        if nbytes is None:
+            nbytes = array.nbytes
+        key = (id(owner), slot)
+        with self.__lock:
+            self.__purge()
+            self.misses += 1
+            if key in self.__entries:
+                self.__remove(key)
+            reference = weakref.ref(owner, lambda ref, key=key: self.__collected.append(key))
+            self.__entries[key] = (reference, nbytes)
+            self.__slots.setdefault(key[0], set()).add(slot)
+            self.nbytes += nbytes
+            victims = self.__over_budget(keep=key)
+        self.__release(victims)
+
+    def touch(self, owner, slot):
+        ''' Record a cache hit, making the array the most recently used '''
+        key = (id(owner), slot)
+        with self.__lock:
+            self.hits += 1
+            if key in self.__entries:
+                self.__entries.move_to_end(key)
+
+    def discard(self, owner, slot=None):
+        ''' Stop tracking an array the owner released itself, or all of its arrays if slot is None '''
+        with self.__lock:
+            slots = self.__slots.get(id(owner), ())
+            if slot is not None:
+                slots = [slot] if slot in slots else []
+            for name in list(slots):
+                self.__remove((id(owner), name))
+
+    def clear(self):
+        ''' Evict all tracked arrays and reset the counters '''
+        with self.__lock:
+            victims = [(reference, key[1]) for key, (reference, _) in self.__entries.items()]
+            self.__entries.clear()
+            self.__slots.clear()
+            self.nbytes = 0
+        self.__release(victims)
+        self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        with self.__lock:
+            self.__purge()
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'entries': len(self.__entries),
+                    'nbytes': self.nbytes,
+                    'budget_bytes': self.budget_bytes}
+
+    def __purge(self):
+        ''' Forget the arrays of garbage collected owners; call with the lock held '''
+        while self.__collected:
+            key = self.__collected.pop()
+            entry = self.__entries.get(key)
+            # the id may already be reused by a new owner
+            if entry is not None and entry[0]() is None:
+                self.__remove(key)
+
+    def __over_budget(self, keep=None):
+        ''' Remove least recently used entries until under budget; call with the lock held '''
+        self.__purge()
+        victims = []
+        if self.budget_bytes is None:
+            return victims
+        while self.nbytes > self.budget_bytes and self.__entries:
+            key = next(iter(self.__entries))
+            if key == keep:
+                # the entry just stored is the most recent, so it is the only one left
+                break
+            reference = self.__remove(key)
+            self.evictions += 1
+            victims.append((reference, key[1]))
+        return victims
+
+    def __remove(self, key):
+        ''' Stop tracking an entry, returning its owner reference; call with the lock held '''
+        reference, nbytes = self.__entries.pop(key)
+        self.nbytes -= nbytes
+        slots = self.__slots[key[0]]
+        slots.discard(key[1])
+        if not slots:
+            del self.__slots[key[0]]
+        return reference
+
+    def __release(self, victims):
+        # outside the lock, as owners discard their other arrays from here
+        for reference, slot in victims:
+            owner = reference()
+            if owner is not None:
+                owner.release_cached(slot)
+
+image_cache = ImageCache()
+
+def set_budget(budget_bytes):
+    ''' Set the memory budget shared by the images cached by all Image objects '''
+    image_cache.set_budget(budget_bytes)
+
+def stats():
+    ''' Hit, miss and eviction counts and the current size of the Image caches '''
+    return image_cache.stats()
@@ -29,13 +29,49 @@ CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
 import micasense.image as image
 import micasense.dls as dls
-import micasense.plotutils as plotutils
 import micasense.imageutils as imageutils
+import micasense.indices as indices
+import micasense.instrumentation as instrumentation
 import math
 import numpy as np
 import cv2
 import os
-import imageio
+import threading
+
+# thread pool shared by all captures to process their bands concurrently, see set_band_threads
+_band_pool = None
+_band_thread_count = 0
+# marks the threads of the band pool, which process any bands of their own serially
+_band_thread = threading.local()
+
+def _mark_band_thread():
+    _band_thread.active = True
+
+def set_band_threads(threads):
+    ''' Process the bands of all captures concurrently on a shared pool of this many threads.
+        The NumPy and OpenCV band computations release the GIL, so a capture takes about as
+        long as its slowest band. 0 or 1 processes bands serially, which is the default '''
+    global _band_pool, _band_thread_count
+    if _band_pool is not None:
+        _band_pool.shutdown(wait=True)
+        _band_pool = None
+        _band_thread_count = 0
+    if threads is not None and threads > 1:
+        import concurrent.futures
+        _band_pool = concurrent.futures.ThreadPoolExecutor(max_workers=threads,
+                                                           thread_name_prefix='micasense-band',
+                                                           initializer=_mark_band_thread)
+        _band_thread_count = threads
+
+def band_threads():
+    ''' The size of the band thread pool, or 0 when bands are processed serially '''
+    return _band_thread_count
+
+def _map_bands(function, *iterables):
+    # a band function which maps bands itself would wait on the pool it is running on
+    if _band_pool is None or getattr(_band_thread, 'active', False):
+        return list(map(function, *iterables))
+    return list(_band_pool.map(function, *iterables))
 
 class Capture(object):
     """
@@ -44,7 +80,10 @@ class Capture(object):
     found in the same folder and also share the same filename prefix, such
     as IMG_0000_*.tif, but this is not required
     """
-    def __init__(self, images, panelCorners=[None]*5):
+    # the capture id of a capture created with verify=False is checked on first access
+    uuid = image.DeferredField('uuid', 'verify')
+
+    def __init__(self, images, panelCorners=[None]*5, verify=True):
         if isinstance(images, image.Image):
             self.images = [images]
         elif isinstance(images, list):
@@ -52,17 +91,25 @@ class Capture(object):
         else:
             raise RuntimeError("Provide an image or list of images to create a Capture")
         self.num_bands = len(self.images)
-        self.images.sort()
-        capture_ids = [img.capture_id for img in self.images]
-        if len(set(capture_ids)) != 1:
-            raise RuntimeError("Images provided are required to all have the same capture id")
-        self.uuid = self.images[0].capture_id
+        if verify:
+            self.verify()
         self.panels = None
         self.detected_panel_count = 0
         self.panelCorners = panelCorners
 
         self.__aligned_capture = None
 
+    def verify(self):
+        ''' Sort the images by band and check they share a capture id. Called automatically for
+            captures created with verify=False the first time the uuid is accessed '''
+        if 'uuid' in self.__dict__:
+            return
+        self.images.sort()
+        capture_ids = [img.capture_id for img in self.images]
+        if len(set(capture_ids)) != 1:
+            raise RuntimeError("Images provided are required to all have the same capture id")
+        self.uuid = self.images[0].capture_id
+
     def set_panelCorners(self,panelCorners):
         self.panelCorners = panelCorners
         self.panels = None
@@ -84,6 +131,14 @@ class Capture(object):
     def from_file(cls, file_name):
         return cls(image.Image(file_name))
 
+    @classmethod
+    def from_band_files(cls, band_files, keep_exif=False, exiftool_path=None):
+        ''' Create a capture from a {band number: path} dictionary, such as the values of
+            imageset.find_capture_files, without reading the files. The image metadata is read
+            when first used, and the capture is verified when its uuid is first used '''
+        return cls([image.Image.deferred(band_files[band], keep_exif, exiftool_path) for band in sorted(band_files)],
+                   verify=False)
+
     @classmethod
     def from_filelist(cls, file_list):
         if len(file_list) == 0:
@@ -109,6 +164,7 @@ class Capture(object):
                 in self.images
             ]
         num_rows = int(math.ceil(float(len(self.images))/float(num_cols)))
+        import micasense.plotutils as plotutils
         if colorbar:
             return plotutils.subplotwithcolorbar(num_rows, num_cols, imgs, titles, figsize)
         else:
@@ -136,7 +192,8 @@ class Capture(object):
            data stored in this class.  Call this after processing-heavy image
            calls to manage program memory footprint.  When processing many images,
            such as iterating over the captures in an ImageSet, it may be necessary
-           to call this after capture is processed'''
+           to call this after capture is processed, or to set a memory budget for
+           all cached image data with micasense.cache.set_budget'''
         for img in self.images:
             img.clear_image_data()
         self.__aligned_capture = None
@@ -192,25 +249,33 @@ class Capture(object):
                     self.undistorted_reflectance(irradiance_list),
                     plot_type='Undistorted Reflectance')
 
+    def map_bands(self, function, *iterables):
+        '''Return [function(img, ...) for each image], computed on the shared band thread pool
+           if set_band_threads has enabled it. Extra iterables are zipped with the images'''
+        return _map_bands(function, self.images, *iterables)
+
     def compute_radiance(self):
-        [img.radiance() for img in self.images]
+        self.map_bands(lambda img: img.radiance())
 
     def compute_undistorted_radiance(self):
-        [img.undistorted_radiance() for img in self.images]
+        self.map_bands(lambda img: img.undistorted_radiance())
 
-    def compute_reflectance(self, irradiance_list=None, force_recompute=True):
-        '''Compute image reflectance from irradiance list, but don't return'''
+    def compute_reflectance(self, irradiance_list=None, force_recompute=True, from_raw=False):
+        '''Compute image reflectance from irradiance list, but don't return.
+           With from_raw, reflectance is computed directly from raw without radiance images'''
         if irradiance_list is not None:
-            [img.reflectance(irradiance_list[i], force_recompute=force_recompute) for i,img in enumerate(self.images)]
+            self.map_bands(lambda img, irradiance: img.reflectance(irradiance, force_recompute=force_recompute, from_raw=from_raw),
+                           [irradiance_list[i] for i in range(len(self.images))])
         else:
-            [img.reflectance(force_recompute=force_recompute) for img in self.images]
+            self.map_bands(lambda img: img.reflectance(force_recompute=force_recompute, from_raw=from_raw))
 
-    def compute_undistorted_reflectance(self, irradiance_list=None, force_recompute=True):
+    def compute_undistorted_reflectance(self, irradiance_list=None, force_recompute=True, from_raw=False):
         '''Compute image reflectance from irradiance list, but don't return'''
         if irradiance_list is not None:
-            [img.undistorted_reflectance(irradiance_list[i], force_recompute=force_recompute) for i,img in enumerate(self.images)]
+            self.map_bands(lambda img, irradiance: img.undistorted_reflectance(irradiance, force_recompute=force_recompute, from_raw=from_raw),
+                           [irradiance_list[i] for i in range(len(self.images))])
         else:
-            [img.undistorted_reflectance(force_recompute=force_recompute) for img in self.images]
+            self.map_bands(lambda img: img.undistorted_reflectance(force_recompute=force_recompute, from_raw=from_raw))
 
 
     def eo_images(self):
@@ -220,14 +285,18 @@ class Capture(object):
 
     def reflectance(self, irradiance_list):
         '''Comptute and return list of reflectance images for given irradiance'''
-        eo_imgs = [img.reflectance(irradiance_list[i]) for i,img in enumerate(self.eo_images())]
-        lw_imgs = [img.reflectance() for i,img in enumerate(self.lw_images())]
+        eo_images = self.eo_images()
+        eo_imgs = _map_bands(lambda img, irradiance: img.reflectance(irradiance),
+                             eo_images, [irradiance_list[i] for i in range(len(eo_images))])
+        lw_imgs = _map_bands(lambda img: img.reflectance(), self.lw_images())
         return eo_imgs + lw_imgs
 
     def undistorted_reflectance(self, irradiance_list):
         '''Comptute and return list of reflectance images for given irradiance'''
-        eo_imgs = [img.undistorted(img.reflectance(irradiance_list[i])) for i,img in enumerate(self.eo_images())]
-        lw_imgs = [img.undistorted(img.reflectance()) for i,img in enumerate(self.lw_images())]
+        eo_images = self.eo_images()
+        eo_imgs = _map_bands(lambda img, irradiance: img.undistorted(img.reflectance(irradiance)),
+                             eo_images, [irradiance_list[i] for i in range(len(eo_images))])
+        lw_imgs = _map_bands(lambda img: img.undistorted(img.reflectance()), self.lw_images())
         return eo_imgs + lw_imgs
 
     def panels_in_all_expected_images(self):
@@ -285,6 +354,7 @@ class Capture(object):
         else:
             return None
 
+    @instrumentation.timed('detect_panels')
     def detect_panels(self):
         from micasense.panel import Panel
         if self.panels is not None and self.detected_panel_count == len(self.images):
@@ -315,7 +385,7 @@ class Capture(object):
     
     def has_rig_relatives(self):
         for img in self.images:
-            if img.meta.rig_relatives() is None:
+            if img.rig_relatives is None:
                 return False
         return True
         
@@ -327,14 +397,25 @@ class Capture(object):
         warp_matrices  =[np.linalg.inv(im.get_homography(ref)) for im in self.images]
         return [w/w[2,2] for w in warp_matrices]
 
-    def create_aligned_capture(self, irradiance_list=None, warp_matrices=None, normalize=False, img_type=None):
+    def alignment_quality(self, warp_matrices=None, ref_index=None, factor=8, **kwargs):
+        ''' Score how well warp_matrices relative to the ref_index band, or the rig relatives if not
+            provided, align the capture; see micasense.imageutils.alignment_quality '''
+        if ref_index is None:
+            ref_index = self.__get_reference_index()
+        if warp_matrices is None:
+            warp_matrices = self.get_warp_matrices(ref_index)
+        return imageutils.alignment_quality(self, warp_matrices, ref_index, factor, **kwargs)
+
+    def create_aligned_capture(self, irradiance_list=None, warp_matrices=None, normalize=False, img_type=None, from_raw=False):
+        ''' Align the undistorted images of the capture. With from_raw, reflectance is computed
+            directly from raw without computing or caching radiance images '''
         if img_type is None and irradiance_list is None and self.dls_irradiance() is None:
             self.compute_undistorted_radiance()
             img_type = 'radiance'
         elif img_type is None:
             if irradiance_list is None:
                 irradiance_list = self.dls_irradiance()+[0]
-            self.compute_undistorted_reflectance(irradiance_list)
+            self.compute_undistorted_reflectance(irradiance_list, from_raw=from_raw)
             img_type = 'reflectance'
         if warp_matrices is None:
             warp_matrices = self.get_warp_matrices()
@@ -347,11 +428,19 @@ class Capture(object):
                                                 img_type=img_type)
         return self.__aligned_capture
 
+    def compute_indices(self, names=('ndvi', 'ndre'), **kwargs):
+        ''' Compute normalized difference indices of the aligned capture; see
+            micasense.indices.normalized_differences for the options '''
+        if self.__aligned_capture is None:
+            raise RuntimeError("call Capture.create_aligned_capture prior to computing indices")
+        return indices.normalized_differences(self.__aligned_capture, self.band_names(), names, **kwargs)
+
     def aligned_shape(self):
         if self.__aligned_capture is None:
             raise RuntimeError("call Capture.create_aligned_capture prior to saving as stack")
         return self.__aligned_capture.shape
 
+    @instrumentation.timed('save_capture_as_stack')
     def save_capture_as_stack(self, outfilename):
         from osgeo.gdal import GetDriverByName, GDT_UInt16
         if self.__aligned_capture is None:
@@ -379,6 +468,7 @@ class Capture(object):
             outband.FlushCache()
         outRaster = None
 
+    @instrumentation.timed('save_capture_as_rgb')
     def save_capture_as_rgb(self, outfilename, gamma=1.4, downsample=1, white_balance='norm', hist_min_percent=0.5, hist_max_percent=99.5, sharpen=True):
         rgb_band_indices = [2,1,0]
         
@@ -411,6 +501,7 @@ class Capture(object):
             unsharp_rgb = rgb
 
         # Apply a gamma correction to make the render appear closer to what our eyes would see
+        import imageio
         if gamma != 0:
             gamma_corr_rgb = unsharp_rgb**(1.0/gamma)
             imageio.imwrite(outfilename, (255*gamma_corr_rgb).astype('uint8'))
@@ -24,30 +24,49 @@ CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
 
 
+import calendar
+import datetime
+import importlib
+import warnings
+from collections import OrderedDict
+
 import numpy as np
+import pytz
 # for DLS correction, we need the sun position at the time the image was taken
 # this can be computed using the pysolar package (ver 0.6)
 # https://pypi.python.org/pypi/Pysolar/0.6
-# we import multiple times with checking here because the case of Pysolar is 
+# we check for both names here because the case of Pysolar is
 # different depending on the python version :(
-import imp
+# pysolar itself is slow to import, so it is only imported on first use by load_pysolar()
 
 havePysolar = False
+pysolar = None
 
 try:
-    import pysolar.solar as pysolar
-    havePysolar = True
-except ImportError:
-    try:
-        import Pysolar.solar as pysolar
-        havePysolar = True
-    except ImportError:
-        import pysolar.solar as pysolar
-        havePysolar = True 
-finally: 
+    from importlib.util import find_spec
+    havePysolar = find_spec('pysolar') is not None or find_spec('Pysolar') is not None
+except ImportError: # python 2.7
+    import imp
+    for _name in ('pysolar', 'Pysolar'):
+        try:
+            imp.find_module(_name)
+            havePysolar = True
+        except ImportError:
+            pass
+finally:
     if not havePysolar:
         print("Unable to import pysolar")
 
+def load_pysolar():
+    ''' import the pysolar solar module on first use '''
+    global pysolar
+    if pysolar is None:
+        try:
+            pysolar = importlib.import_module('pysolar.solar')
+        except ImportError:
+            pysolar = importlib.import_module('Pysolar.solar')
+    return pysolar
+
 def fresnel(phi):
     return __multilayer_transmission(phi, n=[1.000277,1.6,1.38])
 
@@ -111,6 +130,169 @@ def get_orientation(pose, ori):
     n = np.dot(R, ori)
     return n
 
+def datetime_to_seconds(utc_datetime):
+    """Seconds since the unix epoch of a timezone-aware (or naive UTC) datetime"""
+    return calendar.timegm(utc_datetime.utctimetuple()) + utc_datetime.microsecond * 1e-6
+
+def seconds_to_datetime(seconds):
+    """Timezone-aware UTC datetime from seconds since the unix epoch"""
+    return datetime.datetime(1970, 1, 1, tzinfo=pytz.utc) + datetime.timedelta(seconds=seconds)
+
+def sun_altitude_azimuth(latitude, longitude, utc_datetime):
+    """Solar altitude and azimuth (clockwise from north) in degrees using pysolar functions"""
+    pysolar = load_pysolar()
+    with warnings.catch_warnings(): # Ignore pysolar leap seconds offset warning
+        warnings.simplefilter("ignore")
+        try:
+            altitude = pysolar.get_altitude(latitude, longitude, utc_datetime)
+            azimuth = pysolar.get_azimuth(latitude, longitude, utc_datetime)
+        except AttributeError: # catch 0.6 version of pysolar required for python 2.7 support
+            altitude = pysolar.GetAltitude(latitude, longitude, utc_datetime)
+            azimuth = 180-pysolar.GetAzimuth(latitude, longitude, utc_datetime)
+    return altitude, azimuth
+
+class SolarEphemeris(object):
+    """
+    Sun altitude and azimuth sampled on a regular time grid at a single location.
+
+    Only the grid steps bracketing the requested times are computed, so an ephemeris
+    for a day with long gaps between flights stays small.  Positions between grid
+    points are linearly interpolated; over a 60s step the error is far below the
+    accuracy of the DLS angle correction.
+    """
+    def __init__(self, latitude, longitude, utc_times, step_seconds=60.0, tolerance_deg=0.01):
+        self.latitude = latitude
+        self.longitude = longitude
+        self.step_seconds = float(step_seconds)
+        self.tolerance_deg = tolerance_deg
+        self.node_seconds = np.array([])
+        self.altitudes = np.array([])
+        self.azimuths = np.array([])
+        self.extend(utc_times)
+
+    def extend(self, utc_times):
+        ''' Add the grid steps bracketing more times, computing only the new grid points '''
+        seconds = np.array([datetime_to_seconds(t) for t in utc_times])
+        steps = np.unique(np.floor(seconds / self.step_seconds))
+        nodes = np.setdiff1d(np.union1d(steps, steps + 1) * self.step_seconds, self.node_seconds)
+        if len(nodes) == 0:
+            return
+        positions = [sun_altitude_azimuth(self.latitude, self.longitude, seconds_to_datetime(t)) for t in nodes]
+        node_seconds = np.concatenate([self.node_seconds, nodes])
+        altitudes = np.concatenate([self.altitudes, [alt for alt, _ in positions]])
+        azimuths = np.concatenate([self.azimuths % 360.0, [az for _, az in positions]])
+        order = np.argsort(node_seconds)
+        self.node_seconds = node_seconds[order]
+        self.altitudes = altitudes[order]
+        # unwrap so interpolating across north (360 -> 0 degrees) stays continuous
+        self.azimuths = np.degrees(np.unwrap(np.radians(azimuths[order])))
+
+    def covers(self, latitude, longitude):
+        ''' True if a location is close enough to share this ephemeris '''
+        return abs(latitude - self.latitude) <= self.tolerance_deg and \
+               abs(longitude - self.longitude) <= self.tolerance_deg
+
+    def altitude_azimuth(self, seconds):
+        ''' Interpolated (altitude, azimuth) in degrees, or None if the time is not covered '''
+        idx = np.searchsorted(self.node_seconds, seconds, side='right')
+        if idx == 0 or idx == len(self.node_seconds):
+            return None
+        t0, t1 = self.node_seconds[idx-1], self.node_seconds[idx]
+        if t1 - t0 > 1.5 * self.step_seconds: # gap between two groups of times
+            return None
+        frac = (seconds - t0) / (t1 - t0)
+        altitude = self.altitudes[idx-1] + frac * (self.altitudes[idx] - self.altitudes[idx-1])
+        azimuth = self.azimuths[idx-1] + frac * (self.azimuths[idx] - self.azimuths[idx-1])
+        return float(altitude), float(azimuth % 360.0)
+
+class SolarPositionCache(object):
+    """
+    Memoized sun positions shared by all images.
+
+    All of the bands in a capture share the same location and time, so positions are
+    keyed by latitude, longitude and time and computed once per capture. By default the
+    keys are exact, so the positions are those of pysolar. With latlon_decimals and
+    time_resolution_seconds, nearby requests share a position computed at the rounded
+    location and time instead.
+
+    Use add_flight() to precompute an ephemeris for a whole flight, after which each
+    image's solar geometry is a table lookup, interpolated to within about 0.01 degrees.
+    Ephemerides are kept for the max_ephemerides most recently added sites.
+    """
+    def __init__(self, latlon_decimals=None, time_resolution_seconds=None, max_entries=100000, max_ephemerides=256):
+        self.latlon_decimals = latlon_decimals
+        self.time_resolution_seconds = time_resolution_seconds
+        self.max_entries = max_entries
+        self.max_ephemerides = max_ephemerides
+        self.clear()
+
+    def clear(self):
+        self.positions = {}
+        # (tolerance_deg, latitude cell, longitude cell) -> SolarEphemeris
+        self.ephemerides = OrderedDict()
+
+    @staticmethod
+    def __cell(latitude, longitude, tolerance_deg):
+        return (tolerance_deg, int(round(latitude / tolerance_deg)), int(round(longitude / tolerance_deg)))
+
+    def add_flight(self, locations, utc_times, step_seconds=60.0, tolerance_deg=0.01):
+        ''' Precompute ephemerides for (lat, lon, alt) locations and their matching UTC times.
+            Locations are grouped into tolerance_deg cells, so a set spanning several sites
+            gets one ephemeris per site, computed at the mean location of its captures '''
+        cells = {}
+        for location, utc_time in zip(locations, utc_times):
+            if location[0] is None or location[1] is None:
+                continue
+            cell = self.__cell(location[0], location[1], tolerance_deg)
+            cells.setdefault(cell, []).append((location[0], location[1], utc_time))
+        for cell, entries in cells.items():
+            times = [utc_time for _, _, utc_time in entries]
+            ephemeris = self.ephemerides.get(cell)
+            if ephemeris is not None and ephemeris.step_seconds == step_seconds:
+                # only the times not covered yet are computed, e.g. when the same flight is loaded again
+                ephemeris.extend(times)
+                self.ephemerides.move_to_end(cell)
+                continue
+            self.ephemerides[cell] = SolarEphemeris(np.mean([lat for lat, _, _ in entries]),
+                                                    np.mean([lon for _, lon, _ in entries]),
+                                                    times,
+                                                    step_seconds=step_seconds,
+                                                    tolerance_deg=tolerance_deg)
+            while len(self.ephemerides) > self.max_ephemerides:
+                self.ephemerides.popitem(last=False)
+
+    def __ephemeris_position(self, latitude, longitude, seconds):
+        for tolerance_deg in set(cell[0] for cell in self.ephemerides):
+            ephemeris = self.ephemerides.get(self.__cell(latitude, longitude, tolerance_deg))
+            if ephemeris is not None and ephemeris.covers(latitude, longitude):
+                position = ephemeris.altitude_azimuth(seconds)
+                if position is not None:
+                    return position
+        return None
+
+    def altitude_azimuth(self, latitude, longitude, utc_datetime):
+        ''' Solar (altitude, azimuth) in degrees, from a flight ephemeris when one covers the request '''
+        seconds = datetime_to_seconds(utc_datetime)
+        position = self.__ephemeris_position(latitude, longitude, seconds)
+        if position is not None:
+            return position
+        if self.latlon_decimals is not None:
+            latitude, longitude = round(latitude, self.latlon_decimals), round(longitude, self.latlon_decimals)
+        if self.time_resolution_seconds is not None:
+            seconds = round(seconds / self.time_resolution_seconds) * self.time_resolution_seconds
+            utc_datetime = seconds_to_datetime(seconds)
+        key = (latitude, longitude, seconds)
+        position = self.positions.get(key)
+        if position is None:
+            if len(self.positions) >= self.max_entries:
+                self.positions = {}
+            position = sun_altitude_azimuth(latitude, longitude, utc_datetime)
+            self.positions[key] = position
+        return position
+
+# shared by every image; call solar_positions.add_flight() to precompute a whole flight
+solar_positions = SolarPositionCache()
+
 # from the current position (lat,lon,alt) tuple
 # and time (UTC), as well as the sensor orientation (yaw,pitch,roll) tuple
 # compute a sensor sun angle - this is needed as the actual sun irradiance
@@ -127,21 +309,11 @@ def compute_sun_angle(
     sensor_orientation,
 ):
     """ compute the sun angle using pysolar functions"""
-    altitude = 0
-    azimuth = 0
-    import warnings
-    with warnings.catch_warnings(): # Ignore pysolar leap seconds offset warning
-        warnings.simplefilter("ignore")
-        try:
-            altitude = pysolar.get_altitude(position[0], position[1], utc_datetime)
-            azimuth = pysolar.get_azimuth(position[0], position[1], utc_datetime)
-        except AttributeError: # catch 0.6 version of pysolar required for python 2.7 support
-            altitude = pysolar.GetAltitude(position[0], position[1], utc_datetime)
-            azimuth = 180-pysolar.GetAzimuth(position[0], position[1], utc_datetime)
-        sunAltitude = np.radians(np.array(altitude))
-        sunAzimuth = np.radians(np.array(azimuth))
-        sunAzimuth = sunAzimuth % (2 * np.pi ) #wrap range 0 to 2*pi
-        nSun = ned_from_pysolar(sunAzimuth, sunAltitude)
-        nSensor = np.array(get_orientation(pose, sensor_orientation))
-        angle = np.arccos(np.dot(nSun, nSensor))
+    altitude, azimuth = solar_positions.altitude_azimuth(position[0], position[1], utc_datetime)
+    sunAltitude = np.radians(np.array(altitude))
+    sunAzimuth = np.radians(np.array(azimuth))
+    sunAzimuth = sunAzimuth % (2 * np.pi ) #wrap range 0 to 2*pi
+    nSun = ned_from_pysolar(sunAzimuth, sunAltitude)
+    nSensor = np.array(get_orientation(pose, sensor_orientation))
+    angle = np.arccos(np.dot(nSun, nSensor))
     return nSun, nSensor, angle, sunAltitude, sunAzimuth
@@ -31,10 +31,11 @@ import cv2
 import math
 import numpy as np
 
-import matplotlib.pyplot as plt
-import micasense.plotutils as plotutils
 import micasense.metadata as metadata
+import micasense.cache as cache
+import micasense.utils as utils
 import micasense.dls as dls
+import micasense.instrumentation as instrumentation
 
 #helper function to convert euler angles to a rotation matrix
 def rotations_degrees_to_rotation_matrix(rotation_degrees):
@@ -57,112 +58,272 @@ def rotations_degrees_to_rotation_matrix(rotation_degrees):
    R = Rx*Ry*Rz
    return R
 
+# float32 vignette corrections by vignette model, shared by the images of a band
+_vignette_maps = {}
+
+def band_vignette(calibration):
+    ''' The float32 (height, width) vignette correction of a band calibration, computed once.
+        We divide by the polynomial so that the corrected image is image_original * vignette '''
+    key = (calibration.image_size, calibration.vignette_center, calibration.vignette_polynomial)
+    vignette = _vignette_maps.get(key)
+    if vignette is None:
+        width, height = calibration.image_size
+        vignette_center_x, vignette_center_y = calibration.vignette_center
+        v_poly_list = list(calibration.vignette_polynomial)
+        v_poly_list.reverse()
+        v_poly_list.append(1.)
+        x = np.arange(width, dtype=float)[np.newaxis, :]
+        y = np.arange(height, dtype=float)[:, np.newaxis]
+        r = np.hypot((x-vignette_center_x), (y-vignette_center_y))
+        vignette = (1./np.polyval(np.array(v_poly_list), r)).astype(np.float32)
+        vignette.flags.writeable = False
+        _vignette_maps[key] = vignette
+    return vignette
+
+# undistortion (map1, map2) by lens model, shared by the images of a band
+_undistort_maps = {}
+
+class DeferredField(object):
+    """
+    An attribute computed on first access by calling the loader method of the instance.
+    The computed value is stored in the instance dictionary, which takes
+    precedence over this descriptor, so later reads are plain attribute lookups.
+    """
+    def __init__(self, name, loader):
+        self.name = name
+        self.loader = loader
+
+    def __get__(self, obj, owner=None):
+        if obj is None:
+            return self
+        getattr(obj, self.loader)()
+        try:
+            return obj.__dict__[self.name]
+        except KeyError:
+            raise AttributeError(self.name)
+
+class DeferredDlsField(DeferredField):
+    """
+    An Image attribute computed on first access by Image.compute_dls_fields.
+    """
+    def __init__(self, name):
+        super(DeferredDlsField, self).__init__(name, 'compute_dls_fields')
+
+class MetadataField(object):
+    """
+    An Image attribute stored in one of the image's metadata records. Setting a
+    calibration field switches this image to its own calibration record, so the
+    other images of the band are not changed.
+    """
+    def __init__(self, record, name):
+        self.record = record
+        self.name = name
+
+    def __get__(self, img, owner=None):
+        if img is None:
+            return self
+        return getattr(getattr(img, self.record), self.name)
+
+    def __set__(self, img, value):
+        if self.record == 'calibration':
+            img.calibration = img.calibration.replace(**{self.name: value})
+        else:
+            setattr(img.record, self.name, value)
+
 class Image(object):
     """
     An Image is a single file taken by a RedEdge camera representing one
     band of multispectral information
     """
-    def __init__(self, image_path, exiftool_obj=None):
+    # sun angles and DLS irradiances are not needed to read pixels or metadata,
+    # so they are computed lazily
+    dls_orientation_vector = DeferredDlsField('dls_orientation_vector')
+    sun_vector_ned = DeferredDlsField('sun_vector_ned')
+    sensor_vector_ned = DeferredDlsField('sensor_vector_ned')
+    sun_sensor_angle = DeferredDlsField('sun_sensor_angle')
+    solar_elevation = DeferredDlsField('solar_elevation')
+    solar_azimuth = DeferredDlsField('solar_azimuth')
+    angular_correction = DeferredDlsField('angular_correction')
+    horizontal_irradiance = DeferredDlsField('horizontal_irradiance')
+    scattered_irradiance = DeferredDlsField('scattered_irradiance')
+    direct_irradiance = DeferredDlsField('direct_irradiance')
+    direct_to_diffuse_ratio = DeferredDlsField('direct_to_diffuse_ratio')
+    estimated_direct_vector = DeferredDlsField('estimated_direct_vector')
+
+    # metadata is held in two compact records: the band calibration, which is shared by all
+    # images of the same camera band, and the per-image pose/exposure record. Images created
+    # with Image.deferred read them from the file on first access
+    calibration = DeferredField('calibration', 'load_metadata')
+    record = DeferredField('record', 'load_metadata')
+    camera_make = MetadataField('calibration', 'camera_make')
+    camera_model = MetadataField('calibration', 'camera_model')
+    band_name = MetadataField('calibration', 'band_name')
+    band_index = MetadataField('calibration', 'band_index')
+    center_wavelength = MetadataField('calibration', 'center_wavelength')
+    bandwidth = MetadataField('calibration', 'bandwidth')
+    bits_per_pixel = MetadataField('calibration', 'bits_per_pixel')
+    radiometric_cal = MetadataField('calibration', 'radiometric_cal')
+    vignette_center = MetadataField('calibration', 'vignette_center')
+    vignette_polynomial = MetadataField('calibration', 'vignette_polynomial')
+    distortion_parameters = MetadataField('calibration', 'distortion_parameters')
+    principal_point = MetadataField('calibration', 'principal_point')
+    focal_plane_resolution_px_per_mm = MetadataField('calibration', 'focal_plane_resolution_px_per_mm')
+    focal_length = MetadataField('calibration', 'focal_length')
+    focal_length_35 = MetadataField('calibration', 'focal_length_35')
+    rig_relatives = MetadataField('calibration', 'rig_relatives')
+    utc_time = MetadataField('record', 'utc_time')
+    latitude = MetadataField('record', 'latitude')
+    longitude = MetadataField('record', 'longitude')
+    altitude = MetadataField('record', 'altitude')
+    capture_id = MetadataField('record', 'capture_id')
+    flight_id = MetadataField('record', 'flight_id')
+    black_level = MetadataField('record', 'black_level')
+    exposure_time = MetadataField('record', 'exposure_time')
+    gain = MetadataField('record', 'gain')
+    dls_present = MetadataField('record', 'dls_present')
+    dls_yaw = MetadataField('record', 'dls_yaw')
+    dls_pitch = MetadataField('record', 'dls_pitch')
+    dls_roll = MetadataField('record', 'dls_roll')
+    spectral_irradiance = MetadataField('record', 'spectral_irradiance')
+    auto_calibration_image = MetadataField('record', 'auto_calibration_image')
+    panel_albedo = MetadataField('record', 'panel_albedo')
+    panel_region = MetadataField('record', 'panel_region')
+    panel_serial = MetadataField('record', 'panel_serial')
+
+    def __init__(self, image_path, exiftool_obj=None, keep_exif=True, exiftool_path=None):
         if not os.path.isfile(image_path):
             raise IOError("Provided path is not a file: {}".format(image_path))
+        self.__setup(image_path, None, None, keep_exif, exiftool_path)
+        self.load_metadata(exiftool_obj)
+
+    @classmethod
+    def from_records(cls, image_path, calibration, record, exiftool_path=None):
+        ''' Create an Image from already-extracted metadata records, without reading the file '''
+        img = cls.__new__(cls)
+        img.__setup(image_path, calibration, record, False, exiftool_path)
+        return img
+
+    @classmethod
+    def deferred(cls, image_path, keep_exif=False, exiftool_path=None):
+        ''' Create an Image without reading the file; its metadata is read by load_metadata
+            the first time any of it is accessed '''
+        img = cls.__new__(cls)
+        img.__setup(image_path, None, None, keep_exif, exiftool_path)
+        return img
+
+    def __setup(self, image_path, calibration, record, keep_exif, exiftool_path):
         self.path = image_path
-        self.meta = metadata.Metadata(self.path, exiftool_obj=exiftool_obj)
+        # used whenever the file's metadata is read without a running exiftool_obj
+        self.exiftool_path = exiftool_path
+        if calibration is not None:
+            self.calibration = calibration
+            self.record = record
+        self.__meta = None
+        self.__keep_exif = keep_exif
+
+        # Solar geometry and DLS irradiance are only computed when first accessed,
+        # see compute_dls_fields
+        self.__dls_computed = False
 
-        if self.meta.band_name() is None:
-            raise ValueError("Provided file path does not have a band name: {}".format(image_path))
-        if self.meta.band_name().upper() != 'LWIR' and not self.meta.supports_radiometric_calibration():
+        # Internal image containers; these can use a lot of memory, clear with Image.clear_images
+        self.__raw_image = None # pure raw pixels
+        self.__intensity_image = None # black level and gain-exposure/radiometric compensated
+        self.__radiance_image = None # calibrated to radiance
+        self.__reflectance_image = None # calibrated to reflectance (0-1)
+        self.__reflectance_irradiance = None
+        # undistorted images by source kind, as (source, undistorted image, irradiance) tuples
+        self.__undistorted = {}
+
+    def load_metadata(self, exiftool_obj=None):
+        ''' Read the calibration and record of the image from its file. Called automatically
+            for images created with Image.deferred; subsequent calls do nothing '''
+        if self.metadata_loaded():
+            return
+        meta = metadata.Metadata(self.path, exiftoolPath=self.exiftool_path, exiftool_obj=exiftool_obj)
+
+        if meta.band_name() is None:
+            raise ValueError("Provided file path does not have a band name: {}".format(self.path))
+        if meta.band_name().upper() != 'LWIR' and not meta.supports_radiometric_calibration():
             raise ValueError('Library requires images taken with RedEdge-(3/M/MX) camera firmware v2.1.0 or later. ' +
             'Upgrade your camera firmware to at least version 2.1.0 to use this library with RedEdge-(3/M/MX) cameras.')
 
-        self.utc_time = self.meta.utc_time()
-        self.latitude, self.longitude, self.altitude = self.meta.position()
-        self.location = (self.latitude, self.longitude, self.altitude)
-        self.dls_present = self.meta.dls_present()
-        self.dls_yaw, self.dls_pitch, self.dls_roll = self.meta.dls_pose()
-        self.capture_id = self.meta.capture_id()
-        self.flight_id = self.meta.flight_id()
-        self.band_name = self.meta.band_name()
-        self.band_index = self.meta.band_index()
-        self.black_level = self.meta.black_level()
-        if self.meta.supports_radiometric_calibration():
-            self.radiometric_cal = self.meta.radiometric_cal()
-        self.exposure_time = self.meta.exposure()
-        self.gain = self.meta.gain()
-        self.bits_per_pixel = self.meta.bits_per_pixel()
+        self.calibration = metadata.BandCalibration.from_metadata(meta)
+        self.record = metadata.ImageRecord.from_metadata(meta)
+        # the full exif dictionary is large; when it is not kept, Image.meta re-reads it on request
+        if self.__keep_exif:
+            self.__meta = meta
 
         if self.bits_per_pixel != 16:
             NotImplemented("Unsupported pixel bit depth: {} bits".format(self.bits_per_pixel))
 
-        self.vignette_center = self.meta.vignette_center()
-        self.vignette_polynomial = self.meta.vignette_polynomial()
-        self.distortion_parameters = self.meta.distortion_parameters()
-        self.principal_point = self.meta.principal_point()
-        self.focal_plane_resolution_px_per_mm = self.meta.focal_plane_resolution_px_per_mm()
-        self.focal_length = self.meta.focal_length_mm()
-        self.focal_length_35 = self.meta.focal_length_35_mm_eq()
-        self.center_wavelength = self.meta.center_wavelength()
-        self.bandwidth = self.meta.bandwidth()
-        self.rig_relatives = self.meta.rig_relatives()
-        self.spectral_irradiance = self.meta.spectral_irradiance()
-
-        self.auto_calibration_image = self.meta.auto_calibration_image()
-        self.panel_albedo = self.meta.panel_albedo()
-        self.panel_region = self.meta.panel_region()
-        self.panel_serial = self.meta.panel_serial()
-
-        if self.dls_present:
-            self.dls_orientation_vector = np.array([0,0,-1])
-            self.sun_vector_ned, \
-            self.sensor_vector_ned, \
-            self.sun_sensor_angle, \
-            self.solar_elevation, \
-            self.solar_azimuth=dls.compute_sun_angle(self.location,
-                                            self.meta.dls_pose(),
-                                            self.utc_time,
-                                            self.dls_orientation_vector)
-            self.angular_correction = dls.fresnel(self.sun_sensor_angle)
-
-            # when we have good horizontal irradiance the camera provides the solar az and el also
-            if self.meta.scattered_irradiance() != 0 and self.meta.direct_irradiance() != 0:
-                self.solar_azimuth = self.meta.solar_azimuth()
-                self.solar_elevation = self.meta.solar_elevation()
-                self.scattered_irradiance = self.meta.scattered_irradiance()
-                self.direct_irradiance = self.meta.direct_irradiance()
-                self.direct_to_diffuse_ratio = self.meta.direct_irradiance() / self.meta.scattered_irradiance()
-                self.estimated_direct_vector = self.meta.estimated_direct_vector()
-                if self.meta.horizontal_irradiance_valid():
-                    self.horizontal_irradiance = self.meta.horizontal_irradiance()
-                else: 
-                    self.horizontal_irradiance = self.compute_horizontal_irradiance_dls2()
-            else:
-                self.direct_to_diffuse_ratio = 6.0 # assumption
-                self.horizontal_irradiance = self.compute_horizontal_irradiance_dls1()
-
-            self.spectral_irradiance = self.meta.spectral_irradiance()
-        else: # no dls present or LWIR band: compute what we can, set the rest to 0
+    def metadata_loaded(self):
+        ''' True unless the image was created with Image.deferred and its metadata not yet read '''
+        return 'record' in self.__dict__
+
+    @property
+    def meta(self):
+        ''' The full exiftool metadata of the image, read again from the file if it was not kept '''
+        if self.__meta is None:
+            self.__meta = metadata.Metadata(self.path, exiftoolPath=self.exiftool_path)
+        return self.__meta
+
+    @property
+    def location(self):
+        return (self.latitude, self.longitude, self.altitude)
+
+    def compute_dls_fields(self):
+        ''' Compute the sun angles and DLS irradiance fields. Called automatically the first
+            time any of them is accessed; subsequent calls do nothing '''
+        if self.__dls_computed:
+            return
+        # set first so reads of already-computed fields below can't recurse
+        self.__dls_computed = True
+        try:
             self.dls_orientation_vector = np.array([0,0,-1])
-            self.sun_vector_ned, \
-            self.sensor_vector_ned, \
-            self.sun_sensor_angle, \
-            self.solar_elevation, \
-            self.solar_azimuth=dls.compute_sun_angle(self.location,
-                                            (0,0,0),
-                                            self.utc_time,
-                                            self.dls_orientation_vector)
-            self.angular_correction = dls.fresnel(self.sun_sensor_angle)
-            self.horizontal_irradiance = 0
-            self.scattered_irradiance = 0
-            self.direct_irradiance = 0
-            self.direct_to_diffuse_ratio = 0
-            
-        # Internal image containers; these can use a lot of memory, clear with Image.clear_images
-        self.__raw_image = None # pure raw pixels
-        self.__intensity_image = None # black level and gain-exposure/radiometric compensated
-        self.__radiance_image = None # calibrated to radiance
-        self.__reflectance_image = None # calibrated to reflectance (0-1)
-        self.__reflectance_irradiance = None
-        self.__undistorted_source = None # can be any of raw, intensity, radiance
-        self.__undistorted_image = None # current undistorted image, depdining on source
+            self.estimated_direct_vector = None
+            if self.dls_present:
+                self.sun_vector_ned, \
+                self.sensor_vector_ned, \
+                self.sun_sensor_angle, \
+                self.solar_elevation, \
+                self.solar_azimuth=dls.compute_sun_angle(self.location,
+                                                (self.dls_yaw, self.dls_pitch, self.dls_roll),
+                                                self.utc_time,
+                                                self.dls_orientation_vector)
+                self.angular_correction = dls.fresnel(self.sun_sensor_angle)
+
+                # when we have good horizontal irradiance the camera provides the solar az and el also
+                if self.record.scattered_irradiance != 0 and self.record.direct_irradiance != 0:
+                    self.solar_azimuth = self.record.solar_azimuth
+                    self.solar_elevation = self.record.solar_elevation
+                    self.scattered_irradiance = self.record.scattered_irradiance
+                    self.direct_irradiance = self.record.direct_irradiance
+                    self.direct_to_diffuse_ratio = self.record.direct_irradiance / self.record.scattered_irradiance
+                    self.estimated_direct_vector = self.record.estimated_direct_vector
+                    if self.record.horizontal_irradiance_valid:
+                        self.horizontal_irradiance = self.record.horizontal_irradiance
+                    else:
+                        self.horizontal_irradiance = self.compute_horizontal_irradiance_dls2()
+                else:
+                    self.direct_to_diffuse_ratio = 6.0 # assumption
+                    self.horizontal_irradiance = self.compute_horizontal_irradiance_dls1()
+            else: # no dls present or LWIR band: compute what we can, set the rest to 0
+                self.sun_vector_ned, \
+                self.sensor_vector_ned, \
+                self.sun_sensor_angle, \
+                self.solar_elevation, \
+                self.solar_azimuth=dls.compute_sun_angle(self.location,
+                                                (0,0,0),
+                                                self.utc_time,
+                                                self.dls_orientation_vector)
+                self.angular_correction = dls.fresnel(self.sun_sensor_angle)
+                self.horizontal_irradiance = 0
+                self.scattered_irradiance = 0
+                self.direct_irradiance = 0
+                self.direct_to_diffuse_ratio = 0
+        except Exception:
+            self.__dls_computed = False
+            raise
 
     # solar elevation is defined as the angle betwee the horizon and the sun, so it is 0 when the 
     # sun is at the horizon and pi/2 when the sun is directly overhead
@@ -207,13 +368,22 @@ class Image(object):
 
     def raw(self):
         ''' Lazy load the raw image once neecessary '''
-        if self.__raw_image is None:
-            try:
-                self.__raw_image = cv2.imread(self.path,-1)
-            except IOError:
-                print("Could not open image at path {}".format(self.path))
-                raise
-        return self.__raw_image
+        # read into a local, as another thread may evict the cached image before this returns
+        raw_image = self.__raw_image
+        if raw_image is None:
+            raw_image = self.__raw_image = self.__read_raw()
+            cache.image_cache.store(self, 'raw', raw_image)
+        else:
+            cache.image_cache.touch(self, 'raw')
+        return raw_image
+
+    def __read_raw(self):
+        try:
+            # uncompressed images are memory mapped read-only
+            return utils.read_raw(self.path)
+        except IOError:
+            print("Could not open image at path {}".format(self.path))
+            raise
 
     def set_external_rig_relatives(self,external_rig_relatives):
         self.rig_translations = external_rig_relatives['rig_translations']
@@ -234,37 +404,68 @@ class Image(object):
         self.__radiance_image = None
         self.__reflectance_image = None
         self.__reflectance_irradiance = None
-        self.__undistorted_source = None
-        self.__undistorted_image = None
+        self.__undistorted = {}
+        cache.image_cache.discard(self)
+
+    def release_cached(self, slot):
+        ''' Drop one of the cached images (raw, intensity, radiance, reflectance, or undistorted_
+            and a source kind); called by the image cache when it evicts the image '''
+        if slot.startswith('undistorted_'):
+            self.__undistorted.pop(slot[len('undistorted_'):], None)
+        elif slot == 'raw':
+            self.__raw_image = None
+        elif slot == 'intensity':
+            self.__intensity_image = None
+        elif slot == 'radiance':
+            self.__radiance_image = None
+        elif slot == 'reflectance':
+            self.__reflectance_image = None
+            self.__reflectance_irradiance = None
+        # an undistorted image holds on to its source, and is only reused while that is kept
+        if slot in self.__undistorted:
+            del self.__undistorted[slot]
+            cache.image_cache.discard(self, 'undistorted_' + slot)
+        cache.image_cache.discard(self, slot)
 
     def size(self):
-        width, height = self.meta.image_size()
+        width, height = self.calibration.image_size
         return width, height
 
-    def reflectance(self, irradiance=None, force_recompute=False):
-        ''' Lazy-compute and return a reflectance image provided an irradiance reference '''
-        if self.__reflectance_image is not None \
+    def reflectance(self, irradiance=None, force_recompute=False, from_raw=False):
+        ''' Lazy-compute and return a reflectance image provided an irradiance reference.
+            With from_raw, the float32 reflectance is computed directly from the raw image
+            using gain_map, without computing or caching the radiance image '''
+        reflectance_image = self.__reflectance_image
+        if reflectance_image is not None \
             and force_recompute == False \
             and (self.__reflectance_irradiance == irradiance or irradiance == None):
-            return self.__reflectance_image
+            cache.image_cache.touch(self, 'reflectance')
+            return reflectance_image
         if irradiance is None and self.band_name != 'LWIR':
             if self.horizontal_irradiance != 0.0:
                 irradiance = self.horizontal_irradiance
             else:
                 raise RuntimeError("Provide a band-specific spectral irradiance to compute reflectance")
-        if self.band_name != 'LWIR':
+        if self.band_name != 'LWIR' and from_raw:
+            self.__reflectance_irradiance = irradiance
+            reflectance_image = self.__apply_gain_map(self.gain_map('reflectance', irradiance))
+        elif self.band_name != 'LWIR':
             self.__reflectance_irradiance = irradiance
-            self.__reflectance_image = self.radiance() * math.pi / irradiance
+            reflectance_image = self.radiance() * math.pi / irradiance
         else:
-            self.__reflectance_image = self.radiance()
-        return self.__reflectance_image
+            reflectance_image = self.radiance()
+        self.__reflectance_image = reflectance_image
+        cache.image_cache.store(self, 'reflectance', reflectance_image)
+        return reflectance_image
 
     def intensity(self, force_recompute=False):
         ''' Lazy=computes and returns the intensity image after black level,
             vignette, and row correction applied.
             Intensity is in units of DN*Seconds without a radiance correction '''
-        if self.__intensity_image is not None and force_recompute == False:
-            return self.__intensity_image
+        intensity_image = self.__intensity_image
+        if intensity_image is not None and force_recompute == False:
+            cache.image_cache.touch(self, 'intensity')
+            return intensity_image
 
         # get image dimensions
         image_raw = np.copy(self.raw()).T
@@ -280,33 +481,127 @@ class Image(object):
         max_raw_dn = float(2**self.bits_per_pixel)
         intensity_image = L.astype(float)/(self.gain * self.exposure_time * max_raw_dn)
 
-        self.__intensity_image = intensity_image.T
-        return self.__intensity_image
+        intensity_image = self.__intensity_image = intensity_image.T
+        cache.image_cache.store(self, 'intensity', intensity_image)
+        return intensity_image
 
     def radiance(self, force_recompute=False):
         ''' Lazy=computes and returns the radiance image after all radiometric
         corrections have been applied '''
-        if self.__radiance_image is not None and force_recompute == False:
-            return self.__radiance_image
-
-        # get image dimensions
-        image_raw = np.copy(self.raw()).T
-
-        if(self.band_name != 'LWIR'):
-            #  get radiometric calibration factors
-            a1, a2, a3 = self.radiometric_cal[0], self.radiometric_cal[1], self.radiometric_cal[2]
-            # apply image correction methods to raw image
-            V, x, y = self.vignette()
+        radiance_image = self.__radiance_image
+        if radiance_image is not None and force_recompute == False:
+            cache.image_cache.touch(self, 'radiance')
+            return radiance_image
+
+        with instrumentation.stage('radiance', self.capture_id) as record:
+            # get image dimensions
+            image_raw = np.copy(self.raw()).T
+
+            if(self.band_name != 'LWIR'):
+                #  get radiometric calibration factors
+                a1, a2, a3 = self.radiometric_cal[0], self.radiometric_cal[1], self.radiometric_cal[2]
+                # apply image correction methods to raw image
+                V, x, y = self.vignette()
+                R = 1.0 / (1.0 + a2 * y / self.exposure_time - a3 * y)
+                L = V * R * (image_raw - self.black_level)
+                L[L < 0] = 0
+                max_raw_dn = float(2**self.bits_per_pixel)
+                radiance_image = L.astype(float)/(self.gain * self.exposure_time)*a1/max_raw_dn
+            else:
+                L = image_raw - (273.15*100.0) # convert to C from K
+                radiance_image = L.astype(float) * 0.01
+            if record is not None:
+                record['bytes'] = radiance_image.nbytes
+        radiance_image = self.__radiance_image = radiance_image.T
+        cache.image_cache.store(self, 'radiance', radiance_image)
+        return radiance_image
+
+    def gain_map(self, kind='reflectance', irradiance=None):
+        ''' The float32 (height, width) map which multiplies raw counts above the black level to
+            give the intensity, radiance or reflectance image, folding the vignette, row gradient,
+            radiometric calibration, exposure, gain and irradiance corrections into one factor '''
+        if kind not in ('intensity', 'radiance', 'reflectance'):
+            raise ValueError("Unknown image kind {}".format(kind))
+        if self.band_name == 'LWIR':
+            raise RuntimeError("The LWIR band has no gain map")
+        a1, a2, a3 = self.radiometric_cal[0], self.radiometric_cal[1], self.radiometric_cal[2]
+        scale = 1.0 / (self.gain * self.exposure_time * float(2**self.bits_per_pixel))
+        if kind != 'intensity':
+            scale *= a1
+        if kind == 'reflectance':
+            if irradiance is None:
+                if self.horizontal_irradiance != 0.0:
+                    irradiance = self.horizontal_irradiance
+                else:
+                    raise RuntimeError("Provide a band-specific spectral irradiance to compute reflectance")
+            scale *= math.pi / irradiance
+        vignette = band_vignette(self.calibration)
+        # the row gradient correction only depends on the row
+        y = np.arange(vignette.shape[0], dtype=float)[:, np.newaxis]
+        row_scale = (scale / (1.0 + a2 * y / self.exposure_time - a3 * y)).astype(np.float32)
+        return vignette * row_scale
+
+    def __apply_gain_map(self, gain_map, block_rows=256):
+        ''' Multiply a gain map in place by the raw counts above the black level, clipped at zero '''
+        image_raw = self.raw()
+        black_level = np.float32(self.black_level)
+        for top in range(0, gain_map.shape[0], block_rows):
+            block = gain_map[top:top+block_rows]
+            block *= image_raw[top:top+block_rows] - black_level
+            np.maximum(block, 0, out=block)
+        return gain_map
+
+    def compute_into(self, out=None, kind='radiance', irradiance=None, block_rows=256):
+        ''' Compute the raw, intensity, radiance or reflectance image in blocks of rows, writing
+            into the (height, width) out array (float32 if not provided). Only the raw image
+            and one block of temporaries are held, and the Image caches are not changed '''
+        if kind not in ('raw', 'intensity', 'radiance', 'reflectance'):
+            raise ValueError("Unknown image kind {}".format(kind))
+        # use the cached raw image if there is one, but don't cache it otherwise
+        image_raw = self.__raw_image
+        if image_raw is None:
+            image_raw = self.__read_raw()
+        height, width = image_raw.shape
+        if out is None:
+            out = np.empty((height, width), dtype=np.float32)
+        if out.shape != (height, width):
+            raise ValueError("Output shape {} does not match the image shape {}".format(out.shape, (height, width)))
+        if kind == 'raw':
+            out[:] = image_raw
+            return out
+
+        scale = 1.0
+        if kind == 'reflectance' and self.band_name != 'LWIR':
+            if irradiance is None:
+                if self.horizontal_irradiance != 0.0:
+                    irradiance = self.horizontal_irradiance
+                else:
+                    raise RuntimeError("Provide a band-specific spectral irradiance to compute reflectance")
+            scale = math.pi / irradiance
+        if self.band_name == 'LWIR':
+            if kind == 'intensity':
+                raise RuntimeError("Intensity is not defined for the LWIR band")
+            for top in range(0, height, block_rows):
+                bottom = min(top + block_rows, height)
+                out[top:bottom] = (image_raw[top:bottom] - (273.15*100.0)) * 0.01
+            return out
+
+        a1, a2, a3 = self.radiometric_cal[0], self.radiometric_cal[1], self.radiometric_cal[2]
+        max_raw_dn = float(2**self.bits_per_pixel)
+        vignette = band_vignette(self.calibration)
+        if kind == 'intensity':
+            scale /= self.gain * self.exposure_time * max_raw_dn
+        else:
+            scale *= a1 / (self.gain * self.exposure_time * max_raw_dn)
+        for top in range(0, height, block_rows):
+            bottom = min(top + block_rows, height)
+            # the row gradient correction only depends on the row
+            y = np.arange(top, bottom, dtype=float)[:, np.newaxis]
             R = 1.0 / (1.0 + a2 * y / self.exposure_time - a3 * y)
-            L = V * R * (image_raw - self.black_level)
+            L = vignette[top:bottom] * R * (image_raw[top:bottom] - self.black_level)
             L[L < 0] = 0
-            max_raw_dn = float(2**self.bits_per_pixel)
-            radiance_image = L.astype(float)/(self.gain * self.exposure_time)*a1/max_raw_dn
-        else:
-            L = image_raw - (273.15*100.0) # convert to C from K
-            radiance_image = L.astype(float) * 0.01
-        self.__radiance_image = radiance_image.T
-        return self.__radiance_image
+            out[top:bottom] = L * scale
+        return out
 
     def vignette(self):
         ''' Get a numpy array which defines the value to multiply each pixel by to correct
@@ -314,39 +609,23 @@ class Image(object):
         Note: this array is transposed from normal image orientation and comes as part
         of a three-tuple, the other parts of which are also used by the radiance method.
         '''
-        # get vignette center
-        vignette_center_x, vignette_center_y = self.vignette_center
-
-        # get a copy of the vignette polynomial because we want to modify it here
-        v_poly_list = list(self.vignette_polynomial)
-
-        # reverse list and append 1., so that we can call with numpy polyval
-        v_poly_list.reverse()
-        v_poly_list.append(1.)
-        v_polynomial = np.array(v_poly_list)
+        # the vignette correction is shared by the images of a band, see band_vignette
+        vignette = band_vignette(self.calibration).T
 
-        # perform vignette correction
         # get coordinate grid across image, seem swapped because of transposed vignette
-        x_dim, y_dim = self.raw().shape[1], self.raw().shape[0]
+        x_dim, y_dim = self.size()
         x, y = np.meshgrid(np.arange(x_dim), np.arange(y_dim))
 
         #meshgrid returns transposed arrays
         x = x.T
         y = y.T
-
-        # compute matrix of distances from image center
-        r = np.hypot((x-vignette_center_x), (y-vignette_center_y))
-
-        # compute the vignette polynomial for each distance - we divide by the polynomial so that the
-        # corrected image is image_corrected = image_original * vignetteCorrection
-        vignette = 1./np.polyval(v_polynomial, r)
         return vignette, x, y
 
     def undistorted_radiance(self, force_recompute=False):
         return self.undistorted(self.radiance(force_recompute))
 
-    def undistorted_reflectance(self, irradiance=None, force_recompute=False):
-        return self.undistorted(self.reflectance(irradiance, force_recompute))
+    def undistorted_reflectance(self, irradiance=None, force_recompute=False, from_raw=False):
+        return self.undistorted(self.reflectance(irradiance, force_recompute, from_raw))
 
     def plottable_vignette(self):
         return self.vignette()[0].T
@@ -384,39 +663,75 @@ class Image(object):
         t_y = math.radians(self.rig_relatives[1]) / px_fov_y
         return (t_x, t_y)
 
+    def __source_kind(self, image):
+        ''' The kind of cached image an array is (by identity), or 'other' '''
+        if image is self.__raw_image:
+            return 'raw'
+        if image is self.__intensity_image:
+            return 'intensity'
+        if image is self.__radiance_image:
+            return 'radiance'
+        if image is self.__reflectance_image:
+            return 'reflectance'
+        return 'other'
+
+    def undistortion_maps(self):
+        ''' The cv2.remap (map1, map2) undistortion maps, computed once per lens model '''
+        key = (self.calibration.image_size,
+               self.calibration.focal_length,
+               self.calibration.focal_plane_resolution_px_per_mm,
+               self.calibration.principal_point,
+               self.calibration.distortion_parameters)
+        maps = _undistort_maps.get(key)
+        if maps is None:
+            new_cam_mat, _ = cv2.getOptimalNewCameraMatrix(self.cv2_camera_matrix(),
+                                                           self.cv2_distortion_coeff(),
+                                                           self.size(),
+                                                           1)
+            maps = cv2.initUndistortRectifyMap(self.cv2_camera_matrix(),
+                                               self.cv2_distortion_coeff(),
+                                               np.eye(3),
+                                               new_cam_mat,
+                                               self.size(),
+                                               cv2.CV_32F) # cv2.CV_32F for 32 bit floats
+            _undistort_maps[key] = maps
+        return maps
+
     def undistorted(self, image):
         ''' return the undistorted image from input image '''
-        # If we have already undistorted the same source, just return that here
-        # otherwise, lazy compute the undstorted image
-        if self.__undistorted_source is not None and image.data == self.__undistorted_source.data:
-            return self.__undistorted_image
-
-        self.__undistorted_source = image
-
-        new_cam_mat, _ = cv2.getOptimalNewCameraMatrix(self.cv2_camera_matrix(),
-                                                       self.cv2_distortion_coeff(),
-                                                       self.size(),
-                                                       1)
-        map1, map2 = cv2.initUndistortRectifyMap(self.cv2_camera_matrix(),
-                                                self.cv2_distortion_coeff(),
-                                                np.eye(3),
-                                                new_cam_mat,
-                                                self.size(),
-                                                cv2.CV_32F) # cv2.CV_32F for 32 bit floats
-        # compute the undistorted 16 bit image
-        self.__undistorted_image = cv2.remap(image, map1, map2, cv2.INTER_LINEAR)
-        return self.__undistorted_image
+        # Undistorted images are kept per source kind, so alternating between e.g. the raw and
+        # radiance images does not recompute them; one is reused while its source is the same
+        # array (and for reflectance, the same irradiance)
+        kind = self.__source_kind(image)
+        irradiance = self.__reflectance_irradiance if kind == 'reflectance' else None
+        entry = self.__undistorted.get(kind)
+        if entry is not None and entry[0] is image and entry[2] == irradiance:
+            cache.image_cache.touch(self, 'undistorted_' + kind)
+            return entry[1]
+
+        with instrumentation.stage('undistort', self.capture_id, bytes=image.nbytes):
+            map1, map2 = self.undistortion_maps()
+            # compute the undistorted 16 bit image
+            undistorted_image = cv2.remap(image, map1, map2, cv2.INTER_LINEAR)
+        self.__undistorted[kind] = (image, undistorted_image, irradiance)
+        # the sources of the other kinds are cached arrays themselves, but any other source
+        # is only kept alive by this slot, so it is counted with it
+        nbytes = undistorted_image.nbytes + (image.nbytes if kind == 'other' else 0)
+        cache.image_cache.store(self, 'undistorted_' + kind, undistorted_image, nbytes)
+        return undistorted_image
 
     def plot_raw(self, title=None, figsize=None):
         ''' Create a single plot of the raw image '''
         if title is None:
             title = '{} Band {} Raw DN'.format(self.band_name, self.band_index)
+        import micasense.plotutils as plotutils
         return plotutils.plotwithcolorbar(self.raw(), title=title, figsize=figsize)
 
     def plot_intensity(self, title=None, figsize=None):
         ''' Create a single plot of the image converted to uncalibrated intensity '''
         if title is None:
             title = '{} Band {} Intensity (DN*sec)'.format(self.band_name, self.band_index)
+        import micasense.plotutils as plotutils
         return plotutils.plotwithcolorbar(self.intensity(), title=title, figsize=figsize)
 
 
@@ -424,18 +739,21 @@ class Image(object):
         ''' Create a single plot of the image converted to radiance '''
         if title is None:
             title = '{} Band {} Radiance'.format(self.band_name, self.band_index)
+        import micasense.plotutils as plotutils
         return plotutils.plotwithcolorbar(self.radiance(), title=title, figsize=figsize)
 
     def plot_vignette(self, title=None, figsize=None):
         ''' Create a single plot of the vignette '''
         if title is None:
             title = '{} Band {} Vignette'.format(self.band_name, self.band_index)
+        import micasense.plotutils as plotutils
         return plotutils.plotwithcolorbar(self.plottable_vignette(), title=title, figsize=figsize)
 
     def plot_undistorted_radiance(self, title=None, figsize=None):
         ''' Create a single plot of the undistorted radiance '''
         if title is None:
             title = '{} Band {} Undistorted Radiance'.format(self.band_name, self.band_index)
+        import micasense.plotutils as plotutils
         return plotutils.plotwithcolorbar(self.undistorted(self.radiance()), title=title, figsize=figsize)
 
     def plot_all(self, figsize=(13,10)):
@@ -443,6 +761,7 @@ class Image(object):
         plot_types = ['Raw', 'Vignette', 'Radiance', 'Undistorted Radiance']
         titles = ['{} Band {} {}'.format(str(self.band_name), str(self.band_index), tpe)
                  for tpe in plot_types]
+        import micasense.plotutils as plotutils
         plotutils.subplotwithcolorbar(2, 2, plots, titles, figsize=figsize)
 
         #get the homography that maps from this image to the reference image
@@ -27,9 +27,14 @@ COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
 IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
 CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
-import os, glob, fnmatch
+import os, re, glob, fnmatch, json
+from datetime import datetime
+import numpy as np
+import pytz
 import micasense.image as image
 import micasense.capture as capture
+import micasense.dls as dls
+import micasense.metadata as metadata
 import multiprocessing
 
 import exiftool
@@ -38,36 +43,364 @@ import exiftool
 def image_from_file(filename):
     return image.Image(filename)
 
+# ImageRecord fields stored in the ImageSet table, by column type. Missing float values are
+# stored as nan, missing strings as ''
+TABLE_FLOAT_FIELDS = ('latitude', 'longitude', 'altitude',
+                      'black_level', 'exposure_time', 'gain',
+                      'dls_yaw', 'dls_pitch', 'dls_roll',
+                      'spectral_irradiance', 'horizontal_irradiance',
+                      'scattered_irradiance', 'direct_irradiance',
+                      'solar_azimuth', 'solar_elevation', 'panel_albedo')
+TABLE_BOOL_FIELDS = ('dls_present', 'horizontal_irradiance_valid', 'auto_calibration_image')
+TABLE_STRING_FIELDS = ('capture_id', 'flight_id', 'panel_serial')
+
+def _string_length(values):
+    return max([len(v) for v in values if v is not None] + [1])
+
+def images_to_table(images, calibrations):
+    ''' Build a NumPy structured array with one row per image from the image metadata records.
+        The calibration column indexes into the calibrations list '''
+    records = [img.record for img in images]
+    calibration_index = dict((id(cal), i) for i, cal in enumerate(calibrations))
+    dtype = [('path', 'U{}'.format(_string_length([img.path for img in images]))),
+             ('calibration', 'i4'),
+             ('band_index', 'i4'),
+             ('utc_time', 'M8[us]')]
+    dtype += [(name, 'f8') for name in TABLE_FLOAT_FIELDS]
+    dtype += [(name, '?') for name in TABLE_BOOL_FIELDS]
+    dtype += [(name, 'U{}'.format(_string_length([getattr(r, name) for r in records])))
+              for name in TABLE_STRING_FIELDS]
+    dtype += [('estimated_direct_vector', 'f8', (3,)),
+              ('panel_region', 'i4', (4, 2))]
+
+    table = np.zeros(len(images), dtype=dtype)
+    table['path'] = [img.path for img in images]
+    table['calibration'] = [calibration_index[id(img.calibration)] for img in images]
+    table['band_index'] = [img.band_index for img in images]
+    table['utc_time'] = [r.utc_time.astimezone(pytz.utc).replace(tzinfo=None) for r in records]
+    for name in TABLE_FLOAT_FIELDS:
+        table[name] = [np.nan if getattr(r, name) is None else getattr(r, name) for r in records]
+    for name in TABLE_BOOL_FIELDS:
+        table[name] = [bool(getattr(r, name)) for r in records]
+    for name in TABLE_STRING_FIELDS:
+        table[name] = [getattr(r, name) or '' for r in records]
+    table['estimated_direct_vector'] = [(np.nan,)*3 if r.estimated_direct_vector is None
+                                        else r.estimated_direct_vector for r in records]
+    table['panel_region'] = [np.full((4, 2), -1) if r.panel_region is None else r.panel_region
+                             for r in records]
+    return table
+
+def images_from_table(table, calibrations):
+    ''' Create Images from a table built by images_to_table, without reading the image files '''
+    columns = dict((name, table[name].tolist()) for name in table.dtype.names)
+    images = []
+    for i in range(len(table)):
+        values = {}
+        values['utc_time'] = pytz.utc.localize(columns['utc_time'][i])
+        for name in TABLE_FLOAT_FIELDS:
+            value = columns[name][i]
+            values[name] = None if np.isnan(value) else value
+        for name in TABLE_BOOL_FIELDS:
+            values[name] = columns[name][i]
+        for name in TABLE_STRING_FIELDS:
+            values[name] = columns[name][i] or None
+        direct_vector = columns['estimated_direct_vector'][i]
+        if not np.all(np.isnan(direct_vector)):
+            values['estimated_direct_vector'] = direct_vector
+        panel_region = columns['panel_region'][i]
+        if panel_region[0][0] >= 0:
+            values['panel_region'] = [tuple(corner) for corner in panel_region]
+        images.append(image.Image.from_records(columns['path'][i],
+                                               calibrations[columns['calibration'][i]],
+                                               metadata.ImageRecord(**values)))
+    return images
+
+def write_parquet(path, table, calibrations):
+    ''' Write an image table to a Parquet file, with the band calibrations in the file metadata '''
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    arrays = []
+    for name in table.dtype.names:
+        column = table[name]
+        if column.ndim > 1:
+            arrays.append(pa.array(column.reshape(len(column), -1).tolist()))
+        elif column.dtype.kind == 'U':
+            arrays.append(pa.array(column.tolist(), type=pa.string()))
+        else:
+            arrays.append(pa.array(column))
+    schema_metadata = {'micasense.dtype': json.dumps(table.dtype.descr),
+                       'micasense.calibrations': json.dumps([cal.as_dict() for cal in calibrations])}
+    arrow_table = pa.Table.from_arrays(arrays, names=list(table.dtype.names))
+    arrow_table = arrow_table.replace_schema_metadata(schema_metadata)
+    pq.write_table(arrow_table, path)
+
+def read_parquet(path):
+    ''' Read an image table and its band calibrations written by write_parquet '''
+    import pyarrow.parquet as pq
+    arrow_table = pq.read_table(path)
+    schema_metadata = arrow_table.schema.metadata
+    descr = json.loads(schema_metadata[b'micasense.dtype'].decode('utf-8'))
+    dtype = np.dtype([tuple(d[:2]) + tuple(tuple(shape) for shape in d[2:]) for d in descr])
+    table = np.zeros(arrow_table.num_rows, dtype=dtype)
+    for name in dtype.names:
+        column = np.array(arrow_table.column(name).to_pylist())
+        table[name] = column.reshape(table[name].shape)
+    calibrations = [metadata.BandCalibration.intern(**values) for values in
+                    json.loads(schema_metadata[b'micasense.calibrations'].decode('utf-8'))]
+    return table, calibrations
+
+# camera file names, IMG_<capture number>_<band number>.tif
+CAPTURE_FILE_PATTERN = re.compile(r'^IMG_(\d{4})_(\d+)\.tif$')
+
+def _tif_entries(directory):
+    ''' Walk a directory tree once with os.scandir, yielding the DirEntry of each tif file '''
+    pending = [directory]
+    while pending:
+        with os.scandir(pending.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append(entry.path)
+                elif fnmatch.fnmatch(entry.name, '*.tif'):
+                    yield entry
+
+def scan_directory(directory):
+    ''' Find the tif files below a directory, as a {path: (mtime, size)} dictionary '''
+    files = {}
+    for entry in _tif_entries(directory):
+        stat = entry.stat()
+        files[entry.path] = (stat.st_mtime, stat.st_size)
+    return files
+
+def find_capture_files(directory):
+    ''' Find the IMG_NNNN_B.tif files below a directory in a single walk, as a
+        {(folder, capture number): {band number: path}} dictionary sorted by folder and capture
+        number, where folder is relative to the directory '''
+    return _group_capture_files((entry.path for entry in _tif_entries(directory)), directory)
+
+def _group_capture_files(paths, directory):
+    captures = {}
+    for path in paths:
+        match = CAPTURE_FILE_PATTERN.match(os.path.basename(path))
+        if match is None:
+            continue
+        folder = os.path.relpath(os.path.dirname(path), directory)
+        key = (folder, int(match.group(1)))
+        captures.setdefault(key, {})[int(match.group(2))] = path
+    return dict((key, captures[key]) for key in sorted(captures))
+
+def incomplete_captures(capture_files, band_count=None):
+    ''' The captures of find_capture_files missing band files, as a {(folder, capture number):
+        [missing band numbers]} dictionary. band_count defaults to the band count of most captures '''
+    if band_count is None:
+        counts = [max(bands) for bands in capture_files.values()]
+        band_count = max(set(counts), key=counts.count) if counts else 0
+    incomplete = {}
+    for key, bands in capture_files.items():
+        missing = [band for band in range(1, band_count + 1) if band not in bands]
+        if missing:
+            incomplete[key] = missing
+    return incomplete
+
+def write_index(path, images, file_stats):
+    ''' Save the metadata of images and the modification time and size of their files '''
+    calibrations = []
+    for img in images:
+        if not any(img.calibration is cal for cal in calibrations):
+            calibrations.append(img.calibration)
+    stats = np.array([file_stats[img.path] for img in images], dtype='f8').reshape(-1, 2)
+    with open(path, 'wb') as index_file:
+        np.savez(index_file,
+                 table=images_to_table(images, calibrations),
+                 mtime=stats[:, 0],
+                 size=stats[:, 1].astype('i8'),
+                 calibrations=np.array(json.dumps([cal.as_dict() for cal in calibrations])))
+
+def read_index(path):
+    ''' Load an index written by write_index as a {path: ((mtime, size), image)} dictionary '''
+    with np.load(path) as index:
+        calibrations = [metadata.BandCalibration.intern(**values) for values in
+                        json.loads(str(index['calibrations']))]
+        images = images_from_table(index['table'], calibrations)
+        stats = zip(index['mtime'].tolist(), index['size'].tolist())
+    return dict((img.path, (stat, img)) for img, stat in zip(images, stats))
+
 class ImageSet(object):
     """
     An ImageSet is a container for a group of captures that are processed together
     """
-    def __init__(self, captures):
+    def __init__(self, captures, sort=True):
         self.captures = captures
-        captures.sort()
-        
+        # sorting compares capture times, which reads the metadata of deferred captures
+        if sort:
+            captures.sort()
+        # set when loaded from a directory, see refresh
+        self.directory = None
+        self.index = None
+        self.__exiftool_path = None
+        self.__keep_exif = False
+        self.__group_by_filename = False
+        self.__file_stats = {}
+
     @classmethod
-    def from_directory(cls, directory, progress_callback=None, exiftool_path=None):
+    def from_directory(cls, directory, progress_callback=None, exiftool_path=None, keep_exif=False, index=None,
+                       group_by_filename=False):
         """
-        Create and ImageSet recursively from the files in a directory
+        Create and ImageSet recursively from the files in a directory. The full exif
+        metadata of each image is only kept if keep_exif is set; Image.meta re-reads it otherwise.
+        If an index file path is provided, the image metadata is saved there, and only files
+        added or modified since the index was written are read when loading again.
+
+        If group_by_filename is set, captures are formed from the IMG_NNNN_B.tif file names
+        without reading any files, in folder and capture number order. Image metadata is read
+        when first used, or for all images at once with load_metadata
         """
+        if group_by_filename and index is not None:
+            raise ValueError("An index can not be used when grouping captures by file name")
         cls.basedir = directory
-        matches = []
-        for root, dirnames, filenames in os.walk(directory):
-            for filename in fnmatch.filter(filenames, '*.tif'):
-                matches.append(os.path.join(root, filename))
+        imgset = cls([])
+        imgset.directory = directory
+        imgset.index = index
+        imgset.__exiftool_path = exiftool_path
+        imgset.__keep_exif = keep_exif
+        imgset.__group_by_filename = group_by_filename
+        if group_by_filename:
+            imgset.__group(progress_callback)
+            return imgset
+        known = {}
+        if index is not None and os.path.isfile(index):
+            known = read_index(index)
+            for _, img in known.values():
+                img.exiftool_path = exiftool_path
+        imgset.__update(known, progress_callback)
+        return imgset
 
-        images = []
+    def refresh(self, progress_callback=None):
+        """
+        Scan the directory again, reading only files added or modified since the last scan,
+        and merge them into the captures. Returns the newly read images
+        """
+        if self.directory is None:
+            raise RuntimeError("Only an ImageSet created with from_directory can be refreshed")
+        if self.__group_by_filename:
+            return self.__group(progress_callback)
+        known = dict((img.path, (self.__file_stats.get(img.path), img))
+                     for cap in self.captures for img in cap.images)
+        return self.__update(known, progress_callback)
 
+    def __group(self, progress_callback):
+        ''' Form deferred captures from the file names in the directory, keeping the captures
+            whose files have not changed since the last scan. Returns the images of the new
+            or rebuilt captures '''
+        files = scan_directory(self.directory)
+        existing = dict((tuple(img.path for img in cap.images), cap) for cap in self.captures)
+        captures = []
+        new_images = []
+        for band_files in _group_capture_files(files, self.directory).values():
+            paths = tuple(band_files[band] for band in sorted(band_files))
+            cap = existing.get(paths)
+            # a file rewritten in place must be read again, as in __update
+            if cap is None or any(self.__file_stats.get(path) != files[path] for path in paths):
+                cap = capture.Capture.from_band_files(band_files, keep_exif=self.__keep_exif,
+                                                      exiftool_path=self.__exiftool_path)
+                new_images.extend(cap.images)
+            captures.append(cap)
+        self.captures = captures
+        self.__file_stats = files
+        if progress_callback is not None:
+            progress_callback(1.0)
+        return new_images
+
+    def load_metadata(self, progress_callback=None):
+        """
+        Read the metadata of deferred images with a single exiftool process, verify the
+        deferred captures and sort the captures by time
+        """
+        pending = [img for cap in self.captures for img in cap.images if not img.metadata_loaded()]
+        if len(pending) > 0:
+            with self.__exiftool() as exift:
+                for i, img in enumerate(pending):
+                    img.load_metadata(exiftool_obj=exift)
+                    if progress_callback is not None:
+                        progress_callback(float(i)/float(len(pending)))
+        for cap in self.captures:
+            cap.verify()
+        self.captures.sort()
+        dls.solar_positions.add_flight([cap.location() for cap in self.captures],
+                                       [cap.utc_time() for cap in self.captures])
+        if progress_callback is not None:
+            progress_callback(1.0)
+
+    def __exiftool(self):
+        exiftool_path = self.__exiftool_path
         if exiftool_path is None and os.environ.get('exiftoolpath') is not None:
             exiftool_path = os.path.normpath(os.environ.get('exiftoolpath'))
+        return exiftool.ExifTool(exiftool_path)
+
+    def __update(self, known, progress_callback):
+        ''' Scan the directory, reusing known images whose files have not changed since they
+            were read, and rebuild the captures that have new, changed or removed files '''
+        files = scan_directory(self.directory)
+        current = set()
+        matches = []
+        for path, stat in files.items():
+            if path in known and known[path][0] == stat:
+                current.add(id(known[path][1]))
+            else:
+                matches.append(path)
 
-        with exiftool.ExifTool(exiftool_path) as exift:
-            for i,path in enumerate(matches):
-                images.append(image.Image(path, exiftool_obj=exift))
-                if progress_callback is not None:
-                    progress_callback(float(i)/float(len(matches)))
+        new_images = []
+        if len(matches) > 0:
+            with self.__exiftool() as exift:
+                for i,path in enumerate(matches):
+                    new_images.append(image.Image(path, exiftool_obj=exift, keep_exif=self.__keep_exif,
+                                                  exiftool_path=self.__exiftool_path))
+                    if progress_callback is not None:
+                        progress_callback(float(i)/float(len(matches)))
 
+        # captures whose images are all unchanged are kept as they are
+        captures_index = {}
+        unchanged = []
+        for cap in self.captures:
+            kept = [img for img in cap.images if id(img) in current]
+            if len(kept) == len(cap.images):
+                unchanged.append(cap)
+            elif len(kept) > 0:
+                captures_index[cap.uuid] = kept
+        unchanged_ids = set(cap.uuid for cap in unchanged)
+        # images known from an index are not in any capture yet
+        in_captures = set(id(img) for cap in self.captures for img in cap.images)
+        for stat, img in known.values():
+            if id(img) in current and id(img) not in in_captures:
+                captures_index.setdefault(img.capture_id, []).append(img)
+        for img in new_images:
+            if img.capture_id in unchanged_ids:
+                # a changed or late file of a capture; rebuild it
+                cap = [c for c in unchanged if c.uuid == img.capture_id][0]
+                unchanged.remove(cap)
+                unchanged_ids.remove(cap.uuid)
+                captures_index.setdefault(cap.uuid, []).extend(cap.images)
+            captures_index.setdefault(img.capture_id, []).append(img)
+
+        new_captures = [capture.Capture(imgs) for imgs in captures_index.values()]
+        self.captures = unchanged + new_captures
+        self.captures.sort()
+        # solar geometry is computed lazily by each image; precompute the sun ephemeris
+        # for the new captures so those computations are table lookups
+        dls.solar_positions.add_flight([cap.location() for cap in new_captures],
+                                       [cap.utc_time() for cap in new_captures])
+
+        self.__file_stats = dict((img.path, files[img.path]) for cap in self.captures for img in cap.images)
+        if self.index is not None:
+            write_index(self.index, [img for cap in self.captures for img in cap.images], self.__file_stats)
+        if progress_callback is not None:
+            progress_callback(1.0)
+        return new_images
+
+    @classmethod
+    def from_images(cls, images):
+        """
+        Create an ImageSet by grouping a list of images into captures
+        """
         # create a dictionary to index the images so we can sort them
         # into captures
         # {
@@ -85,9 +418,110 @@ class ImageSet(object):
             imgs = captures_index[cap_imgs]
             newcap = capture.Capture(imgs)
             captures.append(newcap)
-        if progress_callback is not None:
-            progress_callback(1.0)
+        # solar geometry is computed lazily by each image; precompute the sun ephemeris
+        # for the whole set so those computations are table lookups
+        dls.solar_positions.add_flight([cap.location() for cap in captures],
+                                       [cap.utc_time() for cap in captures])
         return cls(captures)
+
+    @classmethod
+    def from_table(cls, table, calibrations):
+        """
+        Create an ImageSet from a table and calibrations returned by to_table and
+        calibrations, without reading any image metadata
+        """
+        return cls.from_images(images_from_table(table, calibrations))
+
+    @classmethod
+    def load_table(cls, path):
+        """
+        Create an ImageSet from a Parquet file written by save_table
+        """
+        return cls.from_table(*read_parquet(path))
+
+    def images(self):
+        return [img for cap in self.captures for img in cap.images]
+
+    def calibrations(self):
+        ''' The distinct band calibrations of the images, in the order used by the table calibration column '''
+        calibrations = []
+        seen = set()
+        for img in self.images():
+            if id(img.calibration) not in seen:
+                seen.add(id(img.calibration))
+                calibrations.append(img.calibration)
+        return calibrations
+
+    def to_table(self):
+        ''' A NumPy structured array of the image metadata with one row per image, in capture order.
+            Rows hold the file path, time, position, DLS pose and irradiances, exposure, gain and
+            an index into calibrations() '''
+        return images_to_table(self.images(), self.calibrations())
+
+    def save_table(self, path):
+        ''' Save the image table and calibrations to a Parquet file (requires pyarrow) '''
+        write_parquet(path, self.to_table(), self.calibrations())
+
+    def partition(self, cutoff_altitude=None, ground_altitude=None, cutoff_fraction=0.5, max_gap=None):
+        """
+        Split the captures into ground captures (panel and takeoff/landing images) and flight
+        captures by their altitude and time. Only the metadata is used, but it is read from the
+        files of deferred captures; read it first with load_metadata to use a single exiftool process.
+
+        Captures at or below cutoff_altitude (meters MSL), and auto calibration (panel)
+        captures, are ground captures. The cutoff defaults to cutoff_fraction of the way from
+        the ground altitude to the median capture altitude. The ground altitude defaults to the
+        median altitude of the auto calibration captures, or the lowest capture altitude.
+
+        Consecutive captures of the same kind form segments, which are also split where the time
+        between captures exceeds max_gap seconds (by default 10 times the median interval).
+
+        Returns a dictionary with the 'ground' and 'flight' capture lists, the 'takeoff' and
+        'landing' ground captures before the first and after the last flight capture, the
+        'segments' as (start, stop, is_flight) capture index ranges, the per capture 'agl'
+        array, and the 'ground_altitude', 'cutoff_altitude' and 'flight_agl' (median flight
+        capture height above ground) used
+        """
+        captures = self.captures
+        records = [cap.images[0].record for cap in captures]
+        altitude = np.array([np.nan if r.altitude is None else r.altitude for r in records], dtype=float)
+        seconds = np.array([r.utc_time.timestamp() for r in records], dtype=float)
+        auto_calibration = np.array([any(img.auto_calibration_image for img in cap.images)
+                                     for cap in captures], dtype=bool)
+
+        # captures without an altitude are never flight captures; with none at all, or no
+        # captures, the altitudes are nan and every capture is a ground capture
+        known = ~np.isnan(altitude)
+        if ground_altitude is None:
+            ground_altitude = np.median(altitude[known & auto_calibration]) if (known & auto_calibration).any() \
+                              else altitude[known].min() if known.any() else np.nan
+        agl = altitude - ground_altitude
+        if cutoff_altitude is None:
+            cutoff_altitude = ground_altitude + cutoff_fraction * (np.median(altitude[known]) - ground_altitude) \
+                              if known.any() else np.nan
+        with np.errstate(invalid='ignore'):
+            flight = (altitude > cutoff_altitude) & ~auto_calibration
+
+        intervals = np.diff(seconds)
+        if max_gap is None:
+            max_gap = 10.0 * np.median(intervals) if len(intervals) > 0 else 0.0
+        breaks = np.flatnonzero((flight[1:] != flight[:-1]) | (intervals > max_gap)) + 1
+        bounds = [0] + breaks.tolist() + [len(captures)]
+        segments = [(start, stop, bool(flight[start])) for start, stop in zip(bounds[:-1], bounds[1:])
+                    if stop > start]
+
+        flight_indices = np.flatnonzero(flight)
+        first, last = (flight_indices[0], flight_indices[-1]) if len(flight_indices) > 0 \
+                      else (len(captures), len(captures))
+        return {'ground': [cap for cap, f in zip(captures, flight) if not f],
+                'flight': [cap for cap, f in zip(captures, flight) if f],
+                'takeoff': captures[:first],
+                'landing': captures[last + 1:] if len(flight_indices) > 0 else [],
+                'segments': segments,
+                'agl': agl,
+                'ground_altitude': float(ground_altitude),
+                'cutoff_altitude': float(cutoff_altitude),
+                'flight_agl': float(np.median(agl[flight])) if flight.any() else np.nan}
     
     def as_nested_lists(self):
         columns = [
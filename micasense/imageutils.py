@@ -26,9 +26,8 @@ CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 import cv2
 import numpy as np
 import multiprocessing
-from skimage import exposure
-from skimage.morphology import disk
-from skimage.filters import rank, gaussian
+
+import micasense.instrumentation as instrumentation
 
 def normalize(im, min=None, max=None):
     width, height = im.shape
@@ -42,6 +41,8 @@ def normalize(im, min=None, max=None):
     return norm
 
 def local_normalize(im):
+    from skimage.morphology import disk
+    from skimage.filters import rank
     norm = normalize(im) # TODO: mainly using this as a type conversion, but it's expensive
     width, height = im.shape
     disksize = int(width/5)
@@ -70,16 +71,100 @@ def translation_from_ref(capture, band, ref=4):
     rx,ry = capture.images[ref].rig_xy_offset_in_px()
     return
 
+def tile_energy(grad, tiles=8):
+    '''The mean gradient magnitude of a tiles x tiles grid over an image, and the row and column
+       edges of the tiles'''
+    rows = np.linspace(0, grad.shape[0], tiles + 1).round().astype(int)
+    cols = np.linspace(0, grad.shape[1], tiles + 1).round().astype(int)
+    energy = np.add.reduceat(np.add.reduceat(np.absolute(grad), rows[:-1], axis=0), cols[:-1], axis=1)
+    return energy / np.outer(np.diff(rows), np.diff(cols)), rows, cols
+
+def texture_window(grad, coverage=0.5, tiles=8):
+    '''The (left, top, width, height) window of tiles covering about coverage of the image with
+       the highest gradient energy'''
+    energy, rows, cols = tile_energy(grad, tiles)
+    size = int(min(tiles, max(1, round(tiles * np.sqrt(coverage)))))
+    # sums of every size x size block of tiles, from the summed area table
+    table = np.zeros((tiles + 1, tiles + 1))
+    table[1:, 1:] = energy.cumsum(0).cumsum(1)
+    sums = table[size:, size:] - table[:-size, size:] - table[size:, :-size] + table[:-size, :-size]
+    top, left = np.unravel_index(np.argmax(sums), sums.shape)
+    return (cols[left], rows[top], cols[left + size] - cols[left], rows[top + size] - rows[top])
+
+def texture_mask(grad, min_energy=0.1, tiles=8):
+    '''A uint8 mask excluding the featureless tiles of an image (such as sky, water, saturated or
+       panel areas), whose gradient energy is below min_energy of the median tile, or None if
+       there are none'''
+    energy, rows, cols = tile_energy(grad, tiles)
+    featureless = energy < min_energy * np.median(energy)
+    if not featureless.any():
+        return None
+    mask = np.full(grad.shape, 255, dtype=np.uint8)
+    for row, col in zip(*np.nonzero(featureless)):
+        mask[rows[row]:rows[row + 1], cols[col]:cols[col + 1]] = 0
+    return mask
+
+def find_transform_ecc(template, image, warp_matrix, warp_mode, criteria, input_mask=None):
+    '''cv2.findTransformECC, passing the optional input mask to the OpenCV 3 or 4 signature'''
+    if input_mask is None:
+        return cv2.findTransformECC(template, image, warp_matrix, warp_mode, criteria)
+    if int(cv2.__version__.split('.')[0]) >= 4:
+        # OpenCV 4 also requires the Gaussian filter size, which defaults to 5
+        return cv2.findTransformECC(template, image, warp_matrix, warp_mode, criteria, input_mask, 5)
+    return cv2.findTransformECC(template, image, warp_matrix, warp_mode, criteria, input_mask)
+
+def _offset_warp(warp_matrix, offset):
+    '''The warp matrix from the coordinates of a window at offset (x, y) in the template'''
+    shift = np.array([[1, 0, offset[0]], [0, 1, offset[1]], [0, 0, 1]], dtype=np.float64)
+    if warp_matrix.shape == (2, 3):
+        return np.dot(warp_matrix, shift).astype(np.float32)
+    warped = np.dot(warp_matrix, shift)
+    return (warped / warped[2, 2]).astype(np.float32)
+
+def ecc_level(grad1, grad2, warp_matrix, warp_mode, criteria, texture_coverage=None):
+    '''Run ECC at one pyramid level. With texture_coverage, only the window of the template with
+       the most gradient energy covering that fraction of it is matched, which reduces the cost
+       of each iteration in proportion, and featureless input tiles are masked out'''
+    if texture_coverage is None or texture_coverage >= 1:
+        return find_transform_ecc(grad1, grad2, warp_matrix, warp_mode, criteria)
+    left, top, width, height = texture_window(grad1, texture_coverage)
+    template = np.ascontiguousarray(grad1[top:top+height, left:left+width])
+    cc, window_warp = find_transform_ecc(template, grad2, _offset_warp(warp_matrix, (left, top)),
+                                         warp_mode, criteria, texture_mask(grad2))
+    return cc, _offset_warp(window_warp, (-left, -top))
+
+def level_schedule(value, levels):
+    '''Per pyramid level values, coarsest level first, from a single value or from a sequence
+       whose last value is repeated for any remaining levels'''
+    if np.isscalar(value):
+        return [value]*levels
+    values = list(value)
+    if len(values) == 0:
+        raise ValueError("Provide at least one value for the pyramid levels")
+    return (values + [values[-1]]*levels)[:levels]
+
+def scale_warp_matrix(warp_matrix, warp_mode, factor):
+    '''Scale a warp matrix between pyramid levels, for images scaled up by factor'''
+    if warp_mode == cv2.MOTION_HOMOGRAPHY:
+        return warp_matrix * np.array([[1,1,factor],[1,1,factor],[1.0/factor,1.0/factor,1]], dtype=np.float32)
+    return warp_matrix * np.array([[1,1,factor],[1,1,factor]], dtype=np.float32)
+
+@instrumentation.timed('align')
 def align(pair):
     """ Determine an alignment matrix between two images
     @input:
     Dictionary of the following form:
     {
         'warp_mode':  cv2.MOTION_* (MOTION_AFFINE, MOTION_HOMOGRAPHY)
-        'max_iterations': Maximum number of solver iterations
-        'epsilon_threshold': Solver stopping threshold
+        'max_iterations': Maximum number of solver iterations, or a list per pyramid level (coarsest first)
+        'epsilon_threshold': Solver stopping threshold, or a list per pyramid level (coarsest first)
         'ref_index': index of reference image
         'match_index': index of image to match to reference
+        'texture_coverage': optional fraction of each frame to match, see ecc_level
+        'cc_threshold': optional; skip the finer levels once the correlation coefficient changes
+                        less than this between levels
+        'converged_px': optional; skip the finer levels once a level after the first moves the warp
+                        less than this many full resolution pixels
     }
     @returns:
     Dictionary of the following form:
@@ -87,6 +172,8 @@ def align(pair):
         'ref_index': index of reference image
         'match_index': index of image to match to reference
         'warp_matrix': transformation matrix to use to map match image to reference image frame
+        'cc': correlation coefficient achieved at the last level run
+        'pyramid_level': last level run, where the number of levels is full resolution
     }
 
     Major props to Alexander Reynolds ( https://stackoverflow.com/users/5087436/alexander-reynolds ) for his
@@ -122,7 +209,10 @@ def align(pair):
     warp_matrix[0][2] /= (2**nol)
     warp_matrix[1][2] /= (2**nol)
 
+    cc = 1.0
+    finest_level = nol
     if ref_index != match_index:
+        from skimage.filters import gaussian
 
         show_debug_images = pair['debug']
         # construct grayscale pyramid
@@ -142,10 +232,15 @@ def align(pair):
             gray2_pyr.insert(0, cv2.resize(gray2_pyr[0], None, fx=1/2, fy=1/2,
                                         interpolation=cv2.INTER_AREA))
 
-        # Terminate the optimizer if either the max iterations or the threshold are reached
-        criteria = (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, max_iterations, epsilon_threshold)
+        iterations = level_schedule(max_iterations, nol+1)
+        epsilons = level_schedule(epsilon_threshold, nol+1)
+        cc_threshold = pair.get('cc_threshold')
+        converged_px = pair.get('converged_px')
+        cc = None
         # run pyramid ECC
         for level in range(nol+1):
+            # Terminate the optimizer if either the max iterations or the threshold are reached
+            criteria = (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, int(iterations[level]), epsilons[level])
             grad1 = gradient(gray1_pyr[level])
             grad2 = gradient(gray2_pyr[level])
 
@@ -157,22 +252,38 @@ def align(pair):
                 plotutils.plotwithcolorbar(grad2, "match grad level {}".format(level))
                 print("Starting warp for level {} is:\n {}".format(level,warp_matrix))
 
-            cc, warp_matrix = cv2.findTransformECC(grad1, grad2, warp_matrix, warp_mode, criteria)
+            previous_cc, previous_warp = cc, warp_matrix
+            cc, warp_matrix = ecc_level(grad1, grad2, warp_matrix, warp_mode, criteria, pair.get('texture_coverage'))
+            finest_level = level
 
             if show_debug_images:
                 print("Warp after alignment level {} is \n{}".format(level,warp_matrix))
 
-            if level != nol:  # scale up only the offset by a factor of 2 for the next (larger image) pyramid level
-                if warp_mode == cv2.MOTION_HOMOGRAPHY:
-                    warp_matrix = warp_matrix * np.array([[1,1,2],[1,1,2],[0.5,0.5,1]], dtype=np.float32)
-                else:
-                    warp_matrix = warp_matrix * np.array([[1,1,2],[1,1,2]], dtype=np.float32)
-
-                
+            if level != nol:
+                converged = False
+                # the first level starts from the initial warp, which is often already close, so
+                # it is always refined at least once more before the finer levels can be skipped
+                if converged_px is not None and level > 0:
+                    # the change of the warp at this level, in full resolution pixels
+                    height, width = gray1_pyr[level].shape[:2]
+                    moved = warp_residual(previous_warp, warp_matrix, (width, height)) * 2**(nol - level)
+                    converged = moved < converged_px
+                if cc_threshold is not None and previous_cc is not None:
+                    converged = converged or abs(cc - previous_cc) < cc_threshold
+                if converged:
+                    if show_debug_images:
+                        print("Converged at level {}, skipping the finer levels".format(level))
+                    # scale up to full resolution
+                    warp_matrix = scale_warp_matrix(warp_matrix, warp_mode, 2**(nol - level))
+                    break
+                # scale up only the offset by a factor of 2 for the next (larger image) pyramid level
+                warp_matrix = scale_warp_matrix(warp_matrix, warp_mode, 2)
 
     return {'ref_index': pair['ref_index'],
             'match_index': pair['match_index'],
-            'warp_matrix': warp_matrix }
+            'warp_matrix': warp_matrix,
+            'cc': cc,
+            'pyramid_level': finest_level}
 
 def default_warp_matrix(warp_mode):
     if warp_mode == cv2.MOTION_HOMOGRAPHY:
@@ -180,14 +291,9 @@ def default_warp_matrix(warp_mode):
     else:
         return np.array([[1,0,0],[0,1,0]], dtype=np.float32)
 
-def align_capture(capture, ref_index=1, warp_mode=cv2.MOTION_HOMOGRAPHY, max_iterations=2500, epsilon_threshold=1e-9, multithreaded=True, debug=False, pyramid_levels = None):
-    '''Align images in a capture using openCV
-    MOTION_TRANSLATION sets a translational motion model; warpMatrix is 2x3 with the first 2x2 part being the unity matrix and the rest two parameters being estimated.
-    MOTION_EUCLIDEAN sets a Euclidean (rigid) transformation as motion model; three parameters are estimated; warpMatrix is 2x3.
-    MOTION_AFFINE sets an affine motion model (DEFAULT); six parameters are estimated; warpMatrix is 2x3.
-    MOTION_HOMOGRAPHY sets a homography as a motion model; eight parameters are estimated;`warpMatrix` is 3x3.
-    best results will be AFFINE and HOMOGRAPHY, at the expense of speed
-    '''
+def capture_alignment_pairs(capture, ref_index=1, warp_mode=cv2.MOTION_HOMOGRAPHY, max_iterations=2500, epsilon_threshold=1e-9, debug=False, pyramid_levels=None,
+                            texture_coverage=None, cc_threshold=None, converged_px=None):
+    '''The align() inputs of the non-LWIR bands of a capture, see align_capture'''
     # Match other bands to this reference image (index into capture.images[])
     ref_img = capture.images[ref_index].undistorted(capture.images[ref_index].radiance()).astype('float32')
     
@@ -213,9 +319,14 @@ def align_capture(capture, ref_index=1, warp_mode=cv2.MOTION_HOMOGRAPHY, max_ite
                                     'translations': translations,
                                     'warp_matrix_init': np.array(warp_matrices_init[i], dtype=np.float32),
                                     'debug': debug,
-                                    'pyramid_levels': pyramid_levels})
-    warp_matrices = [None]*len(alignment_pairs)
-
+                                    'pyramid_levels': pyramid_levels,
+                                    'texture_coverage': texture_coverage,
+                                    'cc_threshold': cc_threshold,
+                                    'converged_px': converged_px})
+    return alignment_pairs
+
+def align_pairs(alignment_pairs, multithreaded=True):
+    '''Run align() on each pair, on a process pool if multithreaded, returning the results in order'''
     #required to work across linux/mac/windows, see https://stackoverflow.com/questions/47852237
     if multithreaded and multiprocessing.get_start_method() != 'spawn':
         try:
@@ -223,10 +334,11 @@ def align_capture(capture, ref_index=1, warp_mode=cv2.MOTION_HOMOGRAPHY, max_ite
         except ValueError:
             multithreaded = False
 
+    results = []
     if(multithreaded):
         pool = multiprocessing.Pool(processes=multiprocessing.cpu_count())
-        for _,mat in enumerate(pool.imap_unordered(align, alignment_pairs)):
-            warp_matrices[mat['match_index']] = mat['warp_matrix']
+        for mat in pool.imap(align, alignment_pairs):
+            results.append(mat)
             print("Finished aligning band {}".format(mat['match_index']))
         pool.close()
         pool.join()
@@ -234,11 +346,35 @@ def align_capture(capture, ref_index=1, warp_mode=cv2.MOTION_HOMOGRAPHY, max_ite
         # Single-threaded alternative
         for pair in alignment_pairs:
             mat = align(pair)
-            warp_matrices[mat['match_index']] = mat['warp_matrix']
+            results.append(mat)
             print("Finished aligning band {}".format(mat['match_index']))
+    return results
+
+@instrumentation.timed('align_capture')
+def align_capture(capture, ref_index=1, warp_mode=cv2.MOTION_HOMOGRAPHY, max_iterations=2500, epsilon_threshold=1e-9, multithreaded=True, debug=False, pyramid_levels = None,
+                  texture_coverage=None, cc_threshold=None, converged_px=None):
+    '''Align images in a capture using openCV
+    MOTION_TRANSLATION sets a translational motion model; warpMatrix is 2x3 with the first 2x2 part being the unity matrix and the rest two parameters being estimated.
+    MOTION_EUCLIDEAN sets a Euclidean (rigid) transformation as motion model; three parameters are estimated; warpMatrix is 2x3.
+    MOTION_AFFINE sets an affine motion model (DEFAULT); six parameters are estimated; warpMatrix is 2x3.
+    MOTION_HOMOGRAPHY sets a homography as a motion model; eight parameters are estimated;`warpMatrix` is 3x3.
+    best results will be AFFINE and HOMOGRAPHY, at the expense of speed
+    texture_coverage (e.g. 0.5) matches only the most textured window of that fraction of each frame, see ecc_level
+    max_iterations and epsilon_threshold may be lists per pyramid level, coarsest first; cc_threshold and
+    converged_px skip the finer levels once the alignment has converged, see align
+    The correlation coefficient achieved for each band is stored as 'cc' in its alignment pair
+    '''
+    alignment_pairs = capture_alignment_pairs(capture, ref_index, warp_mode, max_iterations, epsilon_threshold, debug, pyramid_levels,
+                                              texture_coverage, cc_threshold, converged_px)
+    warp_matrices = [None]*len(alignment_pairs)
+    for pair, mat in zip(alignment_pairs, align_pairs(alignment_pairs, multithreaded)):
+        warp_matrices[mat['match_index']] = mat['warp_matrix']
+        pair['cc'] = mat['cc']
 
     if capture.images[-1].band_name == 'LWIR':
+        ref_img = alignment_pairs[0]['ref_image']
         img = capture.images[-1]
+        translations = img.rig_xy_offset_in_px() if img.rig_relatives is not None else (0,0)
         alignment_pairs.append({'warp_mode': warp_mode,
                                 'max_iterations': max_iterations,
                                 'epsilon_threshold': epsilon_threshold,
@@ -247,32 +383,224 @@ def align_capture(capture, ref_index=1, warp_mode=cv2.MOTION_HOMOGRAPHY, max_ite
                                 'match_index':img.band_index,
                                 'match_image':img.undistorted(img.radiance()).astype('float32'),
                                 'translations': translations,
-                                'debug': debug})
+                                'debug': debug,
+                                'cc': None})
         warp_matrices.append(capture.get_warp_matrices(ref_index)[-1])
     return warp_matrices, alignment_pairs
 
+def texture_score(im, ksize=3):
+    '''Mean gradient magnitude of an image relative to its mean, a cheap measure of the structure
+       available to align it which does not depend on the exposure'''
+    im = np.asarray(im, dtype=np.float32)
+    mean = float(np.mean(im))
+    if mean <= 0:
+        return 0.0
+    grad_x = cv2.Sobel(im, cv2.CV_32F, 1, 0, ksize=ksize)
+    grad_y = cv2.Sobel(im, cv2.CV_32F, 0, 1, ksize=ksize)
+    return float(0.5 * (np.mean(np.absolute(grad_x)) + np.mean(np.absolute(grad_y))) / mean)
+
+def capture_texture_score(capture, factor=8):
+    '''The lowest texture_score of the non-LWIR bands of a capture, decimated by factor'''
+    import micasense.quicklook as quicklook
+    return min(texture_score(quicklook.approximate_radiance(img, factor))
+               for img in capture.images if img.band_name != 'LWIR')
+
+def gradient_magnitude(im, ksize=3):
+    '''Sum of the absolute horizontal and vertical Sobel gradients of an image'''
+    im = np.asarray(im, dtype=np.float32)
+    return np.absolute(cv2.Sobel(im, cv2.CV_32F, 1, 0, ksize=ksize)) + \
+           np.absolute(cv2.Sobel(im, cv2.CV_32F, 0, 1, ksize=ksize))
+
+def _peak_offset(response, margin=1):
+    # sub-pixel location of the response peak relative to the response center, by parabola fits,
+    # searching for the peak inside a margin which is only used for the fits
+    inner = response[margin:response.shape[0]-margin, margin:response.shape[1]-margin]
+    y, x = np.unravel_index(np.argmax(inner), inner.shape)
+    y, x = y + margin, x + margin
+    offset = []
+    for position, values in ((x, response[y, :]), (y, response[:, x])):
+        delta = 0.0
+        curvature = values[position-1] - 2*values[position] + values[position+1]
+        if curvature < 0:
+            delta = np.clip(0.5 * (values[position-1] - values[position+1]) / curvature, -0.5, 0.5)
+        offset.append(position + delta - (len(values) - 1) / 2.0)
+    return tuple(offset)
+
+def gradient_shift(ref, im, search=2, border=0.05):
+    '''
+    Compare two aligned images by the normalized cross-correlation of their gradient magnitudes,
+    ignoring a border of that fraction of each side where warped images are undefined.
+    Returns the correlation at zero shift, the peak correlation over shifts of up to search pixels,
+    and the (dx, dy) shift of im relative to ref at that peak, in pixels
+    '''
+    grad_ref = gradient_magnitude(ref)
+    grad_im = gradient_magnitude(im)
+    height, width = grad_ref.shape
+    # one more pixel than the search, so a peak at the search limit can be refined
+    pad = search + 1
+    left = int(round(border * width)) + pad
+    top = int(round(border * height)) + pad
+    if width - 2*left < 8 or height - 2*top < 8:
+        raise ValueError("Images of {}x{} are too small to compare".format(width, height))
+    template = grad_ref[top:height-top, left:width-left]
+    window = grad_im[top-pad:height-top+pad, left-pad:width-left+pad]
+    response = cv2.matchTemplate(window, template, cv2.TM_CCOEFF_NORMED)
+    return float(response[pad, pad]), float(response[1:-1, 1:-1].max()), _peak_offset(response)
+
+def alignment_quality(capture, warp_matrices, ref_index=1, factor=8, search=2, border=0.05):
+    '''
+    Score how well warp_matrices (as from align_capture or Capture.get_warp_matrices) align a capture
+    without warping the full resolution images. The bands are decimated by factor with
+    quicklook.approximate_radiance, warped to the reference band and compared to it with gradient_shift.
+    Lens distortion is not corrected, which is well below a pixel of the decimated images.
+    Returns a list of dictionaries per band, or None for LWIR bands:
+    {
+        'cc': gradient correlation with the reference band as aligned
+        'peak_cc': gradient correlation at the best shift of up to search decimated pixels
+        'residual_px': (dx, dy) shift of the aligned band relative to the reference band at the peak,
+                       in full resolution pixels
+    }
+    '''
+    import micasense.quicklook as quicklook
+    ref = quicklook.approximate_radiance(capture.images[ref_index], factor)
+    size = (ref.shape[1], ref.shape[0])
+    quality = []
+    for i, (img, warp_matrix) in enumerate(zip(capture.images, warp_matrices)):
+        if img.band_name == 'LWIR':
+            quality.append(None)
+            continue
+        if i == ref_index:
+            quality.append({'cc': 1.0, 'peak_cc': 1.0, 'residual_px': (0.0, 0.0)})
+            continue
+        band = cv2.warpPerspective(quicklook.approximate_radiance(img, factor),
+                                   quicklook.scaled_warp_matrix(_homography(warp_matrix), factor),
+                                   size,
+                                   flags=cv2.INTER_LINEAR + cv2.WARP_INVERSE_MAP)
+        cc, peak_cc, (dx, dy) = gradient_shift(ref, band, search, border)
+        quality.append({'cc': cc, 'peak_cc': peak_cc, 'residual_px': (dx * factor, dy * factor)})
+    return quality
+
+def needs_realignment(quality, max_residual_px=4.0, min_cc=None):
+    '''Whether the alignment_quality of a capture shows a band shifted by more than max_residual_px
+       full resolution pixels, or correlating below min_cc, so its warp matrices should be recomputed'''
+    for band in quality:
+        if band is None:
+            continue
+        if np.hypot(*band['residual_px']) > max_residual_px:
+            return True
+        if min_cc is not None and band['cc'] < min_cc:
+            return True
+    return False
+
+def _homography(warp_matrix):
+    warp_matrix = np.asarray(warp_matrix, dtype=np.float64)
+    if warp_matrix.shape == (2, 3):
+        warp_matrix = np.vstack([warp_matrix, [0, 0, 1]])
+    return warp_matrix / warp_matrix[2, 2]
+
+def warp_residual(warp_a, warp_b, size):
+    '''The largest distance in pixels between the image corners mapped by two warp matrices'''
+    width, height = size
+    corners = np.array([[[0, 0]], [[width-1, 0]], [[width-1, height-1]], [[0, height-1]]], dtype=np.float64)
+    offsets = cv2.perspectiveTransform(corners, _homography(warp_a)) - cv2.perspectiveTransform(corners, _homography(warp_b))
+    return float(np.max(np.linalg.norm(offsets, axis=2)))
+
+def combine_warp_matrices(sample_warp_matrices, size, max_residual_px=2.0):
+    '''Combine the per-band warp matrices of several captures into their element-wise median.
+       Samples whose corners land more than max_residual_px from the median are rejected and the
+       median is taken again over the rest. Returns the warp matrices, the (samples, bands)
+       residuals in pixels against them and the (samples, bands) flags of residuals within
+       max_residual_px'''
+    samples, bands = len(sample_warp_matrices), len(sample_warp_matrices[0])
+    warp_matrices = []
+    residuals = np.zeros((samples, bands))
+    inliers = np.zeros((samples, bands), dtype=bool)
+    for band in range(bands):
+        stack = np.array([sample[band] for sample in sample_warp_matrices], dtype=np.float64)
+        if stack.shape[1:] == (3, 3):
+            stack /= stack[:, 2:3, 2:3]
+        consensus = np.median(stack, axis=0)
+        band_residuals = np.array([warp_residual(warp, consensus, size) for warp in stack])
+        band_inliers = band_residuals <= max_residual_px
+        if band_inliers.any() and not band_inliers.all():
+            consensus = np.median(stack[band_inliers], axis=0)
+            band_residuals = np.array([warp_residual(warp, consensus, size) for warp in stack])
+        warp_matrices.append(consensus.astype(np.float32))
+        residuals[:, band] = band_residuals
+        inliers[:, band] = band_residuals <= max_residual_px
+    return warp_matrices, residuals, inliers
+
+@instrumentation.timed('align_flight')
+def align_flight(captures, samples=5, candidates=50, ref_index=1, warp_mode=cv2.MOTION_HOMOGRAPHY, max_iterations=2500,
+                 epsilon_threshold=1e-9, multithreaded=True, pyramid_levels=None, factor=8, max_residual_px=2.0,
+                 texture_coverage=None, cc_threshold=None, converged_px=None):
+    '''
+    Align the captures of a flight from a sample of them. Up to candidates captures, evenly spaced
+    through the flight, are scored with capture_texture_score, and the samples highest scoring
+    captures are aligned together on one process pool. The warp matrices of the samples are
+    combined with combine_warp_matrices, rejecting samples more than max_residual_px away.
+
+    Returns the warp matrices, as from align_capture, and a dictionary of the sampled 'captures',
+    their texture 'scores', the (samples, bands) 'residuals' and 'inliers' of combine_warp_matrices
+    and the 'alignment_pairs' of the samples
+    '''
+    if len(captures) == 0:
+        raise ValueError("No captures to align")
+    indices = np.unique(np.linspace(0, len(captures) - 1, min(candidates, len(captures))).round().astype(int))
+    scores = dict((i, capture_texture_score(captures[i], factor)) for i in indices)
+    chosen = sorted(indices, key=lambda i: scores[i], reverse=True)[:samples]
+    sampled = [captures[i] for i in chosen]
+
+    alignment_pairs = [capture_alignment_pairs(cap, ref_index, warp_mode, max_iterations, epsilon_threshold,
+                                               pyramid_levels=pyramid_levels, texture_coverage=texture_coverage,
+                                               cc_threshold=cc_threshold, converged_px=converged_px)
+                       for cap in sampled]
+    results = align_pairs([pair for pairs in alignment_pairs for pair in pairs], multithreaded)
+    sample_warp_matrices = []
+    for pairs in alignment_pairs:
+        warp_matrices = [None]*len(pairs)
+        for pair, mat in zip(pairs, results[:len(pairs)]):
+            warp_matrices[mat['match_index']] = mat['warp_matrix']
+            pair['cc'] = mat['cc']
+        results = results[len(pairs):]
+        sample_warp_matrices.append(warp_matrices)
+
+    warp_matrices, residuals, inliers = combine_warp_matrices(sample_warp_matrices, sampled[0].images[0].size(),
+                                                              max_residual_px)
+    if sampled[0].images[-1].band_name == 'LWIR':
+        warp_matrices.append(sampled[0].get_warp_matrices(ref_index)[-1])
+    return warp_matrices, {'captures': sampled,
+                           'scores': [scores[i] for i in chosen],
+                           'residuals': residuals,
+                           'inliers': inliers,
+                           'alignment_pairs': alignment_pairs}
+
 #apply homography to create an aligned stack
+@instrumentation.timed('aligned_capture')
 def aligned_capture(capture, warp_matrices, warp_mode, cropped_dimensions, match_index, img_type = 'reflectance',interpolation_mode=cv2.INTER_LANCZOS4):
     width, height = capture.images[0].size()
 
     im_aligned = np.zeros((height,width,len(warp_matrices)), dtype=np.float32 )
 
-    for i in range(0,len(warp_matrices)):
+    def warp_band(image, i, warp_matrix):
         if img_type == 'reflectance':
-            img = capture.images[i].undistorted_reflectance()
+            img = image.undistorted_reflectance()
         else:
-            img = capture.images[i].undistorted_radiance()
+            img = image.undistorted_radiance()
 
         if warp_mode != cv2.MOTION_HOMOGRAPHY:
             im_aligned[:,:,i] = cv2.warpAffine(img,
-                                            warp_matrices[i],
+                                            warp_matrix,
                                             (width,height),
                                             flags=interpolation_mode + cv2.WARP_INVERSE_MAP)
         else:
             im_aligned[:,:,i] = cv2.warpPerspective(img,
-                                                warp_matrices[i],
+                                                warp_matrix,
                                                 (width,height),
                                                 flags=interpolation_mode + cv2.WARP_INVERSE_MAP)
+
+    # the bands are warped concurrently if the capture band thread pool is enabled
+    capture.map_bands(warp_band, range(len(warp_matrices)), warp_matrices)
     (left, top, w, h) = tuple(int(i) for i in cropped_dimensions)
     im_cropped = im_aligned[top:top+h, left:left+w][:]
 
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+MicaSense Spectral Index Utilities
+
+    Normalized difference indices (NDVI, NDRE, ...) over aligned band stacks,
+    such as those returned by Capture.create_aligned_capture
+
+Copyright 2019 MicaSense, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in the
+Software without restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import numpy as np
+
+# normalized difference indices as (a, b) band names for (a - b) / (a + b); band names
+# are matched case-insensitively against the image band names
+NORMALIZED_DIFFERENCES = {
+    'ndvi': ('nir', 'red'),
+    'ndre': ('nir', 'red edge'),
+    'gndvi': ('nir', 'green'),
+    'bndvi': ('nir', 'blue'),
+    'ndwi': ('green', 'nir'),
+}
+
+def band_pairs(band_names, names):
+    ''' Look up the (a, b) stack band indices of each index name '''
+    lookup = dict((band.lower(), i) for i, band in enumerate(band_names))
+    pairs = {}
+    for name in names:
+        try:
+            band_a, band_b = NORMALIZED_DIFFERENCES[name.lower()]
+        except KeyError:
+            raise ValueError("Unknown index {}, expected one of {}".format(name, sorted(NORMALIZED_DIFFERENCES)))
+        if band_a not in lookup or band_b not in lookup:
+            raise ValueError("Index {} requires the {} and {} bands".format(name, band_a, band_b))
+        pairs[name] = (lookup[band_a], lookup[band_b])
+    return pairs
+
+def normalized_differences(stack, band_names, names=('ndvi', 'ndre'), mask=None, fill_value=np.nan,
+                           tile_rows=256, histogram_bins=None, histogram_range=(-1.0, 1.0), out=None):
+    '''
+    Compute normalized difference indices of a (rows, cols, bands) stack in one pass over
+    row tiles, so temporaries are bounded by the tile size. Indices over the same pair of
+    bands (e.g. GNDVI and NDWI) share their difference and sum terms.
+
+    mask is an optional (rows, cols) boolean array of pixels to compute; other pixels, and
+    pixels where both bands are zero, are set to fill_value. out is an optional dictionary
+    of preallocated float32 (rows, cols) outputs by index name.
+
+    Returns a dictionary of float32 index images by name, and a dictionary of
+    (counts, bin_edges) histograms of the computed pixels if histogram_bins is given.
+    '''
+    pairs = band_pairs(band_names, names)
+    rows, cols = stack.shape[:2]
+    if mask is not None and mask.shape != (rows, cols):
+        raise ValueError("Mask shape {} does not match the stack shape {}".format(mask.shape, (rows, cols)))
+    if out is None:
+        out = {}
+    for name in names:
+        if name not in out:
+            out[name] = np.empty((rows, cols), dtype=np.float32)
+        elif out[name].shape != (rows, cols):
+            raise ValueError("Output {} has shape {}, expected {}".format(name, out[name].shape, (rows, cols)))
+
+    histograms = {}
+    if histogram_bins is not None:
+        bin_edges = np.linspace(histogram_range[0], histogram_range[1], histogram_bins + 1)
+        histograms = dict((name, np.zeros(histogram_bins, dtype=np.int64)) for name in names)
+
+    # per-tile scratch: the difference and sum of each distinct band pair
+    tile_rows = max(1, min(tile_rows, rows))
+    terms = {}
+    for pair in set(tuple(sorted(pair)) for pair in pairs.values()):
+        terms[pair] = (np.empty((tile_rows, cols), dtype=np.float32),
+                       np.empty((tile_rows, cols), dtype=np.float32))
+    valid = np.empty((tile_rows, cols), dtype=bool)
+    invalid = np.empty((tile_rows, cols), dtype=bool)
+
+    for top in range(0, rows, tile_rows):
+        bottom = min(top + tile_rows, rows)
+        count = bottom - top
+        for (band_a, band_b), (difference, total) in terms.items():
+            np.subtract(stack[top:bottom, :, band_a], stack[top:bottom, :, band_b],
+                        out=difference[:count], dtype=np.float32, casting='same_kind')
+            np.add(stack[top:bottom, :, band_a], stack[top:bottom, :, band_b],
+                   out=total[:count], dtype=np.float32, casting='same_kind')
+        for name in names:
+            band_a, band_b = pairs[name]
+            difference, total = terms[tuple(sorted((band_a, band_b)))]
+            difference, total = difference[:count], total[:count]
+            tile_valid, tile_invalid = valid[:count], invalid[:count]
+            result = out[name][top:bottom]
+            np.not_equal(total, 0, out=tile_valid)
+            if mask is not None:
+                np.logical_and(tile_valid, mask[top:bottom], out=tile_valid)
+            np.divide(difference, total, out=result, where=tile_valid)
+            if band_a > band_b:
+                # the shared difference term is for the bands in stack order
+                np.negative(result, out=result, where=tile_valid)
+            np.logical_not(tile_valid, out=tile_invalid)
+            result[tile_invalid] = fill_value
+            if histogram_bins is not None:
+                counts, _ = np.histogram(result[tile_valid], bins=bin_edges)
+                histograms[name] += counts
+
+    if histogram_bins is not None:
+        histograms = dict((name, (counts, bin_edges)) for name, counts in histograms.items())
+    return out, histograms
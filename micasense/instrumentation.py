@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+MicaSense Pipeline Instrumentation
+
+    Opt-in timing and output size records of the processing stages, which can be
+    aggregated into a per-stage and per-capture profile of a flight
+
+Copyright 2019 MicaSense, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in the
+Software without restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import contextlib
+import functools
+import time
+
+# Instrumentation is off by default; stages then only cost a flag check
+enabled = False
+records = []
+
+def enable(clear_records=True):
+    ''' Start recording stages, by default discarding earlier records '''
+    global enabled
+    if clear_records:
+        clear()
+    enabled = True
+
+def disable():
+    global enabled
+    enabled = False
+
+def clear():
+    del records[:]
+
+def output_bytes(value):
+    ''' The size of an array, or of a list or tuple of arrays '''
+    if hasattr(value, 'nbytes'):
+        return int(value.nbytes)
+    if isinstance(value, (list, tuple)):
+        return sum(output_bytes(item) for item in value)
+    return 0
+
+def capture_id_of(obj):
+    ''' The capture id of an Image, Capture, Panel or Metadata object, or None '''
+    for candidate in (obj, getattr(obj, 'image', None)):
+        for name in ('capture_id', 'uuid'):
+            value = getattr(candidate, name, None)
+            if callable(value):
+                try:
+                    value = value()
+                except Exception:
+                    value = None
+            if value is not None:
+                return value
+    return None
+
+@contextlib.contextmanager
+def stage(name, capture_id=None, **fields):
+    '''
+    Record the duration of a block as {'stage', 'capture_id', 'seconds', 'bytes', 'start', ...}.
+    The record (None when disabled) is yielded so the block can set its output 'bytes'
+    or other fields
+    '''
+    if not enabled:
+        yield None
+        return
+    record = {'stage': name, 'capture_id': capture_id, 'bytes': 0, 'start': time.time()}
+    record.update(fields)
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record['seconds'] = time.perf_counter() - start
+        records.append(record)
+
+def timed(name, capture_id=capture_id_of):
+    '''
+    Decorate a function or method to record each call as a stage. The capture id is taken
+    from the first argument (e.g. self) after the call, using the capture_id function
+    '''
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            with stage(name) as record:
+                result = func(*args, **kwargs)
+                record['bytes'] = output_bytes(result)
+            if args and capture_id is not None:
+                record['capture_id'] = capture_id(args[0])
+            return result
+        return wrapper
+    return decorator
+
+def report(stage_records=None):
+    '''
+    Aggregate records (by default, all recorded so far) into per-stage totals and per-capture
+    seconds by stage. Nested stages are each counted, so stage totals can overlap
+    '''
+    if stage_records is None:
+        stage_records = list(records)
+    stages = {}
+    captures = {}
+    for record in stage_records:
+        totals = stages.setdefault(record['stage'], {'count': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'bytes': 0})
+        totals['count'] += 1
+        totals['seconds'] += record['seconds']
+        totals['max_seconds'] = max(totals['max_seconds'], record['seconds'])
+        totals['bytes'] += record['bytes']
+        if record['capture_id'] is not None:
+            capture_stages = captures.setdefault(record['capture_id'], {})
+            capture_stages[record['stage']] = capture_stages.get(record['stage'], 0.0) + record['seconds']
+    for totals in stages.values():
+        totals['mean_seconds'] = totals['seconds'] / totals['count']
+    return {'stages': stages, 'captures': captures}
+
+def format_report(flight_report=None):
+    ''' A text table of the per-stage totals of a report, slowest first '''
+    if flight_report is None:
+        flight_report = report()
+    stages = flight_report['stages']
+    lines = ['{:<32} {:>7} {:>11} {:>11} {:>11} {:>11}'.format('stage', 'count', 'total s', 'mean s', 'max s', 'MB')]
+    for name in sorted(stages, key=lambda name: -stages[name]['seconds']):
+        totals = stages[name]
+        lines.append('{:<32} {:>7d} {:>11.3f} {:>11.4f} {:>11.4f} {:>11.1f}'.format(
+            name, totals['count'], totals['seconds'], totals['mean_seconds'],
+            totals['max_seconds'], totals['bytes'] / 2.0**20))
+    lines.append('{} captures'.format(len(flight_report['captures'])))
+    return '\n'.join(lines)
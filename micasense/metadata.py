@@ -31,8 +31,11 @@ import pytz
 import os
 import math
 
+import micasense.instrumentation as instrumentation
+
 class Metadata(object):
     ''' Container for Micasense image metadata'''
+    @instrumentation.timed('metadata')
     def __init__(self, filename, exiftoolPath=None, exiftool_obj=None):
         if exiftool_obj is not None:
             self.exif = exiftool_obj.get_metadata(filename)
@@ -358,3 +361,149 @@ class Metadata(object):
     def panel_serial(self):
         ''' The panel serial number as extracted from the image by the camera '''
         return self.get_item('XMP:PanelSerial')
+
+def _hashable(value):
+    ''' convert metadata lists (and lists of lists) to tuples so they can be hashed and shared '''
+    if isinstance(value, (list, tuple)):
+        return tuple(_hashable(v) for v in value)
+    return value
+
+class BandCalibration(object):
+    ''' Calibration which is constant for every image taken by one camera band.
+        Instances are interned, so all of the images of a band share one object;
+        use BandCalibration.intern() rather than creating them directly '''
+    __slots__ = ('camera_make',
+                 'camera_model',
+                 'band_name',
+                 'band_index',
+                 'center_wavelength',
+                 'bandwidth',
+                 'bits_per_pixel',
+                 'image_size',
+                 'radiometric_cal',
+                 'vignette_center',
+                 'vignette_polynomial',
+                 'distortion_parameters',
+                 'principal_point',
+                 'focal_plane_resolution_px_per_mm',
+                 'focal_length',
+                 'focal_length_35',
+                 'rig_relatives')
+    __interned = {}
+
+    def __init__(self, **values):
+        for name in self.__slots__:
+            setattr(self, name, _hashable(values.get(name)))
+
+    def key(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def as_dict(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+    @classmethod
+    def intern(cls, **values):
+        ''' Get the shared calibration instance with these values '''
+        calibration = cls(**values)
+        return cls.__interned.setdefault(calibration.key(), calibration)
+
+    @classmethod
+    def from_metadata(cls, meta):
+        radiometric_cal = None
+        if meta.supports_radiometric_calibration():
+            radiometric_cal = meta.radiometric_cal()
+        return cls.intern(camera_make=meta.camera_make(),
+                          camera_model=meta.camera_model(),
+                          band_name=meta.band_name(),
+                          band_index=meta.band_index(),
+                          center_wavelength=meta.center_wavelength(),
+                          bandwidth=meta.bandwidth(),
+                          bits_per_pixel=meta.bits_per_pixel(),
+                          image_size=meta.image_size(),
+                          radiometric_cal=radiometric_cal,
+                          vignette_center=meta.vignette_center(),
+                          vignette_polynomial=meta.vignette_polynomial(),
+                          distortion_parameters=meta.distortion_parameters(),
+                          principal_point=meta.principal_point(),
+                          focal_plane_resolution_px_per_mm=meta.focal_plane_resolution_px_per_mm(),
+                          focal_length=meta.focal_length_mm(),
+                          focal_length_35=meta.focal_length_35_mm_eq(),
+                          rig_relatives=meta.rig_relatives())
+
+    def replace(self, **changes):
+        ''' Get the shared calibration with some values changed, e.g. external rig relatives '''
+        values = self.as_dict()
+        values.update(changes)
+        return self.intern(**values)
+
+class ImageRecord(object):
+    ''' Compact per-image pose, exposure and irradiance metadata '''
+    __slots__ = ('utc_time',
+                 'latitude',
+                 'longitude',
+                 'altitude',
+                 'capture_id',
+                 'flight_id',
+                 'black_level',
+                 'exposure_time',
+                 'gain',
+                 'dls_present',
+                 'dls_yaw',
+                 'dls_pitch',
+                 'dls_roll',
+                 'spectral_irradiance',
+                 'horizontal_irradiance',
+                 'horizontal_irradiance_valid',
+                 'scattered_irradiance',
+                 'direct_irradiance',
+                 'solar_azimuth',
+                 'solar_elevation',
+                 'estimated_direct_vector',
+                 'auto_calibration_image',
+                 'panel_albedo',
+                 'panel_region',
+                 'panel_serial')
+
+    def __init__(self, **values):
+        for name in self.__slots__:
+            setattr(self, name, values.get(name))
+
+    def as_dict(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+    @classmethod
+    def from_metadata(cls, meta):
+        latitude, longitude, altitude = meta.position()
+        dls_yaw, dls_pitch, dls_roll = meta.dls_pose()
+        scattered_irradiance = meta.scattered_irradiance()
+        direct_irradiance = meta.direct_irradiance()
+        # only needed (and only defined for known camera models) when the DLS2 provides the
+        # direct and scattered components
+        horizontal_irradiance_valid = False
+        if scattered_irradiance != 0 and direct_irradiance != 0:
+            horizontal_irradiance_valid = meta.horizontal_irradiance_valid()
+        return cls(utc_time=meta.utc_time(),
+                   latitude=latitude,
+                   longitude=longitude,
+                   altitude=altitude,
+                   capture_id=meta.capture_id(),
+                   flight_id=meta.flight_id(),
+                   black_level=meta.black_level(),
+                   exposure_time=meta.exposure(),
+                   gain=meta.gain(),
+                   dls_present=meta.dls_present(),
+                   dls_yaw=dls_yaw,
+                   dls_pitch=dls_pitch,
+                   dls_roll=dls_roll,
+                   spectral_irradiance=meta.spectral_irradiance(),
+                   horizontal_irradiance=meta.horizontal_irradiance(),
+                   horizontal_irradiance_valid=horizontal_irradiance_valid,
+                   scattered_irradiance=scattered_irradiance,
+                   direct_irradiance=direct_irradiance,
+                   solar_azimuth=meta.solar_azimuth(),
+                   solar_elevation=meta.solar_elevation(),
+                   estimated_direct_vector=meta.estimated_direct_vector(),
+                   auto_calibration_image=meta.auto_calibration_image(),
+                   panel_albedo=meta.panel_albedo(),
+                   panel_region=meta.panel_region(),
+                   panel_serial=meta.panel_serial())
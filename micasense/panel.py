@@ -27,11 +27,9 @@ import math
 import numpy as np
 import cv2
 import re
-import pyzbar.pyzbar as pyzbar
 
-from skimage import measure
-import matplotlib.pyplot as plt
 import micasense.imageutils as imageutils
+import micasense.instrumentation as instrumentation
 
 class Panel(object):
 
@@ -78,6 +76,7 @@ class Panel(object):
         return self.image.band_name.upper() != 'LWIR'
 
     def __find_qr(self):
+        import pyzbar.pyzbar as pyzbar
         decoded = pyzbar.decode(self.gray8b, symbols=[pyzbar.ZBarSymbol.QRCODE])
         for symbol in decoded:
             serial_str = symbol.data.decode('UTF-8')
@@ -140,6 +139,7 @@ class Panel(object):
             self.__find_qr()
         return self.qr_bounds is not None
 
+    @instrumentation.timed('panel_corners')
     def panel_corners(self):
         """ get the corners of a panel region based on the qr code location 
             Our algorithm to do this uses a 'reference' qr code location and
@@ -195,6 +195,7 @@ class Panel(object):
         """Provide regional statistics for a image over a region
         Inputs: img is any image ndarray, region is a skimage shape
         Outputs: mean, std, count, and saturated count tuple for the region"""
+        from skimage import measure
         rev_panel_pts = np.fliplr(region) #skimage and opencv coords are reversed
         w, h = img.shape
         mask = measure.grid_points_in_poly((w,h),rev_panel_pts)
@@ -254,6 +255,7 @@ class Panel(object):
         return display_img
 
     def plot(self, figsize=(14,14)):
+        import matplotlib.pyplot as plt
         display_img = self.plot_image()
         fig, ax = plt.subplots(figsize=figsize)
         ax.imshow(display_img)
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+MicaSense Quick-Look Utilities
+
+    Fast low resolution RGB, CIR and NDVI browse images of captures and flights,
+    using decimated raw bands, approximate radiometry and rig-relative alignment
+
+Copyright 2019 MicaSense, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in the
+Software without restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import os
+import multiprocessing
+import cv2
+import numpy as np
+
+import micasense.image as image
+import micasense.capture as capture
+import micasense.indices as indices
+
+# bands of each product, as displayed red, green and blue
+PRODUCT_BANDS = {'rgb': ('red', 'green', 'blue'),
+                 'cir': ('nir', 'red', 'green'),
+                 'ndvi': ('nir', 'red')}
+
+def approximate_radiance(img, factor=8):
+    ''' Decimate the raw image by an integer factor and apply the radiometric calibration, with the
+        row gradient at the decimated pixel centers and the band vignette decimated alike.
+        Lens distortion is not corrected '''
+    raw = img.raw()
+    height, width = raw.shape
+    small = cv2.resize(raw, (width // factor, height // factor), interpolation=cv2.INTER_AREA).astype(np.float32)
+    if img.band_name == 'LWIR':
+        return (small - 273.15*100.0) * 0.01
+    # full resolution rows of the decimated pixel centers
+    y = ((np.arange(small.shape[0]) + 0.5) * factor - 0.5)[:, np.newaxis]
+    a1, a2, a3 = img.radiometric_cal[0], img.radiometric_cal[1], img.radiometric_cal[2]
+    V = cv2.resize(image.band_vignette(img.calibration), (small.shape[1], small.shape[0]), interpolation=cv2.INTER_AREA)
+    R = 1.0 / (1.0 + a2 * y / img.exposure_time - a3 * y)
+    L = V * R * (small - img.black_level)
+    L[L < 0] = 0
+    max_raw_dn = float(2**img.bits_per_pixel)
+    return (L * (a1 / (img.gain * img.exposure_time * max_raw_dn))).astype(np.float32)
+
+def scaled_warp_matrix(warp_matrix, factor):
+    ''' Convert a full resolution homography to one between images decimated by factor '''
+    scale = np.diag([1.0/factor, 1.0/factor, 1.0])
+    return np.dot(scale, np.dot(warp_matrix, np.linalg.inv(scale)))
+
+def _stretch(bands, gamma=1.4, min_percent=0.5, max_percent=99.5):
+    im_min, im_max = np.percentile(bands, (min_percent, max_percent))
+    stretched = np.clip((bands - im_min) / max(im_max - im_min, 1e-12), 0, 1)
+    if gamma != 0:
+        stretched = stretched**(1.0/gamma)
+    return (255*stretched).astype(np.uint8)
+
+def capture_quicklook(cap, factor=8, products=('rgb', 'cir', 'ndvi'), warp_matrices=None, irradiance_list=None):
+    '''
+    Render low resolution browse images of a capture, as a dictionary of uint8 (rows, cols, 3)
+    RGB images by product name. Bands are decimated by factor before any processing, and
+    aligned with warp_matrices (as from Capture.get_warp_matrices or imageutils.align_capture)
+    or, if not provided, with the rig relatives in the image metadata.
+    Reflectance uses irradiance_list, or the raw DLS irradiance if there is one
+    '''
+    band_lookup = dict((name.lower(), i) for i, name in enumerate(cap.band_names()))
+    for product in products:
+        if product not in PRODUCT_BANDS:
+            raise ValueError("Unknown quick-look product {}".format(product))
+        missing = [band for band in PRODUCT_BANDS[product] if band not in band_lookup]
+        if missing:
+            raise ValueError("Product {} requires the {} bands".format(product, ', '.join(missing)))
+    needed = sorted(set(band_lookup[band] for product in products for band in PRODUCT_BANDS[product]))
+
+    if warp_matrices is None:
+        if cap.has_rig_relatives():
+            warp_matrices = cap.get_warp_matrices()
+        else:
+            warp_matrices = [np.eye(3)] * len(cap.images)
+    width, height = cap.images[needed[0]].size()
+    size = (width // factor, height // factor)
+
+    stack = np.zeros((size[1], size[0], len(cap.images)), dtype=np.float32)
+    for i in needed:
+        img = cap.images[i]
+        band = approximate_radiance(img, factor)
+        if irradiance_list is not None:
+            band *= np.pi / irradiance_list[i]
+        elif img.spectral_irradiance:
+            band *= np.pi / img.spectral_irradiance
+        stack[:, :, i] = cv2.warpPerspective(band,
+                                             scaled_warp_matrix(warp_matrices[i], factor),
+                                             size,
+                                             flags=cv2.INTER_LINEAR + cv2.WARP_INVERSE_MAP)
+
+    quicklooks = {}
+    for product in products:
+        bands = [band_lookup[band] for band in PRODUCT_BANDS[product]]
+        if product == 'ndvi':
+            ndvi, _ = indices.normalized_differences(stack, cap.band_names(), names=('ndvi',), fill_value=0)
+            scaled = (255*np.clip(ndvi['ndvi'], 0, 1)).astype(np.uint8)
+            quicklooks[product] = cv2.cvtColor(cv2.applyColorMap(scaled, cv2.COLORMAP_JET), cv2.COLOR_BGR2RGB)
+        else:
+            quicklooks[product] = _stretch(stack[:, :, bands])
+    return quicklooks
+
+def capture_name(cap):
+    ''' The common file name prefix of a capture, e.g. IMG_0001, or its capture id '''
+    name = os.path.splitext(os.path.basename(cap.images[0].path))[0]
+    if '_' in name:
+        return name.rsplit('_', 1)[0]
+    return cap.uuid
+
+def save_quicklooks(cap, out_dir, extension='jpg', **kwargs):
+    ''' Write the quick-look images of a capture to out_dir as <capture name>_<product>.<extension>
+        and return their paths; see capture_quicklook for the options '''
+    paths = []
+    for product, rgb in capture_quicklook(cap, **kwargs).items():
+        path = os.path.join(out_dir, '{}_{}.{}'.format(capture_name(cap), product, extension))
+        cv2.imwrite(path, cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR))
+        paths.append(path)
+    return paths
+
+def _save_job(job):
+    # images are rebuilt from their metadata records, so workers do not run exiftool
+    records, out_dir, extension, kwargs = job
+    cap = capture.Capture([image.Image.from_records(*record) for record in records])
+    return save_quicklooks(cap, out_dir, extension, **kwargs)
+
+def flight_quicklooks(captures, out_dir, processes=None, extension='jpg', progress_callback=None, **kwargs):
+    '''
+    Write the quick-look images of a list of captures, or of an ImageSet, to out_dir using a pool
+    of processes (all cores if None; 1 to work in this process). Returns the written paths
+    '''
+    captures = getattr(captures, 'captures', captures)
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    jobs = [([(img.path, img.calibration, img.record) for img in cap.images], out_dir, extension, kwargs)
+            for cap in captures]
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    paths = []
+    if processes == 1:
+        results = (_save_job(job) for job in jobs)
+    else:
+        pool = multiprocessing.Pool(processes=processes)
+        results = pool.imap(_save_job, jobs, chunksize=4)
+    try:
+        for i, job_paths in enumerate(results):
+            paths.extend(job_paths)
+            if progress_callback is not None:
+                progress_callback(float(i+1)/float(len(jobs)))
+    finally:
+        if processes != 1:
+            pool.close()
+            pool.join()
+    return paths
@@ -0,0 +1,627 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+MicaSense Synthetic Flight Generator
+
+    Writes RedEdge and Altum flights of uncompressed TIFFs with the EXIF, GPS and XMP
+    tags read by micasense.metadata, for loading and scaling tests without real data.
+    Frames are rendered from a ground reflectance map through the inverse of the
+    radiometric model, so the processed reflectance of a flight is known.
+
+    python -m micasense.synthetic OUTPUT_DIR --captures 2000 --camera altum
+Copyright 2019 MicaSense, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in the
+Software without restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import argparse
+import datetime
+import fractions
+import math
+import multiprocessing
+import os
+import struct
+
+import cv2
+import numpy as np
+import pytz
+
+import micasense.dls as dls
+import micasense.image as image
+import micasense.metadata as metadata
+
+CAMERAS = {
+    'rededge': {'camera_model': 'RedEdge',
+                'software': 'v5.2.1',
+                'bands': 5,
+                'image_size': (1280, 960),
+                'focal_plane_resolution_px_per_mm': (266.6667, 266.6667),
+                'focal_length': 5.4,
+                'principal_point': (2.4, 1.8)},
+    'altum': {'camera_model': 'Altum',
+              'software': 'v1.3.0',
+              'bands': 6,
+              'image_size': (2064, 1544),
+              'focal_plane_resolution_px_per_mm': (345.6, 345.6),
+              'focal_length': 8.0,
+              'principal_point': (2.986, 2.234)},
+}
+# the Altum thermal band has its own optics
+LWIR_OPTICS = {'image_size': (160, 120),
+               'focal_plane_resolution_px_per_mm': (83.3333, 83.3333),
+               'focal_length': 1.77,
+               'principal_point': (0.96, 0.72)}
+BANDS = [('Blue', 475, 20), ('Green', 560, 20), ('Red', 668, 10), ('NIR', 840, 40), ('Red edge', 717, 10),
+         ('LWIR', 11000, 6000)]
+RIG_RELATIVES = [(0.0, 0.0, 0.0), (0.25, -0.1, 0.0), (-0.2, 0.15, 0.0), (0.3, 0.2, 0.0), (-0.15, -0.25, 0.0),
+                 (0.5, -0.3, 0.0)]
+
+# band reflectances of the two ground materials, mixed by the vegetation fraction of the ground map
+VEGETATION_REFLECTANCE = (0.04, 0.08, 0.04, 0.45, 0.22)
+SOIL_REFLECTANCE = (0.08, 0.12, 0.16, 0.25, 0.2)
+# clear sky direct irradiance at normal incidence by band, in W/m^2/nm
+DIRECT_IRRADIANCE = (1.35, 1.55, 1.5, 1.05, 1.3)
+PANEL_ALBEDO = (0.52, 0.53, 0.53, 0.51, 0.52)
+PANEL_SERIAL = 'RP04-1923118-SC'
+PANEL_SIZE_M = 0.15
+TEXTURE_GSD_M = 0.1
+BLACK_LEVEL = 4800.0
+METERS_PER_DEGREE = 111320.0
+
+def synthetic_calibration(camera, band_index, downscale=1):
+    ''' The shared calibration of a band, with the image size divided by downscale '''
+    values = dict(CAMERAS[camera])
+    del values['software'], values['bands']
+    band_name, center_wavelength, bandwidth = BANDS[band_index]
+    if band_name == 'LWIR':
+        values.update(LWIR_OPTICS)
+    width, height = values['image_size']
+    width, height = width // downscale, height // downscale
+    values.update(camera_make='MicaSense',
+                  band_name=band_name,
+                  band_index=band_index,
+                  center_wavelength=center_wavelength,
+                  bandwidth=bandwidth,
+                  bits_per_pixel=16,
+                  image_size=(width, height),
+                  radiometric_cal=None if band_name == 'LWIR' else (2.5e-4, 1.2e-7, 1.1e-5),
+                  vignette_center=(width / 2.0 + 10.0 / downscale, height / 2.0 - 8.0 / downscale),
+                  # the corners get about two thirds of the light of the center
+                  vignette_polynomial=tuple(c / (0.5 * math.hypot(width, height))**(i + 1) for i, c in
+                                            enumerate((-0.02, -0.3, 0.05, -0.08, 0.02, -0.005))),
+                  distortion_parameters=(-0.1, 0.15, -0.05, 0.0002, -0.0003),
+                  focal_plane_resolution_px_per_mm=tuple(r / downscale for r in values['focal_plane_resolution_px_per_mm']),
+                  focal_length_35=40.0,
+                  rig_relatives=RIG_RELATIVES[band_index])
+    return metadata.BandCalibration.intern(**values)
+
+def flight_plan(captures, altitude=120.0, ground_altitude=100.0, latitude=47.6, longitude=-122.3,
+                start_time=None, interval=1.0, speed=8.0, line_length=300.0, line_spacing=30.0,
+                panel_captures=2, seed=0):
+    '''
+    Positions of a lawnmower survey flight, preceded and followed by panel_captures
+    ground-level captures of a calibration panel at the takeoff point. Returns one
+    dictionary per capture with its utc_time, latitude, longitude, altitude, east and
+    north (meters from the first line), yaw, pitch and roll (radians), agl and panel.
+    '''
+    if start_time is None:
+        start_time = pytz.utc.localize(datetime.datetime(2019, 6, 10, 18, 0, 0))
+    rng = np.random.RandomState(seed)
+    panel_captures = min(panel_captures, captures // 2)
+    survey_captures = captures - 2 * panel_captures
+    plan = []
+    seconds = 0.0
+
+    def add(east, north, agl, yaw, panel):
+        # times are kept to tenths of a second, the precision of the SubSecTime parsing
+        utc_time = start_time + datetime.timedelta(seconds=round(seconds, 1))
+        tilt = 0.005 if panel else 0.04
+        plan.append({'utc_time': utc_time,
+                     'latitude': latitude + north / METERS_PER_DEGREE,
+                     'longitude': longitude + east / (METERS_PER_DEGREE * math.cos(math.radians(latitude))),
+                     'altitude': ground_altitude + agl,
+                     'east': east,
+                     'north': north,
+                     'agl': agl,
+                     'yaw': (yaw + rng.normal(0, tilt / 2)) % (2 * math.pi),
+                     'pitch': rng.normal(0, tilt),
+                     'roll': rng.normal(0, tilt),
+                     'panel': panel})
+
+    for _ in range(panel_captures):
+        add(-10.0, -10.0, 1.0, 0.0, True)
+        seconds += 2 * interval
+    seconds += 60.0
+    for i in range(survey_captures):
+        distance = i * speed * interval
+        line, along = divmod(distance, line_length)
+        north = along if line % 2 == 0 else line_length - along
+        add(line * line_spacing, north, altitude, 0.0 if line % 2 == 0 else math.pi, False)
+        seconds += interval
+    seconds += 60.0
+    for _ in range(panel_captures):
+        add(-10.0, -10.0, 1.0, 0.0, True)
+        seconds += 2 * interval
+    return plan
+
+def ground_texture(size=2048, seed=0):
+    ''' A periodic (size, size) float32 vegetation fraction map of fields with crop rows '''
+    rng = np.random.RandomState(seed)
+    frequency = np.hypot(np.fft.fftfreq(size)[:, None], np.fft.fftfreq(size)[None, :])
+    field = np.real(np.fft.ifft2(np.fft.fft2(rng.normal(size=(size, size))) / (2e-3 + frequency)**1.5))
+    field = (field - field.mean()) / field.std()
+    rows = np.sin(2 * np.pi * np.arange(size) / 8.0)[None, :]
+    return (1.0 / (1.0 + np.exp(-(1.5 * field + 0.8 * rows)))).astype(np.float32)
+
+def _sky(entry, band_index, start_time):
+    ''' The (direct, scattered, horizontal, sensor) irradiance and sun geometry of a capture,
+        with slowly passing clouds attenuating the direct light '''
+    sun_ned, _, sun_sensor_angle, solar_elevation, solar_azimuth = dls.compute_sun_angle(
+        (entry['latitude'], entry['longitude'], entry['altitude']),
+        (entry['yaw'], entry['pitch'], entry['roll']),
+        entry['utc_time'],
+        np.array([0, 0, -1]))
+    seconds = (entry['utc_time'] - start_time).total_seconds()
+    cloud = 0.5 + 0.5 * math.sin(2 * math.pi * seconds / 600.0)
+    direct = DIRECT_IRRADIANCE[band_index] * (1.0 - 0.4 * cloud)
+    scattered = DIRECT_IRRADIANCE[band_index] / 6.0 * (1.0 + 0.5 * cloud)
+    horizontal = direct * math.sin(solar_elevation) + scattered
+    sensor = dls.fresnel(sun_sensor_angle) * (direct * max(math.cos(sun_sensor_angle), 0.0) + scattered)
+    return direct, scattered, horizontal, sensor, float(solar_elevation), float(solar_azimuth), sun_ned
+
+def panel_corners(calibration, entry):
+    ''' The (x, y) undistorted image corners of the panel reflectance area in a ground-level capture '''
+    width, height = calibration.image_size
+    gsd = entry['agl'] / (calibration.focal_length * calibration.focal_plane_resolution_px_per_mm[0])
+    half = 0.5 * PANEL_SIZE_M / gsd
+    dx, dy = _rig_offset_px(calibration)
+    cx, cy = width / 2.0 + dx, height / 2.0 + dy
+    x0, y0, x1, y1 = [int(round(v)) for v in (cx - half, cy - half, cx + half, cy + half)]
+    return [(x0, y0), (x1, y0), (x1, y1), (x0, y1)]
+
+def _rig_offset_px(calibration):
+    pixel_fov = 2.0 * math.atan2(0.5 / calibration.focal_plane_resolution_px_per_mm[0], calibration.focal_length)
+    return [math.radians(r) / pixel_fov for r in calibration.rig_relatives[:2]]
+
+def _qr_modules(text):
+    ''' The boolean module matrix of a QR code, or None without the optional qrcode package '''
+    try:
+        import qrcode
+    except ImportError:
+        return None
+    qr = qrcode.QRCode(border=0)
+    qr.add_data(text)
+    qr.make(fit=True)
+    return np.array(qr.get_matrix(), dtype=bool)
+
+def synthetic_record(calibration, entry, capture_id, flight_id, start_time=None):
+    ''' The per-image record of a band of a flight_plan capture, with an exposure time that
+        puts the mean scene (or the panel) near the middle of the sensor range '''
+    if start_time is None:
+        start_time = entry['utc_time']
+    values = {'utc_time': entry['utc_time'],
+              'latitude': entry['latitude'],
+              'longitude': entry['longitude'],
+              'altitude': entry['altitude'],
+              'capture_id': capture_id,
+              'flight_id': flight_id,
+              'black_level': BLACK_LEVEL,
+              'gain': 1.0,
+              'dls_present': True,
+              'dls_yaw': entry['yaw'],
+              'dls_pitch': entry['pitch'],
+              'dls_roll': entry['roll'],
+              'auto_calibration_image': False}
+    band_index = calibration.band_index
+    if calibration.band_name == 'LWIR':
+        values.update(exposure_time=0.001, spectral_irradiance=0.0, horizontal_irradiance=0.0,
+                      horizontal_irradiance_valid=False, scattered_irradiance=0.0, direct_irradiance=0.0,
+                      solar_elevation=0.0, solar_azimuth=0.0)
+        return metadata.ImageRecord(**values)
+    direct, scattered, horizontal, sensor, solar_elevation, solar_azimuth, sun_ned = \
+        _sky(entry, band_index, start_time)
+    mean_reflectance = 0.5 * (VEGETATION_REFLECTANCE[band_index] + SOIL_REFLECTANCE[band_index])
+    if entry['panel']:
+        # expose for the panel rather than the ground around it
+        mean_reflectance = PANEL_ALBEDO[band_index]
+    target_dn = 20000.0 * calibration.radiometric_cal[0] / 2.0**calibration.bits_per_pixel
+    exposure_time = target_dn / (mean_reflectance * horizontal / math.pi)
+    values.update(exposure_time=round(min(max(exposure_time, 6.6e-5), 0.01), 6),
+                  spectral_irradiance=sensor,
+                  horizontal_irradiance=horizontal,
+                  horizontal_irradiance_valid=True,
+                  scattered_irradiance=scattered,
+                  direct_irradiance=direct,
+                  solar_elevation=solar_elevation,
+                  solar_azimuth=solar_azimuth,
+                  estimated_direct_vector=[float(v) for v in sun_ned])
+    if entry['panel']:
+        values.update(auto_calibration_image=True,
+                      panel_albedo=PANEL_ALBEDO[band_index],
+                      panel_region=panel_corners(calibration, entry),
+                      panel_serial=PANEL_SERIAL)
+    return metadata.ImageRecord(**values)
+
+# per band calibration: the lens distortion maps and inverse vignette of band_model
+_band_models = {}
+
+def band_model(calibration):
+    '''
+    The cv2.remap (map1, map2) that distort an undistorted image (as made by
+    Image.undistorted) into raw pixels, and the float32 (rows, cols) inverse of the
+    vignette correction of a band
+    '''
+    if calibration not in _band_models:
+        width, height = calibration.image_size
+        img = image.Image.from_records(None, calibration, None)
+        camera_matrix, distortion = img.cv2_camera_matrix(), img.cv2_distortion_coeff()
+        new_camera_matrix, _ = cv2.getOptimalNewCameraMatrix(camera_matrix, distortion, (width, height), 1)
+        rows, cols = np.mgrid[0:height, 0:width].astype(np.float32)
+        points = np.stack([cols.ravel(), rows.ravel()], axis=-1)[:, None, :]
+        points = cv2.undistortPoints(points, camera_matrix, distortion, P=new_camera_matrix)
+        map1, map2 = cv2.convertMaps(points[:, 0, 0].reshape(height, width),
+                                     points[:, 0, 1].reshape(height, width), cv2.CV_16SC2)
+        vignette_center_x, vignette_center_y = calibration.vignette_center
+        polynomial = list(reversed(calibration.vignette_polynomial)) + [1.0]
+        inverse_vignette = np.polyval(polynomial, np.hypot(cols - vignette_center_x, rows - vignette_center_y))
+        _band_models[calibration] = (map1, map2, inverse_vignette.astype(np.float32))
+    return _band_models[calibration]
+
+def _draw_panel(reflectance, record):
+    ''' Draw the panel, its dark body and (with the qrcode package) its QR code into an
+        undistorted reflectance image '''
+    (x0, y0), _, (x1, y1), _ = record.panel_region
+    border = (x1 - x0) // 2
+    reflectance[max(y0 - border, 0):y1 + border, max(x0 - border, 0):x1 + 3 * border] = 0.04
+    # the panel region corners are inclusive
+    reflectance[y0:y1 + 1, x0:x1 + 1] = record.panel_albedo
+    modules = _qr_modules(record.panel_serial)
+    if modules is not None:
+        size = max(x1 - x0 - border // 2, 1)
+        qr = cv2.resize(np.where(modules, 0.03, 0.8).astype(np.float32), (size, size),
+                        interpolation=cv2.INTER_NEAREST)
+        qr_x = x1 + 1 + border // 2 + border // 4
+        region = reflectance[y0:y0 + size, qr_x:qr_x + size]
+        region[...] = qr[:region.shape[0], :region.shape[1]]
+
+def synthetic_frame(calibration, record, entry, texture, rng=None):
+    ''' Render the 16 bit raw frame of a band from the ground vegetation fraction texture,
+        through the lens distortion and radiometric model of the band '''
+    width, height = calibration.image_size
+    gsd = entry['agl'] / (calibration.focal_length * calibration.focal_plane_resolution_px_per_mm[0])
+    dx, dy = _rig_offset_px(calibration)
+    # map undistorted pixels to texture pixels: the top of the image faces along the heading
+    scale = gsd / TEXTURE_GSD_M
+    cos_yaw, sin_yaw = math.cos(entry['yaw']), math.sin(entry['yaw'])
+    cx, cy = width / 2.0 + dx, height / 2.0 + dy
+    warp = np.array([[scale * cos_yaw, -scale * sin_yaw, 0.0],
+                     [scale * sin_yaw, scale * cos_yaw, 0.0]])
+    warp[:, 2] = np.array([entry['east'], -entry['north']]) / TEXTURE_GSD_M - warp[:, :2].dot((cx, cy))
+    # cut the footprint out of the periodic texture, as warping with a wrapped border is slow
+    corners = warp.dot([[0, width, 0, width], [0, 0, height, height], [1, 1, 1, 1]])
+    x0, y0 = np.floor(corners.min(axis=1)).astype(int) - 2
+    x1, y1 = np.ceil(corners.max(axis=1)).astype(int) + 2
+    footprint = texture[np.ix_(np.arange(y0, y1) % texture.shape[0], np.arange(x0, x1) % texture.shape[1])]
+    warp[:, 2] -= (x0, y0)
+    vegetation = cv2.warpAffine(footprint, warp, (width, height),
+                                flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP,
+                                borderMode=cv2.BORDER_REPLICATE)
+    if rng is None:
+        rng = np.random.default_rng(0)
+    map1, map2, inverse_vignette = band_model(calibration)
+
+    if calibration.band_name == 'LWIR':
+        celsius = 35.0 - 12.0 * cv2.remap(vegetation, map1, map2, cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+        celsius += 0.1 * rng.standard_normal(celsius.shape, dtype=np.float32)
+        return np.clip((celsius + 273.15) * 100.0, 0, 65535).astype(np.uint16)
+
+    band_index = calibration.band_index
+    reflectance = SOIL_REFLECTANCE[band_index] + \
+        vegetation * (VEGETATION_REFLECTANCE[band_index] - SOIL_REFLECTANCE[band_index])
+    if record.auto_calibration_image:
+        _draw_panel(reflectance, record)
+    reflectance = cv2.remap(reflectance, map1, map2, cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+
+    # invert radiance = V * R * (raw - black) / (gain * exposure) * a1 / 2^bits
+    a1, a2, a3 = calibration.radiometric_cal
+    rows = np.arange(height, dtype=np.float32)[:, None]
+    inverse_row_gradient = 1.0 + a2 * rows / record.exposure_time - a3 * rows
+    dn_scale = record.horizontal_irradiance / math.pi * \
+        record.gain * record.exposure_time * 2.0**calibration.bits_per_pixel / a1
+    dn = reflectance * inverse_vignette
+    dn *= inverse_row_gradient * np.float32(dn_scale)
+    dn += np.float32(record.black_level)
+    dn += 20.0 * rng.standard_normal(dn.shape, dtype=np.float32)
+    return np.clip(dn, 0, 65535).astype(np.uint16)
+
+def _rational(value, max_denominator=1000000):
+    fraction = fractions.Fraction(value).limit_denominator(max_denominator)
+    return fraction.numerator, fraction.denominator
+
+def _dms(degrees):
+    minutes, seconds = divmod(abs(degrees) * 3600.0, 60.0)
+    whole_degrees, minutes = divmod(minutes, 60.0)
+    return [(int(whole_degrees), 1), (int(minutes), 1), _rational(seconds, 10000)]
+
+def exiftool_metadata(calibration, record, software='v5.2.1'):
+    '''
+    The metadata of an image as reported by exiftool (numeric values, grouped names), as
+    read by micasense.metadata.Metadata. write_tiff encodes these into the file.
+    '''
+    width, height = calibration.image_size
+    utc_time = record.utc_time
+    meta = {'EXIF:Make': calibration.camera_make,
+            'EXIF:Model': calibration.camera_model,
+            'EXIF:Software': software,
+            'EXIF:ImageWidth': width,
+            'EXIF:ImageHeight': height,
+            'EXIF:BitsPerSample': calibration.bits_per_pixel,
+            'EXIF:BlackLevel': ' '.join(['{:d}'.format(int(record.black_level))] * 4),
+            'EXIF:DateTimeOriginal': utc_time.strftime('%Y:%m:%d %H:%M:%S'),
+            'EXIF:SubSecTime': '{:d}'.format(utc_time.microsecond),
+            'EXIF:ExposureTime': record.exposure_time,
+            'EXIF:ISOSpeed': int(round(record.gain * 100)),
+            'EXIF:FocalLength': calibration.focal_length,
+            'EXIF:FocalPlaneXResolution': calibration.focal_plane_resolution_px_per_mm[0],
+            'EXIF:FocalPlaneYResolution': calibration.focal_plane_resolution_px_per_mm[1],
+            'EXIF:FocalLengthIn35mmFormat': int(round(calibration.focal_length_35)),
+            'Composite:FocalLength35efl': float(int(round(calibration.focal_length_35))),
+            'EXIF:GPSLatitude': abs(record.latitude),
+            'EXIF:GPSLatitudeRef': 'N' if record.latitude >= 0 else 'S',
+            'EXIF:GPSLongitude': abs(record.longitude),
+            'EXIF:GPSLongitudeRef': 'E' if record.longitude >= 0 else 'W',
+            'EXIF:GPSAltitude': record.altitude,
+            'XMP:BandName': calibration.band_name,
+            'XMP:CentralWavelength': calibration.center_wavelength,
+            'XMP:WavelengthFWHM': calibration.bandwidth,
+            'XMP:RigCameraIndex': calibration.band_index,
+            'XMP:CaptureId': record.capture_id,
+            'XMP:FlightId': record.flight_id,
+            'XMP:VignettingCenter': list(calibration.vignette_center),
+            'XMP:VignettingPolynomial': list(calibration.vignette_polynomial),
+            'XMP:PerspectiveDistortion': list(calibration.distortion_parameters),
+            'XMP:PrincipalPoint': ','.join(repr(float(v)) for v in calibration.principal_point),
+            'XMP:PerspectiveFocalLength': calibration.focal_length,
+            'XMP:PerspectiveFocalLengthUnits': 'mm',
+            'XMP:RigRelatives': ','.join(repr(float(v)) for v in calibration.rig_relatives),
+            'XMP:Yaw': record.dls_yaw,
+            'XMP:Pitch': record.dls_pitch,
+            'XMP:Roll': record.dls_roll,
+            'XMP:IrradianceScaleToSIUnits': 1.0,
+            'XMP:SpectralIrradiance': record.spectral_irradiance,
+            'XMP:HorizontalIrradiance': record.horizontal_irradiance,
+            'XMP:DirectIrradiance': record.direct_irradiance,
+            'XMP:ScatteredIrradiance': record.scattered_irradiance,
+            'XMP:SolarElevation': record.solar_elevation,
+            'XMP:SolarAzimuth': record.solar_azimuth}
+    if calibration.radiometric_cal is not None:
+        meta['XMP:RadiometricCalibration'] = list(calibration.radiometric_cal)
+    if record.estimated_direct_vector is not None:
+        meta['XMP:EstimatedDirectLightVector'] = list(record.estimated_direct_vector)
+    if record.auto_calibration_image:
+        meta.update({'XMP:CalibrationPicture': 2,
+                     'XMP:Albedo': record.panel_albedo,
+                     'XMP:ReflectArea': ','.join('{:d},{:d}'.format(x, y) for x, y in record.panel_region),
+                     'XMP:PanelSerial': record.panel_serial})
+    return meta
+
+# XMP namespaces of the tags, following the MicaSense camera files
+XMP_NAMESPACES = {'Camera': 'http://pix4d.com/camera/1.0/',
+                  'MicaSense': 'http://micasense.com/MicaSense/1.0/',
+                  'DLS': 'http://micasense.com/DLS/1.0/'}
+XMP_PREFIXES = {'BandName': 'Camera', 'CentralWavelength': 'Camera', 'WavelengthFWHM': 'Camera',
+                'RigCameraIndex': 'Camera', 'VignettingCenter': 'Camera', 'VignettingPolynomial': 'Camera',
+                'PerspectiveDistortion': 'Camera', 'PrincipalPoint': 'Camera',
+                'PerspectiveFocalLength': 'Camera', 'PerspectiveFocalLengthUnits': 'Camera',
+                'RigRelatives': 'Camera', 'IrradianceScaleToSIUnits': 'Camera',
+                'CaptureId': 'MicaSense', 'FlightId': 'MicaSense', 'RadiometricCalibration': 'MicaSense',
+                'CalibrationPicture': 'MicaSense', 'Albedo': 'Camera', 'ReflectArea': 'Camera',
+                'PanelSerial': 'Camera'}
+
+def xmp_packet(meta):
+    ''' Serialize the XMP: items of an exiftool_metadata dictionary; lists become rdf:Seq '''
+    properties = []
+    for key in sorted(meta):
+        group, name = key.split(':', 1)
+        if group != 'XMP':
+            continue
+        prefix = XMP_PREFIXES.get(name, 'DLS')
+        value = meta[key]
+        if isinstance(value, (list, tuple)):
+            items = ''.join('<rdf:li>{!r}</rdf:li>'.format(float(v)) for v in value)
+            properties.append('<{0}:{1}><rdf:Seq>{2}</rdf:Seq></{0}:{1}>'.format(prefix, name, items))
+        else:
+            if isinstance(value, float):
+                value = repr(value)
+            properties.append('<{0}:{1}>{2}</{0}:{1}>'.format(prefix, name, value))
+    namespaces = ' '.join('xmlns:{}="{}"'.format(prefix, uri) for prefix, uri in sorted(XMP_NAMESPACES.items()))
+    return ('<?xpacket begin="﻿" id="W5M0MpCehiHzreSzNTczkc9d"?>'
+            '<x:xmpmeta xmlns:x="adobe:ns:meta/">'
+            '<rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">'
+            '<rdf:Description rdf:about="" {}>{}</rdf:Description>'
+            '</rdf:RDF></x:xmpmeta><?xpacket end="w"?>').format(namespaces, ''.join(properties)).encode('utf-8')
+
+# TIFF field types: BYTE, ASCII, SHORT, LONG, RATIONAL
+TIFF_TYPES = {1: 'B', 2: 'B', 3: 'H', 4: 'I', 5: 'I'}
+# exiftool name: (IFD, tag, type) of the EXIF items written by write_tiff
+EXIF_TAGS = {'EXIF:Make': ('ifd0', 271, 2),
+             'EXIF:Model': ('ifd0', 272, 2),
+             'EXIF:Software': ('ifd0', 305, 2),
+             'EXIF:BlackLevel': ('ifd0', 50714, 3),
+             'EXIF:ExposureTime': ('exif', 33434, 5),
+             'EXIF:ISOSpeed': ('exif', 34867, 4),
+             'EXIF:DateTimeOriginal': ('exif', 36867, 2),
+             'EXIF:SubSecTime': ('exif', 37520, 2),
+             'EXIF:FocalLength': ('exif', 37386, 5),
+             'EXIF:FocalPlaneXResolution': ('exif', 41486, 5),
+             'EXIF:FocalPlaneYResolution': ('exif', 41487, 5),
+             'EXIF:FocalLengthIn35mmFormat': ('exif', 41989, 3),
+             'EXIF:GPSLatitudeRef': ('gps', 1, 2),
+             'EXIF:GPSLatitude': ('gps', 2, 5),
+             'EXIF:GPSLongitudeRef': ('gps', 3, 2),
+             'EXIF:GPSLongitude': ('gps', 4, 5),
+             'EXIF:GPSAltitude': ('gps', 6, 5)}
+
+def _tiff_values(key, tag_type, value):
+    ''' The flat list of TIFF values of an exiftool item '''
+    if tag_type == 2:
+        return list(value.encode('ascii') + b'\x00')
+    if key in ('EXIF:GPSLatitude', 'EXIF:GPSLongitude'):
+        return [v for pair in _dms(value) for v in pair]
+    if tag_type == 5:
+        return list(_rational(value))
+    if key == 'EXIF:BlackLevel':
+        return [int(v) for v in value.split(' ')]
+    return [int(value)]
+
+def _ifd(entries, offset):
+    ''' Encode an IFD starting at offset, with values too large for an entry placed after it '''
+    entries = sorted(entries)
+    data_offset = offset + 2 + 12 * len(entries) + 4
+    table = struct.pack('<H', len(entries))
+    data = b''
+    for tag, tag_type, values in entries:
+        count = len(values) // 2 if tag_type == 5 else len(values)
+        payload = struct.pack('<{}{}'.format(len(values), TIFF_TYPES[tag_type]), *values)
+        if len(payload) <= 4:
+            table += struct.pack('<HHI', tag, tag_type, count) + payload.ljust(4, b'\x00')
+        else:
+            table += struct.pack('<HHII', tag, tag_type, count, data_offset + len(data))
+            data += payload + b'\x00' * (len(payload) % 2)
+    return table + struct.pack('<I', 0) + data
+
+def write_tiff(path, frame, meta):
+    ''' Write a single band 16 bit frame as an uncompressed little-endian TIFF with the
+        EXIF, GPS and XMP items of an exiftool_metadata dictionary '''
+    height, width = frame.shape
+    tags = {'ifd0': [(256, 4, [width]), (257, 4, [height]), (258, 3, [16]), (259, 3, [1]),
+                     (262, 3, [1]), (277, 3, [1]), (278, 4, [height]), (279, 4, [frame.nbytes]),
+                     (284, 3, [1]), (700, 1, list(xmp_packet(meta)))],
+            'exif': [(41488, 3, [4])], # focal plane resolution in mm
+            'gps': [(0, 1, [2, 2, 0, 0]), (5, 1, [0])]}
+    for key, value in meta.items():
+        if key in EXIF_TAGS and value is not None:
+            ifd, tag, tag_type = EXIF_TAGS[key]
+            tags[ifd].append((tag, tag_type, _tiff_values(key, tag_type, value)))
+    # the sizes of the IFDs do not depend on their offsets, so lay them out with placeholders
+    placeholders = [(273, 4, [0]), (34665, 4, [0]), (34853, 4, [0])]
+    ifd0_offset = 8
+    exif_offset = ifd0_offset + len(_ifd(tags['ifd0'] + placeholders, ifd0_offset))
+    gps_offset = exif_offset + len(_ifd(tags['exif'], exif_offset))
+    pixel_offset = gps_offset + len(_ifd(tags['gps'], gps_offset))
+    pixel_offset += -pixel_offset % 16
+    ifd0 = _ifd(tags['ifd0'] + [(273, 4, [pixel_offset]), (34665, 4, [exif_offset]), (34853, 4, [gps_offset])],
+                ifd0_offset)
+    with open(path, 'wb') as tiff:
+        tiff.write(b'II*\x00' + struct.pack('<I', ifd0_offset))
+        tiff.write(ifd0)
+        tiff.write(_ifd(tags['exif'], exif_offset))
+        tiff.write(_ifd(tags['gps'], gps_offset))
+        tiff.write(b'\x00' * (pixel_offset - tiff.tell()))
+        tiff.write(frame.astype('<u2').tobytes())
+
+def write_capture(directory, camera='rededge', capture_index=0, entry=None, flight_id='synthetic',
+                  texture=None, downscale=1, start_time=None):
+    ''' Write the TIFFs of one capture, named like the camera's IMG_0000_1.tif files, and
+        return its Images '''
+    if entry is None:
+        entry = flight_plan(1, panel_captures=0)[0]
+    if texture is None:
+        texture = ground_texture()
+    rng = np.random.default_rng(capture_index)
+    capture_id = '{}{:07d}'.format(flight_id, capture_index)
+    images = []
+    for band_index in range(CAMERAS[camera]['bands']):
+        calibration = synthetic_calibration(camera, band_index, downscale)
+        record = synthetic_record(calibration, entry, capture_id, flight_id, start_time)
+        path = os.path.join(directory, 'IMG_{:04d}_{}.tif'.format(capture_index % 10000, band_index + 1))
+        write_tiff(path, synthetic_frame(calibration, record, entry, texture, rng),
+                   exiftool_metadata(calibration, record, CAMERAS[camera]['software']))
+        images.append(image.Image.from_records(path, calibration, record))
+    return images
+
+_textures = {}
+
+def _write_job(job):
+    # each worker process renders the ground texture of a seed once
+    folder, camera, capture_index, entry, flight_id, seed, downscale, start_time = job
+    if seed not in _textures:
+        _textures[seed] = ground_texture(seed=seed)
+    images = write_capture(folder, camera, capture_index, entry, flight_id, _textures[seed], downscale, start_time)
+    return [img.path for img in images]
+
+def write_flight(directory, captures=1000, camera='rededge', downscale=1, flight_id='synthetic',
+                 captures_per_folder=200, seed=0, processes=None, progress_callback=None, **plan_kwargs):
+    '''
+    Write a flight of captures laid out like a camera SD card, in 0000SET/000, 0000SET/001, ...
+    folders of captures_per_folder captures, using a pool of processes (all cores if None; 1 to
+    work in this process). Extra keyword arguments are passed to flight_plan. Returns the paths
+    of the images written.
+    '''
+    plan = flight_plan(captures, seed=seed, **plan_kwargs)
+    jobs = []
+    for capture_index, entry in enumerate(plan):
+        folder = os.path.join(directory, '0000SET', '{:03d}'.format(capture_index // captures_per_folder))
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        jobs.append((folder, camera, capture_index, entry, flight_id, seed, downscale, plan[0]['utc_time']))
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    paths = []
+    if processes == 1:
+        # one ephemeris for the whole flight makes the sun geometry of each capture a lookup
+        dls.solar_positions.add_flight([(e['latitude'], e['longitude'], e['altitude']) for e in plan],
+                                       [e['utc_time'] for e in plan])
+        results = (_write_job(job) for job in jobs)
+    else:
+        pool = multiprocessing.Pool(processes=processes)
+        results = pool.imap(_write_job, jobs, chunksize=4)
+    try:
+        for i, job_paths in enumerate(results):
+            paths.extend(job_paths)
+            if progress_callback is not None:
+                progress_callback(float(i + 1) / len(jobs))
+    finally:
+        if processes != 1:
+            pool.close()
+            pool.join()
+    return paths
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Write a synthetic MicaSense flight')
+    parser.add_argument('directory', help='output directory')
+    parser.add_argument('--captures', type=int, default=1000, help='number of captures, including panels')
+    parser.add_argument('--camera', choices=sorted(CAMERAS), default='rededge')
+    parser.add_argument('--downscale', type=int, default=1, help='divide the image size by this factor')
+    parser.add_argument('--panel-captures', type=int, default=2,
+                        help='panel captures before and after the flight')
+    parser.add_argument('--altitude', type=float, default=120.0, help='flight height above ground in meters')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--processes', type=int, default=None, help='worker processes, all cores by default')
+    args = parser.parse_args(argv)
+
+    def progress(fraction):
+        print('\r{:5.1f}%'.format(100 * fraction), end='')
+    paths = write_flight(args.directory, captures=args.captures, camera=args.camera,
+                         downscale=args.downscale, seed=args.seed, processes=args.processes,
+                         progress_callback=progress,
+                         panel_captures=args.panel_captures, altitude=args.altitude)
+    print('\nwrote {} images to {}'.format(len(paths), args.directory))
+
+if __name__ == '__main__':
+    main()
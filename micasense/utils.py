@@ -21,6 +21,73 @@ CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
 import cv2
 import numpy as np
+import struct
+
+# TIFF tags used to locate the pixels of an uncompressed image
+TIFF_LAYOUT_TAGS = {256: 'width',
+                    257: 'height',
+                    258: 'bits_per_sample',
+                    259: 'compression',
+                    273: 'strip_offsets',
+                    277: 'samples_per_pixel',
+                    279: 'strip_byte_counts',
+                    339: 'sample_format'}
+
+def uncompressed_tiff_layout(path):
+    ''' Get the (offset, shape, dtype) of the pixels of a little-endian, single band, unsigned
+        8 or 16 bit TIFF whose strips are uncompressed and contiguous, or None otherwise '''
+    try:
+        with open(path, 'rb') as tiff:
+            header = tiff.read(8)
+            if len(header) < 8 or header[:4] != b'II*\x00':
+                return None
+            tiff.seek(struct.unpack('<I', header[4:])[0])
+            count = struct.unpack('<H', tiff.read(2))[0]
+            entries = tiff.read(12 * count)
+            tags = {}
+            for i in range(count):
+                tag, tag_type, num, value = struct.unpack('<HHI4s', entries[12*i:12*(i+1)])
+                if tag not in TIFF_LAYOUT_TAGS:
+                    continue
+                if tag_type not in (3, 4): # SHORT or LONG
+                    return None
+                fmt = '<{}{}'.format(num, 'H' if tag_type == 3 else 'I')
+                size = struct.calcsize(fmt)
+                if size > 4:
+                    tiff.seek(struct.unpack('<I', value)[0])
+                    value = tiff.read(size)
+                tags[TIFF_LAYOUT_TAGS[tag]] = struct.unpack(fmt, value[:size])
+    except (IOError, struct.error):
+        return None
+
+    if 'width' not in tags or 'height' not in tags or 'strip_offsets' not in tags \
+        or 'strip_byte_counts' not in tags or 'bits_per_sample' not in tags:
+        return None
+    if tags.get('compression', (1,))[0] != 1 \
+        or tags.get('samples_per_pixel', (1,))[0] != 1 \
+        or tags.get('sample_format', (1,))[0] != 1:
+        return None
+    bits = tags['bits_per_sample'][0]
+    if bits not in (8, 16):
+        return None
+    width, height = tags['width'][0], tags['height'][0]
+    offsets, byte_counts = tags['strip_offsets'], tags['strip_byte_counts']
+    if len(offsets) != len(byte_counts) or sum(byte_counts) < width * height * bits // 8:
+        return None
+    for offset, byte_count, next_offset in zip(offsets, byte_counts, offsets[1:]):
+        if offset + byte_count != next_offset:
+            return None
+    return offsets[0], (height, width), np.dtype('<u{}'.format(bits // 8))
+
+def read_raw(path, memmap=True):
+    ''' Read the raw pixels of an image file. Uncompressed TIFFs are mapped read-only into
+        memory, so only the pages used are read; other files are read with OpenCV '''
+    if memmap:
+        layout = uncompressed_tiff_layout(path)
+        if layout is not None:
+            offset, shape, dtype = layout
+            return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape)
+    return cv2.imread(path, -1)
 
 
 def raw_image_to_radiance(meta, imageRaw):
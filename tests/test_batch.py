@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Test batched radiometry
+
+Copyright 2019 MicaSense, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in the
+Software without restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import pytest
+import numpy as np
+
+import micasense.batch as batch
+import micasense.synthetic as synthetic
+
+@pytest.fixture()
+def flight_images(tmpdir):
+    images = []
+    for i, entry in enumerate(synthetic.flight_plan(3, panel_captures=1)):
+        images += synthetic.write_capture(str(tmpdir), 'altum', capture_index=i, entry=entry, downscale=8)
+    return images
+
+def test_radiance_batch(flight_images):
+    batches = batch.radiance_batch(flight_images)
+    assert len(batches) == 6
+    assert sorted(len(images) for images, _ in batches) == [3] * 6
+    for images, radiance in batches:
+        assert radiance.dtype == np.float32
+        assert radiance.shape == (len(images),) + images[0].raw().shape
+        for img, expected in zip(images, radiance):
+            assert np.allclose(expected, img.radiance(), rtol=1e-5, atol=1e-6)
+
+def test_radiance_batch_size(flight_images):
+    batches = batch.radiance_batch(flight_images, batch_size=2)
+    assert [len(images) for images, _ in batches] == [2, 1] * 6
+    whole = dict((id(images[0].calibration), radiance) for images, radiance in batch.radiance_batch(flight_images))
+    (first, first_radiance), (second, second_radiance) = batches[:2]
+    assert first[0].calibration is second[0].calibration
+    assert np.array_equal(np.concatenate([first_radiance, second_radiance]), whole[id(first[0].calibration)])
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Test the image cache
+
+Copyright 2019 MicaSense, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in the
+Software without restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import gc
+import pytest
+import numpy as np
+
+import micasense.cache as cache
+
+class Owner(object):
+    def __init__(self):
+        self.arrays = {}
+
+    def get(self, image_cache, slot):
+        if slot in self.arrays:
+            image_cache.touch(self, slot)
+        else:
+            self.arrays[slot] = np.zeros(100, dtype=np.uint8)
+            image_cache.store(self, slot, self.arrays[slot])
+        return self.arrays[slot]
+
+    def release_cached(self, slot):
+        del self.arrays[slot]
+
+def test_unbounded_counts():
+    image_cache = cache.ImageCache()
+    owner = Owner()
+    owner.get(image_cache, 'raw')
+    owner.get(image_cache, 'raw')
+    owner.get(image_cache, 'radiance')
+    stats = image_cache.stats()
+    assert stats['hits'] == 1
+    assert stats['misses'] == 2
+    assert stats['evictions'] == 0
+    assert stats['nbytes'] == 200
+
+def test_lru_eviction():
+    image_cache = cache.ImageCache(budget_bytes=250)
+    first, second = Owner(), Owner()
+    first.get(image_cache, 'raw')
+    second.get(image_cache, 'raw')
+    first.get(image_cache, 'raw')
+    second.get(image_cache, 'radiance')
+    # the least recently used array is evicted
+    assert 'raw' not in second.arrays
+    assert 'raw' in first.arrays
+    assert image_cache.stats()['evictions'] == 1
+    assert image_cache.nbytes == 200
+
+def test_set_budget_evicts():
+    image_cache = cache.ImageCache()
+    owner = Owner()
+    for slot in ('raw', 'intensity', 'radiance'):
+        owner.get(image_cache, slot)
+    image_cache.set_budget(100)
+    assert list(owner.arrays) == ['radiance']
+    assert image_cache.nbytes == 100
+
+def test_discard_and_collect():
+    image_cache = cache.ImageCache()
+    first, second = Owner(), Owner()
+    first.get(image_cache, 'raw')
+    second.get(image_cache, 'raw')
+    image_cache.discard(first)
+    assert image_cache.nbytes == 100
+    del second
+    gc.collect()
+    assert image_cache.stats()['nbytes'] == 0
+
+def test_discard_slot():
+    image_cache = cache.ImageCache()
+    owner = Owner()
+    for slot in ('raw', 'radiance'):
+        owner.get(image_cache, slot)
+    image_cache.discard(owner, 'raw')
+    image_cache.discard(owner, 'intensity')
+    assert image_cache.stats()['entries'] == 1
+    image_cache.set_budget(0)
+    # the remaining slot is still tracked, and evicted
+    assert list(owner.arrays) == ['raw']
+    assert image_cache.nbytes == 0
@@ -25,9 +25,13 @@ CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
 import pytest
 import os, glob
+import cv2
+import numpy as np
 
 import micasense.capture as capture
 import micasense.image as image
+import micasense.imageutils as imageutils
+import micasense.synthetic as synthetic
 
 def test_from_images(file_list):
     imgs = [image.Image(fle) for fle in file_list]
@@ -233,4 +237,38 @@ def test_no_rig_relatives(non_panel_rededge_file_list):
 def test_panel_albedo(panel_altum_capture):
     panel_altum_capture.detect_panels()
     good_panel_albedo = [0.5282, 0.5274, 0.5263, 0.5246, 0.5258]
-    assert panel_altum_capture.panel_albedo() == pytest.approx(good_panel_albedo, 1e-4)
\ No newline at end of file
+    assert panel_altum_capture.panel_albedo() == pytest.approx(good_panel_albedo, 1e-4)
+
+
+def test_band_threads(tmpdir):
+    cap = capture.Capture(synthetic.write_capture(str(tmpdir), 'altum', downscale=4))
+    irradiance = cap.dls_irradiance()
+    warp_matrices = cap.get_warp_matrices()
+    width, height = cap.images[0].size()
+    def aligned():
+        cap.compute_undistorted_reflectance(irradiance + [0], from_raw=True)
+        return imageutils.aligned_capture(cap, warp_matrices, cv2.MOTION_HOMOGRAPHY,
+                                          (0, 0, width, height), None, img_type='reflectance')
+    expected_reflectance = [img.copy() for img in cap.undistorted_reflectance(irradiance)]
+    expected_aligned = aligned()
+    cap.clear_image_data()
+    capture.set_band_threads(3)
+    try:
+        assert capture.band_threads() == 3
+        for threaded, expected in zip(cap.undistorted_reflectance(irradiance), expected_reflectance):
+            assert np.allclose(threaded, expected)
+        assert np.allclose(aligned(), expected_aligned)
+    finally:
+        capture.set_band_threads(0)
+    assert capture.band_threads() == 0
+
+
+def test_nested_map_bands(tmpdir):
+    cap = capture.Capture(synthetic.write_capture(str(tmpdir), 'rededge', downscale=8))
+    capture.set_band_threads(2)
+    try:
+        # more outer band tasks than threads, each mapping the bands again
+        names = cap.map_bands(lambda img: cap.map_bands(lambda other: other.band_name))
+    finally:
+        capture.set_band_threads(0)
+    assert names == [cap.band_names()] * len(cap.images)
@@ -152,4 +152,74 @@ def test_get_orientation_west():
     pose = (math.radians(-90),math.radians(-90), math.radians(0))
     orientation = [0,0,-1]
     ned = dls.get_orientation(pose, orientation)
-    assert ned == pytest.approx([0,-1,0])
\ No newline at end of file
+    assert ned == pytest.approx([0,-1,0])
+
+def test_solar_position_cache_matches_pysolar():
+    cache = dls.SolarPositionCache()
+    dt = datetime.datetime(2019,3,21,12,8,0,tzinfo=datetime.timezone.utc)
+    alt, az = cache.altitude_azimuth(51.4769, 0, dt)
+    expected_alt, expected_az = dls.sun_altitude_azimuth(51.4769, 0, dt)
+    assert alt == pytest.approx(expected_alt, abs=1e-6)
+    assert az == pytest.approx(expected_az, abs=1e-6)
+    # positions are exact unless rounding is asked for
+    later = dt + datetime.timedelta(milliseconds=3)
+    assert cache.altitude_azimuth(51.4769, 0, later) == dls.sun_altitude_azimuth(51.4769, 0, later)
+    assert len(cache.positions) == 2
+    # a band image a few milliseconds later is served from a rounding cache
+    rounding = dls.SolarPositionCache(latlon_decimals=4, time_resolution_seconds=1.0)
+    assert rounding.altitude_azimuth(51.4769, 0, dt) == (alt, az)
+    assert rounding.altitude_azimuth(51.47691, 0, later) == (alt, az)
+    assert len(rounding.positions) == 1
+
+def test_solar_ephemeris_interpolation():
+    lat, lon = 36.576096, -119.4352689
+    start = datetime.datetime(2017,10,19,20,40,39,tzinfo=datetime.timezone.utc)
+    times = [start + datetime.timedelta(seconds=2*i) for i in range(300)]
+    cache = dls.SolarPositionCache()
+    cache.add_flight([(lat, lon, 100.0)]*len(times), times)
+    assert len(cache.ephemerides) == 1
+    for t in times[::37]:
+        alt, az = cache.altitude_azimuth(lat, lon, t)
+        expected_alt, expected_az = dls.sun_altitude_azimuth(lat, lon, t)
+        assert alt == pytest.approx(expected_alt, abs=0.01)
+        assert az == pytest.approx(expected_az, abs=0.01)
+    # the cache is not used for positions covered by the ephemeris
+    assert len(cache.positions) == 0
+
+def test_solar_ephemeris_outside_flight():
+    start = datetime.datetime(2017,10,19,20,40,39,tzinfo=datetime.timezone.utc)
+    ephemeris = dls.SolarEphemeris(36.57, -119.43, [start])
+    assert ephemeris.covers(36.575, -119.435)
+    assert not ephemeris.covers(37.57, -119.43)
+    later = start + datetime.timedelta(hours=2)
+    assert ephemeris.altitude_azimuth(dls.datetime_to_seconds(later)) is None
+
+def test_solar_ephemeris_added_once():
+    start = datetime.datetime(2017,10,19,20,40,39,tzinfo=datetime.timezone.utc)
+    times = [start + datetime.timedelta(seconds=i) for i in range(10)]
+    cache = dls.SolarPositionCache()
+    cache.add_flight([(36.57, -119.43, 100.0)]*len(times), times)
+    cache.add_flight([(36.57, -119.43, 100.0)]*len(times), times)
+    assert len(cache.ephemerides) == 1
+
+def test_solar_ephemeris_sites():
+    start = datetime.datetime(2017,10,19,20,40,39,tzinfo=datetime.timezone.utc)
+    times = [start + datetime.timedelta(seconds=i) for i in range(4)]
+    cache = dls.SolarPositionCache(max_ephemerides=2)
+    locations = [(36.5712, -119.4312, 100.0), (36.5714, -119.4314, 100.0)] * 2
+    cache.add_flight(locations, times)
+    ephemeris, = cache.ephemerides.values()
+    # computed at the mean location of the captures, not at the center of the cell
+    assert ephemeris.latitude == pytest.approx(36.5713)
+    assert ephemeris.longitude == pytest.approx(-119.4313)
+    # later times at the same site extend its ephemeris
+    later = [t + datetime.timedelta(hours=1) for t in times]
+    cache.add_flight(locations, later)
+    assert len(cache.ephemerides) == 1
+    assert cache.altitude_azimuth(36.5713, -119.4313, later[0]) is not None
+    assert len(cache.positions) == 0
+    # only the most recently added sites are kept
+    cache.add_flight([(37.0, -119.0, 100.0)], times)
+    cache.add_flight([(38.0, -119.0, 100.0)], times)
+    assert len(cache.ephemerides) == 2
+    assert [e.latitude for e in cache.ephemerides.values()] == [37.0, 38.0]
@@ -30,6 +30,9 @@ import numpy as np
 
 import micasense.image as image
 import micasense.panel as panel
+import micasense.cache as cache
+import micasense.metadata as metadata
+import micasense.synthetic as synthetic
 
 def test_load_image_metadata(img):
     assert img.meta is not None
@@ -60,8 +63,7 @@ def test_clear_image_data(img):
     assert img._Image__radiance_image is None
     assert img._Image__reflectance_image is None
     assert img._Image__reflectance_irradiance is None
-    assert img._Image__undistorted_source is None
-    assert img._Image__undistorted_image is None
+    assert img._Image__undistorted == {}
 
 def test_reflectance(img):
     pan = panel.Panel(img)
@@ -122,3 +124,95 @@ def test_altum_bad_dls2_horizontal_irradiance(bad_dls2_horiz_irr_image):
     good_horiz_irradiance = direct_irr * np.sin(solar_el) + scattered_irr
     assert bad_dls2_horiz_irr_image.horizontal_irradiance == pytest.approx(good_horiz_irradiance, 1e-3)
 
+def test_dls_fields_are_deferred(altum_flight_image):
+    assert 'horizontal_irradiance' not in altum_flight_image.__dict__
+    assert altum_flight_image.band_name is not None
+    assert 'solar_elevation' not in altum_flight_image.__dict__
+    assert altum_flight_image.horizontal_irradiance > 0
+    assert 'solar_elevation' in altum_flight_image.__dict__
+
+def test_images_share_band_calibration(img, img2):
+    other = image.Image(img.path, keep_exif=False)
+    assert other.calibration is img.calibration
+    assert other.record is not img.record
+    assert other.meta.band_name() == img.band_name
+
+def test_image_from_records(img):
+    copy = image.Image.from_records(img.path, img.calibration, img.record)
+    assert copy.capture_id == img.capture_id
+    assert copy.size() == img.size()
+    assert copy.horizontal_irradiance == pytest.approx(img.horizontal_irradiance)
+
+def test_compute_into_matches_radiance(img):
+    out = np.empty(img.raw().shape, dtype=np.float64)
+    assert img.compute_into(out, kind='radiance', block_rows=100) is out
+    assert out == pytest.approx(img.radiance(), abs=1e-12)
+
+def test_compute_into_reflectance_float32(img):
+    out = img.compute_into(kind='reflectance', irradiance=1.5, block_rows=333)
+    assert out.dtype == np.float32
+    assert out == pytest.approx(img.reflectance(irradiance=1.5), rel=1e-5, abs=1e-6)
+
+def test_reflectance_from_raw(img):
+    expected = img.reflectance(irradiance=1.5, force_recompute=True)
+    img.clear_image_data()
+    reflectance = img.reflectance(irradiance=1.5, force_recompute=True, from_raw=True)
+    assert reflectance.dtype == np.float32
+    assert reflectance == pytest.approx(expected, rel=1e-5, abs=1e-6)
+    # the radiance image is not computed
+    assert img._Image__radiance_image is None
+
+def test_gain_map(img):
+    gain = img.gain_map('radiance')
+    assert gain.dtype == np.float32
+    radiance = gain * np.maximum(img.raw() - np.float32(img.black_level), 0)
+    assert radiance == pytest.approx(img.radiance(), rel=1e-5, abs=1e-8)
+
+def test_undistorted_slots(img):
+    undistorted_raw = img.undistorted(img.raw())
+    undistorted_radiance = img.undistorted(img.radiance())
+    # alternating sources reuse the undistorted image of each
+    assert img.undistorted(img.raw()) is undistorted_raw
+    assert img.undistorted(img.radiance()) is undistorted_radiance
+    img.radiance(force_recompute=True)
+    assert img.undistorted(img.radiance()) is not undistorted_radiance
+    assert img.undistorted(img.radiance()) == pytest.approx(undistorted_radiance)
+
+def test_compute_into_leaves_caches(tmpdir):
+    img = synthetic.write_capture(str(tmpdir), 'rededge', downscale=8)[0]
+    entries = cache.stats()['entries']
+    out = img.compute_into(kind='radiance')
+    assert img._Image__raw_image is None
+    assert cache.stats()['entries'] == entries
+    assert np.allclose(out, img.radiance(), rtol=1e-5, atol=1e-8)
+
+def test_meta_uses_exiftool_path(tmpdir, monkeypatch):
+    img = synthetic.write_capture(str(tmpdir), 'rededge', downscale=8)[0]
+    executables = []
+    class ExifTool(object):
+        def __init__(self, executable=None):
+            executables.append(executable)
+        def __enter__(self):
+            return self
+        def __exit__(self, *args):
+            pass
+        def get_metadata(self, path):
+            return synthetic.exiftool_metadata(img.calibration, img.record)
+    monkeypatch.setattr(metadata.exiftool, 'ExifTool', ExifTool)
+    deferred = image.Image.deferred(img.path, exiftool_path='/opt/exiftool/exiftool')
+    assert deferred.band_name == img.band_name
+    # the full metadata was not kept, and is read again with the same exiftool
+    assert deferred.meta.band_name() == img.band_name
+    assert executables == ['/opt/exiftool/exiftool'] * 2
+
+def test_undistorted_other_source_counted(tmpdir):
+    img = synthetic.write_capture(str(tmpdir), 'rededge', downscale=8)[0]
+    width, height = img.size()
+    source = np.ones((height, width), dtype=np.float32)
+    before = cache.stats()['nbytes']
+    undistorted = img.undistorted(source)
+    assert img.undistorted(source) is undistorted
+    # the slot keeps the source alive, so it is counted in the cache budget
+    assert cache.stats()['nbytes'] - before == source.nbytes + undistorted.nbytes
+    img.clear_image_data()
+    assert cache.stats()['nbytes'] == before
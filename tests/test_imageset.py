@@ -25,11 +25,13 @@ CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
 
 import pytest
-import os, glob
+import os, glob, datetime, warnings
+import numpy as np
 
 import micasense.imageset as imageset
 import micasense.capture as capture
 import micasense.image as image
+import micasense.synthetic as synthetic
 
 @pytest.fixture()
 def files_dir():
@@ -61,4 +63,129 @@ def test_as_nested_lists(files_dir):
     assert imgset is not None
     data, columns = imgset.as_nested_lists()
     assert data[0][1] == 36.576096
-    assert columns[0] == 'timestamp'
\ No newline at end of file
+    assert columns[0] == 'timestamp'
+
+
+def test_to_table(files_dir):
+    imgset = imageset.ImageSet.from_directory(files_dir)
+    table = imgset.to_table()
+    assert len(table) == 10
+    assert table['latitude'][0] == 36.576096
+    assert table['capture_id'][0] == imgset.captures[0].uuid
+    assert len(imgset.calibrations()) == 5
+
+def test_from_table(files_dir):
+    imgset = imageset.ImageSet.from_directory(files_dir)
+    loaded = imageset.ImageSet.from_table(imgset.to_table(), imgset.calibrations())
+    assert len(loaded.captures) == 2
+    for cap, loaded_cap in zip(imgset.captures, loaded.captures):
+        assert loaded_cap.uuid == cap.uuid
+        assert loaded_cap.utc_time() == cap.utc_time()
+        assert loaded_cap.dls_irradiance() == pytest.approx(cap.dls_irradiance())
+
+def test_save_table(files_dir, tmpdir):
+    pytest.importorskip('pyarrow')
+    imgset = imageset.ImageSet.from_directory(files_dir)
+    path = str(tmpdir.join('imageset.parquet'))
+    imgset.save_table(path)
+    loaded = imageset.ImageSet.load_table(path)
+    assert [cap.uuid for cap in loaded.captures] == [cap.uuid for cap in imgset.captures]
+    assert loaded.captures[0].images[0].calibration is imgset.captures[0].images[0].calibration
+
+def test_from_directory_index(files_dir, tmpdir):
+    index = str(tmpdir.join('index.npz'))
+    imgset = imageset.ImageSet.from_directory(files_dir, index=index)
+    assert os.path.isfile(index)
+    loaded = imageset.ImageSet.from_directory(files_dir, index=index)
+    assert [cap.uuid for cap in loaded.captures] == [cap.uuid for cap in imgset.captures]
+    assert loaded.captures[0].utc_time() == imgset.captures[0].utc_time()
+
+def test_refresh_unchanged(files_dir):
+    imgset = imageset.ImageSet.from_directory(files_dir)
+    captures = list(imgset.captures)
+    assert imgset.refresh() == []
+    assert all(cap is old for cap, old in zip(imgset.captures, captures))
+
+def test_find_capture_files(tmp_path):
+    first, second = os.path.join('0000SET', '000'), os.path.join('0000SET', '001')
+    for folder, names in [(first, ['IMG_0000_1.tif', 'IMG_0000_2.tif', 'IMG_0001_1.tif', 'IMG_0001_2.tif']),
+                          (second, ['IMG_0200_1.tif', 'IMG_0201_2.tif', 'diag0.tif'])]:
+        os.makedirs(str(tmp_path / folder))
+        for name in names:
+            (tmp_path / folder / name).write_bytes(b'')
+    capture_files = imageset.find_capture_files(str(tmp_path))
+    assert list(capture_files.keys()) == [(first, 0), (first, 1), (second, 200), (second, 201)]
+    assert capture_files[(first, 1)] == {1: str(tmp_path / first / 'IMG_0001_1.tif'),
+                                         2: str(tmp_path / first / 'IMG_0001_2.tif')}
+    assert imageset.incomplete_captures(capture_files) == {(second, 200): [2], (second, 201): [1]}
+    assert imageset.incomplete_captures(capture_files, band_count=1) == {(second, 201): [1]}
+
+def test_group_by_filename(tmpdir):
+    plan = synthetic.flight_plan(2, panel_captures=0)
+    written = [synthetic.write_capture(str(tmpdir), 'rededge', capture_index=i, entry=entry, downscale=8)
+               for i, entry in enumerate(plan)]
+    imgset = imageset.ImageSet.from_directory(str(tmpdir), group_by_filename=True)
+    assert [[img.path for img in cap.images] for cap in imgset.captures] == \
+           [[img.path for img in images] for images in written]
+    assert not any(img.metadata_loaded() for img in imgset.images())
+    # the metadata is read on first use
+    metadata = dict((img.path, synthetic.exiftool_metadata(img.calibration, img.record,
+                                                           synthetic.CAMERAS['rededge']['software']))
+                    for images in written for img in images)
+    class ExifTool(object):
+        def get_metadata(self, path):
+            return metadata[path]
+    cap = imgset.captures[1]
+    for img in cap.images:
+        img.load_metadata(exiftool_obj=ExifTool())
+    assert cap.uuid == written[1][0].capture_id
+    assert not any(img.metadata_loaded() for img in imgset.captures[0].images)
+    assert imgset.refresh() == []
+    assert imgset.captures[1] is cap
+    # a file rewritten in place rebuilds its capture
+    path = written[1][2].path
+    stat = os.stat(path)
+    os.utime(path, (stat.st_atime, stat.st_mtime + 10))
+    refreshed = imgset.refresh()
+    assert [img.path for img in refreshed] == [img.path for img in written[1]]
+    assert imgset.captures[1] is not cap
+    assert not any(img.metadata_loaded() for img in imgset.captures[1].images)
+
+def test_partition():
+    plan = synthetic.flight_plan(20, panel_captures=2)
+    # a battery change halfway through the flight
+    for entry in plan[10:]:
+        entry['utc_time'] += datetime.timedelta(hours=1)
+    captures = []
+    for i, entry in enumerate(plan):
+        images = []
+        for band in range(5):
+            calibration = synthetic.synthetic_calibration('rededge', band, downscale=8)
+            record = synthetic.synthetic_record(calibration, entry, 'capture{}'.format(i), 'flight')
+            images.append(image.Image.from_records(None, calibration, record))
+        captures.append(capture.Capture(images))
+    imgset = imageset.ImageSet(captures)
+    parts = imgset.partition()
+    assert parts['takeoff'] == captures[:2]
+    assert parts['landing'] == captures[-2:]
+    assert parts['flight'] == captures[2:-2]
+    assert parts['ground'] == captures[:2] + captures[-2:]
+    assert parts['segments'] == [(0, 2, False), (2, 10, True), (10, 18, True), (18, 20, False)]
+    assert parts['ground_altitude'] == pytest.approx(plan[0]['altitude'])
+    assert parts['flight_agl'] == pytest.approx(plan[5]['altitude'] - plan[0]['altitude'])
+    assert imgset.partition(cutoff_altitude=plan[5]['altitude'] + 1)['flight'] == []
+
+def test_partition_without_altitudes():
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        parts = imageset.ImageSet([]).partition()
+        assert parts['ground'] == [] and parts['flight'] == [] and parts['segments'] == []
+        assert np.isnan(parts['ground_altitude']) and np.isnan(parts['flight_agl'])
+
+        entry = synthetic.flight_plan(1, panel_captures=0)[0]
+        calibration = synthetic.synthetic_calibration('rededge', 0, downscale=8)
+        record = synthetic.synthetic_record(calibration, entry, 'capture0', 'flight')
+        record.altitude = None
+        cap = capture.Capture([image.Image.from_records(None, calibration, record)])
+        parts = imageset.ImageSet([cap]).partition()
+        assert parts['ground'] == [cap] and parts['flight'] == []
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Test image alignment utilities
+
+Copyright 2019 MicaSense, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in the
+Software without restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import pytest
+import numpy as np
+import cv2
+
+import micasense.capture as capture
+import micasense.imageutils as imageutils
+import micasense.synthetic as synthetic
+
+def test_texture_score():
+    texture = synthetic.ground_texture(size=256, seed=1)
+    assert imageutils.texture_score(2.0 * texture) == pytest.approx(imageutils.texture_score(texture), rel=1e-5)
+    assert imageutils.texture_score(cv2.GaussianBlur(texture, (0, 0), 4.0)) < imageutils.texture_score(texture)
+    assert imageutils.texture_score(np.full((64, 64), 0.3, dtype=np.float32)) == 0.0
+
+def test_capture_texture_score(tmpdir):
+    cap = capture.Capture(synthetic.write_capture(str(tmpdir), 'altum', downscale=4))
+    assert imageutils.capture_texture_score(cap, factor=4) > 0
+
+def test_combine_warp_matrices():
+    size = (2064, 1544)
+    rng = np.random.RandomState(0)
+    truth = [np.array([[1.001, 0.002, 12.0], [-0.002, 0.999, -7.5], [1e-7, -2e-7, 1.0]]), np.eye(3)]
+    samples = []
+    for _ in range(5):
+        samples.append([warp + np.array([[0, 0, rng.uniform(-0.2, 0.2)], [0, 0, rng.uniform(-0.2, 0.2)], [0, 0, 0]])
+                        for warp in truth])
+    # a featureless capture converged to a shifted solution
+    samples[2][0] = samples[2][0] + np.array([[0, 0, 25.0], [0, 0, 0], [0, 0, 0]])
+    warp_matrices, residuals, inliers = imageutils.combine_warp_matrices(samples, size, max_residual_px=1.0)
+    assert warp_matrices[0].dtype == np.float32
+    for warp, expected in zip(warp_matrices, truth):
+        assert imageutils.warp_residual(warp, expected, size) < 0.3
+    assert inliers[:, 0].tolist() == [True, True, False, True, True]
+    assert inliers[:, 1].all()
+    assert residuals[2, 0] > 20
+
+@pytest.fixture()
+def texture_pair():
+    texture = cv2.GaussianBlur(np.random.RandomState(0).rand(300, 400).astype(np.float32), (0, 0), 3)
+    # a featureless band across the top, like sky or water
+    texture[:60] = texture.mean()
+    warp_matrix = np.array([[1, 0, 2.4], [0, 1, -1.3]], dtype=np.float32)
+    moved = cv2.warpAffine(texture, warp_matrix, (400, 300), borderMode=cv2.BORDER_REFLECT)
+    gradients = [np.absolute(cv2.Sobel(im, cv2.CV_32F, 1, 0)) + np.absolute(cv2.Sobel(im, cv2.CV_32F, 0, 1))
+                 for im in (texture, moved)]
+    return gradients, warp_matrix
+
+def test_texture_window(texture_pair):
+    (grad, _), _ = texture_pair
+    left, top, width, height = imageutils.texture_window(grad, coverage=0.25, tiles=8)
+    assert (width, height) == (200, 150)
+    assert top >= 60
+    mask = imageutils.texture_mask(grad, tiles=10)
+    assert mask.dtype == np.uint8
+    assert (mask[:60] == 0).all() and (mask[60:] == 255).all()
+    assert imageutils.texture_mask(grad[60:]) is None
+
+@pytest.mark.parametrize('warp_mode', [cv2.MOTION_TRANSLATION, cv2.MOTION_AFFINE, cv2.MOTION_HOMOGRAPHY])
+def test_ecc_level_texture_coverage(texture_pair, warp_mode):
+    (grad1, grad2), expected = texture_pair
+    criteria = (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 100, 1e-6)
+    warp_matrix = imageutils.default_warp_matrix(warp_mode)
+    cc, warp_matrix = imageutils.ecc_level(grad1, grad2, warp_matrix, warp_mode, criteria, texture_coverage=0.5)
+    assert cc > 0.9
+    assert warp_matrix.shape == imageutils.default_warp_matrix(warp_mode).shape
+    assert imageutils.warp_residual(warp_matrix, expected, (400, 300)) < 0.2
+
+def test_level_schedule():
+    assert imageutils.level_schedule(2500, 3) == [2500, 2500, 2500]
+    assert imageutils.level_schedule([500, 100], 4) == [500, 100, 100, 100]
+    assert imageutils.level_schedule((1e-6, 1e-7, 1e-8, 1e-9), 2) == [1e-6, 1e-7]
+    with pytest.raises(ValueError):
+        imageutils.level_schedule([], 2)
+
+@pytest.mark.parametrize('warp_mode', [cv2.MOTION_AFFINE, cv2.MOTION_HOMOGRAPHY])
+def test_scale_warp_matrix(warp_mode):
+    warp_matrix = imageutils.default_warp_matrix(warp_mode)
+    warp_matrix[:2, 2] = [1.5, -0.5]
+    if warp_mode == cv2.MOTION_HOMOGRAPHY:
+        warp_matrix[2, :2] = [1e-4, -2e-4]
+    # scaling twice by 2 matches scaling once by 4, as when the finer pyramid levels are skipped
+    twice = imageutils.scale_warp_matrix(imageutils.scale_warp_matrix(warp_matrix, warp_mode, 2), warp_mode, 2)
+    once = imageutils.scale_warp_matrix(warp_matrix, warp_mode, 4)
+    assert once.dtype == np.float32
+    assert np.allclose(twice, once)
+    assert np.allclose(once[:2, 2], [6.0, -2.0])
+
+def test_gradient_shift(texture_pair):
+    (texture, _), _ = texture_pair
+    shifted = cv2.warpAffine(texture, np.array([[1, 0, -1.5], [0, 1, 0.5]], dtype=np.float32), (400, 300),
+                             borderMode=cv2.BORDER_REFLECT)
+    cc, peak_cc, (dx, dy) = imageutils.gradient_shift(texture, texture)
+    assert cc == pytest.approx(1.0) and (dx, dy) == pytest.approx((0, 0), abs=0.01)
+    cc, peak_cc, (dx, dy) = imageutils.gradient_shift(texture, shifted, search=3)
+    assert cc < peak_cc
+    assert (dx, dy) == pytest.approx((-1.5, 0.5), abs=0.25)
+    with pytest.raises(ValueError):
+        imageutils.gradient_shift(texture[:12, :12], shifted[:12, :12])
+
+def test_alignment_quality(tmpdir):
+    cap = capture.Capture(synthetic.write_capture(str(tmpdir), 'altum', downscale=2))
+    # the synthetic bands are offset from each other by their rig relatives
+    offsets = [np.array(synthetic._rig_offset_px(img)) for img in cap.images]
+    warp_matrices = []
+    for offset in offsets:
+        warp_matrix = np.eye(3)
+        warp_matrix[:2, 2] = offset - offsets[1]
+        warp_matrices.append(warp_matrix)
+    quality = cap.alignment_quality(warp_matrices, ref_index=1, factor=4)
+    assert quality[-1] is None
+    for band in quality[:-1]:
+        assert band['cc'] > 0.85
+        assert np.hypot(*band['residual_px']) < 1.0
+    assert not imageutils.needs_realignment(quality, min_cc=0.85)
+
+    warp_matrices[0] = warp_matrices[0] + np.array([[0, 0, 6.0], [0, 0, -3.0], [0, 0, 0]])
+    quality = imageutils.alignment_quality(cap, warp_matrices, ref_index=1, factor=4)
+    assert quality[0]['cc'] < quality[0]['peak_cc']
+    assert quality[0]['residual_px'] == pytest.approx((-6.0, 3.0), abs=1.0)
+    assert imageutils.needs_realignment(quality)
+
+def test_align_converged_px_refines_initial_warp():
+    texture = cv2.GaussianBlur(np.random.RandomState(1).rand(600, 800).astype(np.float32), (0, 0), 4)
+    expected = np.array([[1, 0, 6.4], [0, 1, -3.2], [0, 0, 1]], dtype=np.float32)
+    moved = cv2.warpPerspective(texture, expected, (800, 600), flags=cv2.INTER_LINEAR,
+                                borderMode=cv2.BORDER_REFLECT)
+    # a near-correct initial warp, like the rig relatives, hardly moves at the coarsest level
+    warp_matrix_init = expected + np.array([[0, 0, 0.3], [0, 0, -0.3], [0, 0, 0]], dtype=np.float32)
+    pair = {'warp_mode': cv2.MOTION_HOMOGRAPHY,
+            'max_iterations': 100,
+            'epsilon_threshold': 1e-6,
+            'ref_index': 0,
+            'ref_image': texture,
+            'match_index': 1,
+            'match_image': moved,
+            'translations': (0, 0),
+            'warp_matrix_init': warp_matrix_init,
+            'debug': False,
+            'pyramid_levels': 2,
+            'converged_px': 1.0}
+    result = imageutils.align(pair)
+    assert result['pyramid_level'] >= 1
+    assert imageutils.warp_residual(result['warp_matrix'], expected, (800, 600)) < 0.25
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Test package import time
+
+Copyright 2019 MicaSense, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in the
+Software without restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import pytest
+import os
+import subprocess
+import sys
+
+# modules which are slow to import and only needed by plotting, QR code
+# detection, alignment filters or the sun position computation
+DEFERRED_MODULES = ['matplotlib', 'mpl_toolkits', 'pyzbar', 'skimage', 'pysolar', 'imageio']
+
+def import_times(modules):
+    ''' Import modules in a fresh interpreter with -X importtime and return
+        a {module name: cumulative microseconds} dictionary for everything imported '''
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    cmd = [sys.executable, '-X', 'importtime', '-c', 'import ' + ', '.join(modules)]
+    result = subprocess.run(cmd, cwd=root, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        try:
+            times[name.strip()] = int(cumulative)
+        except ValueError: # header line
+            pass
+    return times
+
+@pytest.mark.parametrize('module', ['micasense.image',
+                                    'micasense.capture',
+                                    'micasense.imageset',
+                                    'micasense.panel',
+                                    'micasense.imageutils',
+                                    'micasense.dls'])
+def test_import_defers_heavy_modules(module):
+    times = import_times([module])
+    assert module in times
+    loaded = [name for name in times if name.split('.')[0] in DEFERRED_MODULES]
+    assert loaded == []
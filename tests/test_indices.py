@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Test spectral index utilities
+
+Copyright 2019 MicaSense, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in the
+Software without restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import pytest
+import numpy as np
+
+import micasense.indices as indices
+
+BAND_NAMES = ['Blue', 'Green', 'Red', 'NIR', 'Red edge']
+
+@pytest.fixture()
+def stack():
+    rng = np.random.RandomState(4)
+    stack = rng.uniform(0.01, 0.8, size=(37, 23, 5)).astype(np.float32)
+    stack[0, 0, :] = 0
+    return stack
+
+def test_ndvi_ndre(stack):
+    out, histograms = indices.normalized_differences(stack, BAND_NAMES, tile_rows=8)
+    nir, red, red_edge = stack[:,:,3], stack[:,:,2], stack[:,:,4]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ndvi = (nir - red) / (nir + red)
+        ndre = (nir - red_edge) / (nir + red_edge)
+    assert out['ndvi'].dtype == np.float32
+    assert np.isnan(out['ndvi'][0, 0])
+    assert out['ndvi'][1:] == pytest.approx(ndvi[1:], abs=1e-6)
+    assert out['ndre'][1:] == pytest.approx(ndre[1:], abs=1e-6)
+    assert histograms == {}
+
+def test_shared_terms(stack):
+    out, _ = indices.normalized_differences(stack, BAND_NAMES, names=('gndvi', 'ndwi'))
+    assert out['ndwi'][1:] == pytest.approx(-out['gndvi'][1:], abs=1e-6)
+
+def test_mask_and_histogram(stack):
+    mask = stack[:,:,3] >= 0.2
+    out, histograms = indices.normalized_differences(stack, BAND_NAMES, names=('ndvi',), mask=mask,
+                                                     fill_value=0, histogram_bins=64, tile_rows=5)
+    assert np.all(out['ndvi'][~mask] == 0)
+    counts, bin_edges = histograms['ndvi']
+    expected, _ = np.histogram(out['ndvi'][mask], bins=bin_edges)
+    assert counts.sum() == mask.sum()
+    assert np.all(counts == expected)
+
+def test_preallocated_output(stack):
+    ndvi = np.zeros(stack.shape[:2], dtype=np.float32)
+    out, _ = indices.normalized_differences(stack, BAND_NAMES, names=('ndvi',), out={'ndvi': ndvi})
+    assert out['ndvi'] is ndvi
+    assert ndvi[5, 5] != 0
+
+def test_missing_band(stack):
+    with pytest.raises(ValueError):
+        indices.normalized_differences(stack[:,:,:3], BAND_NAMES[:3], names=('ndvi',))
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Test the pipeline instrumentation
+
+Copyright 2019 MicaSense, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in the
+Software without restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import pytest
+import numpy as np
+
+import micasense.instrumentation as instrumentation
+
+class Step(object):
+    def __init__(self, capture_id):
+        self.capture_id = capture_id
+
+    @instrumentation.timed('step')
+    def run(self, size):
+        return np.zeros(size, dtype=np.uint8)
+
+@pytest.fixture()
+def instrumented():
+    instrumentation.enable()
+    yield
+    instrumentation.disable()
+    instrumentation.clear()
+
+def test_disabled_records_nothing():
+    instrumentation.clear()
+    assert Step('a').run(10).shape == (10,)
+    with instrumentation.stage('block') as record:
+        assert record is None
+    assert instrumentation.records == []
+
+def test_timed_records(instrumented):
+    Step('a').run(10)
+    Step('b').run(20)
+    assert [r['capture_id'] for r in instrumentation.records] == ['a', 'b']
+    assert [r['bytes'] for r in instrumentation.records] == [10, 20]
+    assert all(r['seconds'] >= 0 for r in instrumentation.records)
+
+def test_report(instrumented):
+    Step('a').run(10)
+    Step('a').run(30)
+    with instrumentation.stage('block', 'b', bytes=5):
+        pass
+    flight_report = instrumentation.report()
+    assert flight_report['stages']['step']['count'] == 2
+    assert flight_report['stages']['step']['bytes'] == 40
+    assert flight_report['stages']['block']['bytes'] == 5
+    assert sorted(flight_report['captures']) == ['a', 'b']
+    assert 'step' in instrumentation.format_report(flight_report)
+
+def test_image_radiance_stage(instrumented, img):
+    img.radiance(force_recompute=True)
+    radiance = [r for r in instrumentation.records if r['stage'] == 'radiance']
+    assert len(radiance) == 1
+    assert radiance[0]['capture_id'] == img.capture_id
+    assert radiance[0]['bytes'] == img.radiance().nbytes
@@ -141,3 +141,23 @@ def test_horizontal_irradiance_valid(meta):
 
 def test_horizontal_irradiance_valid_altum(meta_altum_dls2):
     assert meta_altum_dls2.horizontal_irradiance_valid() == True
+
+def test_band_calibration_is_shared(meta):
+    calibration = metadata.BandCalibration.from_metadata(meta)
+    assert calibration is metadata.BandCalibration.from_metadata(meta)
+    assert calibration.band_name == meta.band_name()
+    assert calibration.vignette_polynomial == pytest.approx(meta.vignette_polynomial())
+
+def test_band_calibration_replace():
+    calibration = metadata.BandCalibration.intern(band_name='Blue', rig_relatives=[0.1, 0.2, 0.0])
+    assert calibration is metadata.BandCalibration.intern(band_name='Blue', rig_relatives=(0.1, 0.2, 0.0))
+    moved = calibration.replace(rig_relatives=[0.0, 0.0, 0.0])
+    assert moved is not calibration
+    assert moved.band_name == 'Blue'
+    assert calibration.rig_relatives == (0.1, 0.2, 0.0)
+
+def test_image_record(meta):
+    record = metadata.ImageRecord.from_metadata(meta)
+    assert record.capture_id == meta.capture_id()
+    assert record.exposure_time == meta.exposure()
+    assert (record.latitude, record.longitude, record.altitude) == meta.position()
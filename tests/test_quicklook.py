@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Test quick-look utilities
+
+Copyright 2019 MicaSense, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in the
+Software without restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import os
+import pytest
+import numpy as np
+import cv2
+
+import micasense.capture as capture
+import micasense.quicklook as quicklook
+
+def test_scaled_warp_matrix():
+    warp = np.array([[1.0, 0.01, 40.0], [-0.01, 1.0, -16.0], [0.0, 0.0, 1.0]])
+    scaled = quicklook.scaled_warp_matrix(warp, 8)
+    point = np.array([800.0, 640.0, 1.0])
+    assert np.dot(scaled, point / [8, 8, 1])[:2] == pytest.approx(np.dot(warp, point)[:2] / 8)
+
+def test_approximate_radiance(img):
+    small = quicklook.approximate_radiance(img, 4)
+    width, height = img.size()
+    assert small.shape == (height // 4, width // 4)
+    full = cv2.resize(img.radiance().astype(np.float32), (width // 4, height // 4), interpolation=cv2.INTER_AREA)
+    assert small == pytest.approx(full, rel=0.01, abs=1e-4 * full.max())
+
+def test_capture_quicklook(non_panel_altum_capture):
+    quicklooks = quicklook.capture_quicklook(non_panel_altum_capture, factor=8)
+    width, height = non_panel_altum_capture.images[0].size()
+    assert sorted(quicklooks) == ['cir', 'ndvi', 'rgb']
+    for rgb in quicklooks.values():
+        assert rgb.shape == (height // 8, width // 8, 3)
+        assert rgb.dtype == np.uint8
+
+def test_flight_quicklooks(file_list, non_panel_rededge_file_list, tmpdir):
+    captures = [capture.Capture.from_filelist(file_list),
+                capture.Capture.from_filelist(non_panel_rededge_file_list)]
+    paths = quicklook.flight_quicklooks(captures, str(tmpdir), processes=2, products=('rgb',))
+    assert len(paths) == 2
+    assert all(os.path.isfile(path) for path in paths)
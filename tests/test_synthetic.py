@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Test the synthetic flight generator
+
+Copyright 2019 MicaSense, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in the
+Software without restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import pytest
+import numpy as np
+import cv2
+
+import micasense.capture as capture
+import micasense.image as image
+import micasense.synthetic as synthetic
+import micasense.utils as utils
+
+class ExifToolRecords(object):
+    ''' Stands in for exiftool with the metadata the generator encoded in each file '''
+    def __init__(self, images, software):
+        self.metadata = dict((img.path, synthetic.exiftool_metadata(img.calibration, img.record, software))
+                             for img in images)
+
+    def get_metadata(self, path):
+        return self.metadata[path]
+
+@pytest.fixture()
+def panel_entry():
+    return synthetic.flight_plan(2, panel_captures=1)[0]
+
+def test_flight_plan():
+    plan = synthetic.flight_plan(10, panel_captures=2)
+    assert len(plan) == 10
+    assert [entry['panel'] for entry in plan] == [True] * 2 + [False] * 6 + [True] * 2
+    times = [entry['utc_time'] for entry in plan]
+    assert times == sorted(times)
+    assert all(entry['altitude'] == 220.0 for entry in plan if not entry['panel'])
+
+def test_write_tiff(tmpdir):
+    images = synthetic.write_capture(str(tmpdir), 'altum', downscale=8)
+    assert len(images) == 6
+    for img in images:
+        assert utils.uncompressed_tiff_layout(img.path) is not None
+        assert np.array_equal(utils.read_raw(img.path), cv2.imread(img.path, -1))
+        assert img.raw().shape == img.calibration.image_size[::-1]
+
+def test_metadata_round_trip(tmpdir, panel_entry):
+    images = synthetic.write_capture(str(tmpdir), 'rededge', entry=panel_entry, downscale=8)
+    exiftool = ExifToolRecords(images, synthetic.CAMERAS['rededge']['software'])
+    for img in images:
+        loaded = image.Image(img.path, exiftool_obj=exiftool)
+        assert loaded.calibration is img.calibration
+        expected = img.record.as_dict()
+        for name, value in loaded.record.as_dict().items():
+            if isinstance(value, float):
+                assert value == pytest.approx(expected[name], rel=1e-6, abs=1e-9)
+            elif name == 'estimated_direct_vector':
+                assert value == pytest.approx(expected[name])
+            elif name == 'panel_region':
+                assert [tuple(corner) for corner in value] == [tuple(corner) for corner in expected[name]]
+            else:
+                assert value == expected[name]
+
+def test_reflectance(tmpdir):
+    images = synthetic.write_capture(str(tmpdir), 'rededge', downscale=4)
+    for img in images:
+        reflectance = img.reflectance(img.horizontal_irradiance)
+        band = img.band_index
+        low, high = sorted((synthetic.SOIL_REFLECTANCE[band], synthetic.VEGETATION_REFLECTANCE[band]))
+        assert low - 0.01 < reflectance.mean() < high + 0.01
+
+def test_panel_irradiance(tmpdir, panel_entry):
+    cap = capture.Capture(synthetic.write_capture(str(tmpdir), 'rededge', entry=panel_entry, downscale=2))
+    assert cap.panels_in_all_expected_images()
+    irradiance = cap.panel_irradiance()
+    expected = [img.horizontal_irradiance for img in cap.images]
+    assert irradiance == pytest.approx(expected, rel=0.01)
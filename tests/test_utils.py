@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Test image processing utilities
+
+Copyright 2019 MicaSense, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in the
+Software without restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import pytest
+import numpy as np
+import cv2
+
+import micasense.utils as utils
+
+@pytest.fixture()
+def raw_pixels():
+    return np.random.RandomState(2).randint(0, 2**16, size=(120, 160)).astype(np.uint16)
+
+def test_read_raw_memmap(raw_pixels, tmpdir):
+    path = str(tmpdir.join('uncompressed.tif'))
+    cv2.imwrite(path, raw_pixels, [cv2.IMWRITE_TIFF_COMPRESSION, 1])
+    offset, shape, dtype = utils.uncompressed_tiff_layout(path)
+    assert shape == raw_pixels.shape
+    assert dtype == np.uint16
+    raw = utils.read_raw(path)
+    assert isinstance(raw, np.memmap)
+    assert not raw.flags.writeable
+    assert np.array_equal(raw, raw_pixels)
+
+def test_read_raw_compressed(raw_pixels, tmpdir):
+    path = str(tmpdir.join('compressed.tif'))
+    cv2.imwrite(path, raw_pixels, [cv2.IMWRITE_TIFF_COMPRESSION, 5]) # LZW
+    assert utils.uncompressed_tiff_layout(path) is None
+    raw = utils.read_raw(path)
+    assert not isinstance(raw, np.memmap)
+    assert np.array_equal(raw, raw_pixels)
+
+def test_read_raw_without_memmap(raw_pixels, tmpdir):
+    path = str(tmpdir.join('uncompressed.tif'))
+    cv2.imwrite(path, raw_pixels, [cv2.IMWRITE_TIFF_COMPRESSION, 1])
+    assert not isinstance(utils.read_raw(path, memmap=False), np.memmap)